@@ -10,12 +10,16 @@
 # SegmentorWidget have a member called "marker" which is the instance of Marker, used for selecting seeds
 #---------------------------------------------------------------------------
 import os
+import sys
+import multiprocessing
 import vtk, qt, ctk, slicer
 import logging
+import numpy as np
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
 from Marker import Marker
 from SegmentorLogic import SegmentorLogic
+from SegmentorProgress import SegmentorProgress
 #---------------------------------------------------------------------------
 
 widgetForTest = None
@@ -185,6 +189,141 @@ class SegmentorWidget(ScriptedLoadableModuleWidget,VTKObservationMixin):
     self.enableAutoSegmentCheckBox.setToolTip("If checked, automatically do segmentation after marking.")
     parametersFormLayout.addRow("Auto Segment After Marking", self.enableAutoSegmentCheckBox)
 
+    #
+    #If checked, also write the input volume with the ROI highlighted to a "_processed" volume.
+    #
+    self.enableProcessedVolumeCheckBox = qt.QCheckBox()
+    self.enableProcessedVolumeCheckBox.checked = 0
+    self.enableProcessedVolumeCheckBox.enabled = True
+    self.enableProcessedVolumeCheckBox.setToolTip("If checked, also write a copy of the input volume with the ROI highlighted (uses as much memory as the input volume), otherwise only the label is written.")
+    parametersFormLayout.addRow("Create Processed Volume", self.enableProcessedVolumeCheckBox)
+
+    #
+    #If checked, smooth the segmentation by 3D morphological operations instead of slice by slice.
+    #
+    self.enableMorphology3dCheckBox = qt.QCheckBox()
+    self.enableMorphology3dCheckBox.checked = 0
+    self.enableMorphology3dCheckBox.enabled = True
+    self.enableMorphology3dCheckBox.setToolTip("If checked, smooth the segmentation by 3D morphological operations instead of slice by slice.")
+    parametersFormLayout.addRow("3D Morphology", self.enableMorphology3dCheckBox)
+
+    #
+    # incremental segmentation, a new marking only grows from the new seeds into the last result
+    #
+    self.enableIncrementalCheckBox = qt.QCheckBox()
+    self.enableIncrementalCheckBox.checked = 0
+    self.enableIncrementalCheckBox.enabled = True
+    self.enableIncrementalCheckBox.setToolTip("If checked, a new marking extends the last segmentation instead of segmenting again from scratch.")
+    parametersFormLayout.addRow("Incremental Segmentation", self.enableIncrementalCheckBox)
+
+    #
+    # multi-label segmentation, each label value of the seeding label is a separate region
+    #
+    self.enableMultiLabelCheckBox = qt.QCheckBox()
+    self.enableMultiLabelCheckBox.checked = 0
+    self.enableMultiLabelCheckBox.enabled = True
+    self.enableMultiLabelCheckBox.setToolTip("If checked, each label value of the seeding label (painted with the Editor) is segmented as a separate region, all in one pass.")
+    parametersFormLayout.addRow("Multi-label Segmentation", self.enableMultiLabelCheckBox)
+
+    #
+    # grow from all the marked voxels, the growth follows its front and stops with it
+    #
+    self.enableSeedFrontCheckBox = qt.QCheckBox()
+    self.enableSeedFrontCheckBox.checked = 0
+    self.enableSeedFrontCheckBox.enabled = True
+    self.enableSeedFrontCheckBox.setToolTip("If checked, the growth starts from all the marked voxels and stops when its front stops, otherwise it grows in cubes around the brightest marked voxel up to the border of the volume.")
+    parametersFormLayout.addRow("Grow From All Seeds", self.enableSeedFrontCheckBox)
+
+    #
+    # estimate the intensity range in the histogram of the volume, kept between the segmentations
+    #
+    self.enableVolumeHistogramCheckBox = qt.QCheckBox()
+    self.enableVolumeHistogramCheckBox.checked = 0
+    self.enableVolumeHistogramCheckBox.enabled = True
+    self.enableVolumeHistogramCheckBox.setToolTip("If checked, the intensity range is taken from the marked voxels counted in the histogram of the volume (computed once per volume), so a few outlier voxels do not widen it.")
+    parametersFormLayout.addRow("Volume Histogram Range", self.enableVolumeHistogramCheckBox)
+
+    #
+    # number of threads used to refine the slices of the segmentation, default is the number of CPUs (at most 8)
+    #
+    self.refineWorkersSlider = ctk.ctkSliderWidget()
+    self.refineWorkersSlider.singleStep = 1
+    self.refineWorkersSlider.decimals = 0
+    self.refineWorkersSlider.minimum = 1
+    self.refineWorkersSlider.maximum = 16
+    self.refineWorkersSlider.value = min(multiprocessing.cpu_count(), 8)
+    self.refineWorkersSlider.setToolTip("Number of threads used to refine the slices of the segmentation.")
+    parametersFormLayout.addRow("Refinement Threads", self.refineWorkersSlider)
+
+    #
+    # the growth does not go farther than this from the seed point, in mm
+    #
+    self.maxRadiusSlider = ctk.ctkSliderWidget()
+    self.maxRadiusSlider.singleStep = 1
+    self.maxRadiusSlider.decimals = 0
+    self.maxRadiusSlider.minimum = 0
+    self.maxRadiusSlider.maximum = 500
+    self.maxRadiusSlider.value = 0
+    self.maxRadiusSlider.setToolTip("Maximum distance (mm) of the segmentation from the marked seed point (0: no limit), stops the leaks along vessels.")
+    parametersFormLayout.addRow("Max Radius (mm)", self.maxRadiusSlider)
+
+    #
+    # the growth stops at the edges of the volume, where the gradient is this times the gradient of the marked voxels
+    #
+    self.edgeStopSlider = ctk.ctkSliderWidget()
+    self.edgeStopSlider.singleStep = 0.5
+    self.edgeStopSlider.decimals = 1
+    self.edgeStopSlider.minimum = 0
+    self.edgeStopSlider.maximum = 10
+    self.edgeStopSlider.value = 0
+    self.edgeStopSlider.setToolTip("Stops the segmentation at the edges of the volume, where the intensity changes this times faster than within the marked voxels (0: no edge stop), stops the leaks through weak edges.")
+    parametersFormLayout.addRow("Edge Stop", self.edgeStopSlider)
+
+    #
+    # coarse-to-fine growth, the levels of the resolution halved before the growth at the full resolution
+    #
+    self.pyramidLevelsSlider = ctk.ctkSliderWidget()
+    self.pyramidLevelsSlider.singleStep = 1
+    self.pyramidLevelsSlider.decimals = 0
+    self.pyramidLevelsSlider.minimum = 0
+    self.pyramidLevelsSlider.maximum = 3
+    self.pyramidLevelsSlider.value = 0
+    self.pyramidLevelsSlider.setToolTip("Grows the segmentation at a resolution halved this number of times first, then refines its boundary at the full resolution (0: full resolution only), faster on big lesions of high resolution volumes. Not used by the multi-label segmentation.")
+    parametersFormLayout.addRow("Coarse-to-fine Levels", self.pyramidLevelsSlider)
+
+    #
+    # time and voxel budget of the growth, the growth stops and keeps what it has grown when one is used up
+    #
+    self.timeBudgetSlider = ctk.ctkSliderWidget()
+    self.timeBudgetSlider.singleStep = 1
+    self.timeBudgetSlider.decimals = 0
+    self.timeBudgetSlider.minimum = 0
+    self.timeBudgetSlider.maximum = 300
+    self.timeBudgetSlider.value = 0
+    self.timeBudgetSlider.setToolTip("Seconds the growth may run (0: no limit), the region grown so far is kept when it is used up.")
+    parametersFormLayout.addRow("Time Budget (s)", self.timeBudgetSlider)
+
+    self.voxelBudgetSlider = ctk.ctkSliderWidget()
+    self.voxelBudgetSlider.singleStep = 1
+    self.voxelBudgetSlider.decimals = 0
+    self.voxelBudgetSlider.minimum = 0
+    self.voxelBudgetSlider.maximum = 1000
+    self.voxelBudgetSlider.value = 0
+    self.voxelBudgetSlider.setToolTip("Millions of voxels the growth may visit (0: no limit), the region grown so far is kept when it is used up.")
+    parametersFormLayout.addRow("Voxel Budget (M)", self.voxelBudgetSlider)
+
+    #
+    # number of previous results kept (compactly) for undo
+    #
+    self.undoStepsSlider = ctk.ctkSliderWidget()
+    self.undoStepsSlider.singleStep = 1
+    self.undoStepsSlider.decimals = 0
+    self.undoStepsSlider.minimum = 1
+    self.undoStepsSlider.maximum = 50
+    self.undoStepsSlider.value = 10
+    self.undoStepsSlider.setToolTip("Number of previous segmentation results kept for undo.")
+    parametersFormLayout.addRow("Undo Steps", self.undoStepsSlider)
+
     
     #
     # Apply Button, for manual operation
@@ -194,11 +333,32 @@ class SegmentorWidget(ScriptedLoadableModuleWidget,VTKObservationMixin):
     self.applyButton.enabled = False #unabled by default, this button will enable after uncheck Auto Mode
     parametersFormLayout.addRow(self.applyButton)
 
+    #
+    # Undo Button, restores the previous segmentation result
+    #
+    self.undoButton = qt.QPushButton("Undo")
+    self.undoButton.toolTip = "Restore the previous segmentation result."
+    parametersFormLayout.addRow(self.undoButton)
+
+    #
+    # progress of the running segmentation, which can be cancelled
+    #
+    self.progressBar = qt.QProgressBar()
+    self.progressBar.minimum = 0
+    self.progressBar.maximum = 100
+    self.progressBar.hide()
+    self.cancelButton = qt.QPushButton("Cancel")
+    self.cancelButton.toolTip = "Cancel the running segmentation."
+    self.cancelButton.enabled = False
+    parametersFormLayout.addRow(self.progressBar, self.cancelButton)
+
 
     # connections, process the event from UI
 
 	
     self.applyButton.connect('clicked(bool)', self.onApplyButton)
+    self.cancelButton.connect('clicked(bool)', self.onCancelButton)
+    self.undoButton.connect('clicked(bool)', self.onUndoButton)
     self.enableFullAutoCheckBox.connect('clicked(bool)', self.onFullAutoClicked)
     self.enableAutoSegmentCheckBox.connect('clicked(bool)', self.onAutoSegmentClicked)
     self.inputSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onSelect)
@@ -258,6 +418,7 @@ class SegmentorWidget(ScriptedLoadableModuleWidget,VTKObservationMixin):
   #
   def onSceneClose(self, caller=None, event=None):
       print "onSceneClose"
+      self.logic.cancel()
       self.marker.dropListen()
       self.marker1.dropListen()
       self.marker2.dropListen()
@@ -383,7 +544,55 @@ class SegmentorWidget(ScriptedLoadableModuleWidget,VTKObservationMixin):
     paintSize = self.paintSizeSlider.value
     compensateIntensity = self.compensateIntensitySlider.value
     smoothValue = self.smoothValueSlider.value
-    self.logic.run(self.inputSelector.currentNode(), self.seedingSelector.currentNode(), paintSize, auto_model or full_auto, compensateIntensity,self.labelNumber ,smoothValue)
+    processedVolume = self.enableProcessedVolumeCheckBox.checked
+    morphology3d = self.enableMorphology3dCheckBox.checked
+    refineWorkers = int(self.refineWorkersSlider.value)
+    incremental = self.enableIncrementalCheckBox.checked
+    multiLabel = self.enableMultiLabelCheckBox.checked
+    seedFront = self.enableSeedFrontCheckBox.checked
+    maxRadius = self.maxRadiusSlider.value or None
+    volumeHistogram = 256 if self.enableVolumeHistogramCheckBox.checked else 0
+    edgeStop = self.edgeStopSlider.value or None
+    pyramidLevels = int(self.pyramidLevelsSlider.value)
+    # the data derived from the volumes are kept up to this size (MB), if set in the settings
+    cacheSize = qt.QSettings().value('Segmentor/CacheMB')
+    if cacheSize:
+      self.logic.getVolumeCache().maxBytes = int(cacheSize) * 1024 * 1024
+    # the stages of each segmentation are appended to this JSON trace file, if set in the settings
+    traceFile = qt.QSettings().value('Segmentor/TraceFile') or None
+    # and the peak allocation of each stage is traced, if set in the settings (slows the segmentation down)
+    traceMemory = qt.QSettings().value('Segmentor/TraceMemory') in (True, 'true', '1')
+    progress = SegmentorProgress(timeBudget = self.timeBudgetSlider.value or None,
+                                 voxelBudget = self.voxelBudgetSlider.value * 1000000 or None)
+    # the segmentation runs in the background, the progress is shown until it finishes
+    self.progressBar.value = 0
+    self.progressBar.show()
+    self.cancelButton.enabled = True
+    if not self.logic.run(self.inputSelector.currentNode(), self.seedingSelector.currentNode(), paintSize, auto_model or full_auto, compensateIntensity,self.labelNumber ,smoothValue, processedVolume, morphology3d, refineWorkers, traceFile,
+                          progress, True, self.onProgress, self.onFinished, incremental, int(self.undoStepsSlider.value), multiLabel, seedFront, maxRadius, volumeHistogram, edgeStop, pyramidLevels,
+                          traceMemory):
+      self.onFinished(False)
+
+  #
+  #progress of the running segmentation
+  #
+  def onProgress(self, stage, fraction):
+    self.progressBar.setFormat(stage + " %p%")
+    self.progressBar.value = int(100 * fraction)
+
+  #
+  #the segmentation finished, was cancelled or failed
+  #
+  def onFinished(self, success):
+    self.progressBar.hide()
+    self.cancelButton.enabled = False
+
+  def onCancelButton(self):
+    self.logic.cancel()
+
+  def onUndoButton(self):
+    if not self.logic.undo():
+      slicer.util.showStatusMessage("Nothing to undo", 2000)
 
 
 
@@ -403,6 +612,51 @@ class SegmentorTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test()
+    self.setUp()
+    self.test_undoWhileRunning()
+
+  #
+  #a scalar volume node holding a numpy array (KJI order, int16 or uint8)
+  #
+  def makeVolume(self, name, array):
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(array.shape[::-1])
+    imageData.AllocateScalars(vtk.VTK_SHORT if array.dtype == np.int16 else vtk.VTK_UNSIGNED_CHAR, 1)
+    node = slicer.vtkMRMLScalarVolumeNode()
+    node.SetName(name)
+    node.SetAndObserveImageData(imageData)
+    slicer.mrmlScene.AddNode(node)
+    slicer.util.array(node.GetID())[...] = array
+    imageData.Modified()
+    return node
+
+  #
+  #Undo clicked while a segmentation runs only undoes this segmentation
+  #
+  def test_undoWhileRunning(self):
+    self.delayDisplay("Testing undo while a segmentation runs")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Testing', 'Python'))
+    from SegmentorBenchmark import makePhantom
+    volumeData, seedsData, center = makePhantom(64, 12, 5.0)
+    volume = self.makeVolume('phantom', volumeData)
+    seeds = self.makeVolume('phantom-label', seedsData)
+    logic = SegmentorLogic()
+    def run(compensateIntensity, background = False):
+      self.assertTrue(logic.run(volume, seeds, 1, False, compensateIntensity, 1, 50, progress = SegmentorProgress(), background = background))
+      return slicer.util.array(seeds.GetName() + '_grow')
+
+    # the first run creates the output label, the second one keeps the first result for undo
+    first = np.array(run(11))
+    second = np.array(run(0))
+    self.assertFalse((first == second).all())
+    # undo while the third run is running: the label is the second result, whether the run was cancelled or had finished
+    output = run(11, background = True)
+    self.assertTrue(logic.undo())
+    self.assertTrue((output == second).all())
+    self.assertTrue(logic.undo())
+    self.assertTrue((output == first).all())
+    self.assertFalse(logic.undo())
+    self.delayDisplay('Undo while running passed!')
 
   def test(self):
 
@@ -434,6 +688,7 @@ class SegmentorTest(ScriptedLoadableModuleTest):
         self.delayDisplay('Testing applying paint effect!')
         #apply the painted label for segmentation
         widgetForTest.onApplyButton()
+        widgetForTest.logic.wait()
         self.delayDisplay('Testing segmentation!')
 
 #---------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,231 @@
+﻿# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# Batch segmentation from the command line, without 3D slicer:
+#
+#   python SegmentorBatch.py --input volumes/ --output labels/ --workers 8
+#
+# every volume of the input directory is segmented from its seeds (findCases), the labels and a
+# JSON report (report.jsonl) are written as the cases finish, see --help for the options
+#---------------------------------------------------------------------------
+from __future__ import print_function
+
+import os
+import sys
+import time
+import json
+import logging
+import argparse
+import multiprocessing
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from SegmentorIO import SegmentorIO
+from SegmentorCore import SegmentorCore
+from SegmentorRange import SegmentorHistogram
+from SegmentorProgress import SegmentorProgress
+from SegmentorProfile import SegmentorProfile
+
+SEEDS_SUFFIX = '_seeds'
+LABEL_SUFFIX = '_label'
+MASK_SUFFIX = '_mask.npz'
+REPORT_NAME = 'report.jsonl'
+
+#
+#the cases of the input directory: (case, volume path, seeds path or None, extension), every NRRD/NIfTI
+#volume "<case>.<ext>" with its seeds "<case>_seeds.<ext>" (a seeding label) or "<case>_seeds.csv" (seed
+#points, one "i,j,k" voxel index per row, optionally followed by a label) of the seeds directory
+#
+def findCases(inputDirectory, seedsDirectory):
+  io = SegmentorIO()
+  extensions = io.NRRD_EXTENSIONS + io.NIFTI_EXTENSIONS + ('.csv',)
+  cases = []
+  for name in sorted(os.listdir(inputDirectory)):
+    extension = io.volumeExtension(name)
+    if extension is None:
+      continue
+    case = name[:-len(extension)]
+    if case.endswith(SEEDS_SUFFIX) or case.endswith(LABEL_SUFFIX):
+      continue
+    seeds = None
+    for seedsExtension in (extension,) + extensions:
+      path = os.path.join(seedsDirectory, case + SEEDS_SUFFIX + seedsExtension)
+      if os.path.exists(path):
+        seeds = path
+        break
+    cases.append((case, os.path.join(inputDirectory, name), seeds, extension))
+  return cases
+
+#
+#limit the address space of a worker process (MB), a case exceeding it fails with MemoryError
+#
+def initWorker(maxMemory):
+  if not maxMemory:
+    return
+  try:
+    import resource
+    limit = int(maxMemory) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+  except (ImportError, ValueError) as e:
+    logging.warning("cannot limit the memory of the worker: %s", e)
+
+#
+#segment one case in a worker process, returns the record of the report (timing and throughput),
+#the label is written to "<output>/<case>_label.<ext>", and with masks a run-length encoded copy
+#to "<output>/<case>_mask.npz"
+#
+def segmentCase(job):
+  record = {'case': job['case'], 'volume': job['volume'], 'seeds': job['seeds'], 'output': job['output']}
+  start = time.time()
+  try:
+    io = SegmentorIO()
+    inputVolumeData, spacing, header = io.readVolume(job['volume'], job['mmap'])
+    if job['seeds'].lower().endswith('.csv'):
+      seedingROIData = io.readSeedPoints(job['seeds'], inputVolumeData.shape, job['seedRadius'])
+    else:
+      seedingROIData = io.readVolume(job['seeds'], job['mmap'])[0]
+    read = time.time()
+
+    core = SegmentorCore(job['compensateIntensity'], job['morphology3d'], job['refineWorkers'],
+                         memoryLimit = job['memoryLimit'], scratchDirectory = job['scratch'],
+                         progress = SegmentorProgress(timeBudget = job['timeBudget'], voxelBudget = job['voxelBudget']),
+                         multiLabel = job['multiLabel'], seedFront = job['seedFront'], maxRadius = job['maxRadius'],
+                         edgeStop = job['edgeStop'], pyramidLevels = job['pyramidLevels'],
+                         anisotropy = job['anisotropy'], profile = SegmentorProfile(traceMemory = job['traceMemory']))
+    core.intensityRange.bins = job['rangeBins']
+    core.intensityRange.tailFraction = job['tailFraction']
+    if job['volumeHistogram']:
+      with core.profile.stage('histogram'):
+        core.intensityRange.histogram = SegmentorHistogram(inputVolumeData, job['volumeHistogram'])
+    outputROIData = core.allocate(inputVolumeData.shape, np.uint8)
+    core.segment(inputVolumeData, seedingROIData, spacing, outputROIData)
+    segmented = time.time()
+
+    io.writeLabel(job['output'], outputROIData, header)
+    if job['mask']:
+      record['maskBytes'] = io.writeMask(job['mask'], outputROIData).nbytes()
+    written = time.time()
+
+    window = core.window.slices()
+    record.update({
+      'status': 'done',
+      'shape': list(inputVolumeData.shape),
+      'spacing': list(spacing),
+      'voxels': int(inputVolumeData.size),
+      'windowVoxels': int(outputROIData[window].size),
+      'labelVoxels': int(np.count_nonzero(outputROIData[window])),
+      'memoryMapped': isinstance(inputVolumeData, np.memmap),
+      'stopped': core.grow.stopped,
+      'labels': core.labels,
+      'stages': core.profile.result()['stages'],
+      'readSeconds': read - start,
+      'segmentSeconds': segmented - read,
+      'writeSeconds': written - segmented,
+      'voxelsPerSecond': inputVolumeData.size / max(segmented - read, 1e-9),
+    })
+  except MemoryError:
+    record.update({'status': 'failed', 'error': 'out of memory'})
+  except Exception as e:
+    record.update({'status': 'failed', 'error': '%s: %s' % (type(e).__name__, e)})
+  record['seconds'] = time.time() - start
+  return record
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description = 'OneClickCut batch segmentation of a directory of NRRD/NIfTI volumes.')
+  parser.add_argument('--input', required = True, help = 'directory of the volumes')
+  parser.add_argument('--output', required = True, help = 'directory of the labels and the report')
+  parser.add_argument('--seeds', default = None, help = 'directory of the seeds (default: the input directory)')
+  parser.add_argument('--workers', type = int, default = multiprocessing.cpu_count(), help = 'number of worker processes')
+  parser.add_argument('--max-memory', type = int, default = 0,
+                      help = 'address space limit of a worker process in MB, includes the memory-mapped files (0: no limit)')
+  parser.add_argument('--mmap', action = 'store_true', help = 'memory-map the raw NRRD and uncompressed NIfTI volumes')
+  parser.add_argument('--memory-limit', type = int, default = 0,
+                      help = 'work arrays bigger than this (MB) are memory-mapped scratch files (0: no limit), '
+                             'the edge gradient, the coarse-to-fine masks and the temporaries of the growth of the '
+                             'working window stay in memory, so the peak memory is higher')
+  parser.add_argument('--scratch', default = None, help = 'directory of the scratch files (default: the system temporary directory)')
+  parser.add_argument('--compensate', type = float, default = 11, help = 'compensate intensity of the grow-cut')
+  parser.add_argument('--morphology3d', action = 'store_true', help = 'smooth the labels by 3D morphology')
+  parser.add_argument('--refine-workers', type = int, default = 1, help = 'refinement threads of each worker process')
+  parser.add_argument('--time-budget', type = float, default = 0, help = 'seconds the growth of a case may run (0: no limit)')
+  parser.add_argument('--voxel-budget', type = int, default = 0, help = 'voxels the growth of a case may visit (0: no limit)')
+  parser.add_argument('--multi-label', action = 'store_true', help = 'grow each label value of the seeds as a separate region')
+  parser.add_argument('--seed-front', action = 'store_true', help = 'grow from all the seed voxels instead of the shells around the brightest one')
+  parser.add_argument('--max-radius', type = float, default = 0, help = 'mm around the seed point the growth may reach (0: no limit)')
+  parser.add_argument('--range-bins', type = int, default = 10, help = 'bins of the histogram of the seed values')
+  parser.add_argument('--tail-fraction', type = float, default = 0.05, help = 'fraction of the seed values a bin must hold to be in the range (volume histogram: of each tail)')
+  parser.add_argument('--volume-histogram', type = int, default = 0,
+                      help = 'bins of the volume histogram the seeds are counted in (0: bins over the seed values)')
+  parser.add_argument('--edge-stop', type = float, default = 0,
+                      help = 'stop the growth where the gradient is above this times the gradient of the seeds (0: no edge stop)')
+  parser.add_argument('--pyramid', type = int, default = 0,
+                      help = 'levels of the coarse-to-fine growth, the resolution is halved at each level (0: full resolution only), '
+                             'not used with --multi-label')
+  parser.add_argument('--anisotropy', type = float, default = 3.0,
+                      help = 'grow and refine in mm (shells, kernels, native slices) the volumes whose largest spacing is this times the smallest one (0: never)')
+  parser.add_argument('--seed-radius', type = int, default = 2, help = 'radius (voxels) of the ball marked around a seed point')
+  parser.add_argument('--masks', action = 'store_true', help = 'also write the labels as run-length encoded masks (.npz)')
+  parser.add_argument('--overwrite', action = 'store_true', help = 'segment again the cases which already have a label')
+  parser.add_argument('--trace-memory', action = 'store_true', help = 'trace the peak allocation of each stage (python 3, slower)')
+  parser.add_argument('--verbose', action = 'store_true', help = 'log the progress of the segmentation')
+  args = parser.parse_args(argv)
+
+  logging.basicConfig(level = logging.INFO if args.verbose else logging.WARNING)
+  if not os.path.isdir(args.output):
+    os.makedirs(args.output)
+
+  jobs = []
+  skipped = 0
+  for case, volume, seeds, extension in findCases(args.input, args.seeds or args.input):
+    output = os.path.join(args.output, case + LABEL_SUFFIX + extension)
+    if seeds is None:
+      logging.warning("%s: no seeds found, skipped", case)
+      skipped = skipped + 1
+      continue
+    #resume, the labels are renamed into place only when complete
+    if os.path.exists(output) and not args.overwrite:
+      skipped = skipped + 1
+      continue
+    jobs.append({'case': case, 'volume': volume, 'seeds': seeds, 'output': output,
+                 'compensateIntensity': args.compensate, 'morphology3d': args.morphology3d,
+                 'refineWorkers': args.refine_workers, 'seedRadius': args.seed_radius, 'mmap': args.mmap,
+                 'memoryLimit': args.memory_limit * 1024 * 1024 if args.memory_limit else None, 'scratch': args.scratch,
+                 'timeBudget': args.time_budget or None, 'voxelBudget': args.voxel_budget or None, 'multiLabel': args.multi_label,
+                 'seedFront': args.seed_front, 'maxRadius': args.max_radius or None,
+                 'rangeBins': args.range_bins, 'tailFraction': args.tail_fraction, 'volumeHistogram': args.volume_histogram,
+                 'edgeStop': args.edge_stop or None, 'pyramidLevels': args.pyramid,
+                 'anisotropy': args.anisotropy or None, 'traceMemory': args.trace_memory,
+                 'mask': os.path.join(args.output, case + MASK_SUFFIX) if args.masks else None})
+  print('%d cases to segment, %d skipped' % (len(jobs), skipped))
+  if not jobs:
+    return 0
+
+  start = time.time()
+  failed = 0
+  # a fresh process for each case, so the memory of a case is returned to the system
+  pool = multiprocessing.Pool(max(args.workers, 1), initWorker, (args.max_memory,), maxtasksperchild = 1)
+  try:
+    with open(os.path.join(args.output, REPORT_NAME), 'a') as report:
+      for record in pool.imap_unordered(segmentCase, jobs):
+        report.write(json.dumps(record, sort_keys = True) + '\n')
+        report.flush()
+        if record['status'] == 'done':
+          print('%-32s done   %8.2f s  %12.0f voxels/s  %10d label voxels' % \
+                (record['case'], record['seconds'], record['voxelsPerSecond'], record['labelVoxels']))
+        else:
+          failed = failed + 1
+          print('%-32s failed %8.2f s  %s' % (record['case'], record['seconds'], record['error']))
+  finally:
+    pool.close()
+    pool.join()
+
+  elapsed = time.time() - start
+  print('%d done, %d failed in %.1f s (%.1f cases/hour)' % \
+        (len(jobs) - failed, failed, elapsed, 3600.0 * len(jobs) / max(elapsed, 1e-9)))
+  return 1 if failed else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
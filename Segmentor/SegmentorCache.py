@@ -0,0 +1,175 @@
+# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# Cache of the data derived from a volume (histogram, smoothed copy, gradient magnitude,
+# intensities normalized to uint8/uint16), kept between the clicks on the same volume
+#---------------------------------------------------------------------------
+
+import logging
+import threading
+import collections
+import numpy as np
+from SegmentorRange import SegmentorHistogram
+
+#
+#bytes used by a cached value, an array or an object with nbytes()
+#
+def valueBytes(value):
+  nbytes = getattr(value, 'nbytes', 0)
+  return int(nbytes() if callable(nbytes) else nbytes)
+
+#
+#the volume smoothed by a [1, 2, 1] / 4 kernel along each axis (float32), the borders are replicated
+#
+def smoothVolume(volume):
+  smoothed = np.array(volume, np.float32)
+  for axis in range(smoothed.ndim):
+    if smoothed.shape[axis] < 2:
+      continue
+    # the axis is the first one of a view of the volume
+    line = np.moveaxis(smoothed, axis, 0)
+    filtered = line * np.float32(0.5)
+    filtered[1:] += line[:-1] * np.float32(0.25)
+    filtered[:-1] += line[1:] * np.float32(0.25)
+    filtered[0] += line[0] * np.float32(0.25)
+    filtered[-1] += line[-1] * np.float32(0.25)
+    line[...] = filtered
+  return smoothed
+
+#
+#the gradient magnitude (intensity per mm, float32) of a volume, spacing is the size of the voxels
+#(mm) along the axes of the array
+#
+def gradientMagnitude(volume, spacing = (1.0, 1.0, 1.0)):
+  volume = np.asarray(volume, np.float32)
+  magnitude = np.zeros(volume.shape, np.float32)
+  for axis in range(volume.ndim):
+    if volume.shape[axis] < 2:
+      continue
+    derivative = np.gradient(volume, float(spacing[axis]), axis = axis)
+    magnitude += derivative * derivative
+  return np.sqrt(magnitude, out = magnitude)
+
+#
+#the intensities of a volume scaled from [low, high] to the range of an unsigned integer type
+#
+def normalizeVolume(volume, low, high, dtype = np.uint8):
+  top = np.iinfo(dtype).max
+  scale = top / max(float(high) - float(low), 1e-9)
+  normalized = (np.asarray(volume, np.float32) - np.float32(low)) * np.float32(scale)
+  return np.clip(normalized, 0, top, out = normalized).astype(dtype)
+
+#---------------------------------------------------------------------------
+#
+# SegmentorCache, an entry is keyed by the volume key, (node ID, modification time) in slicer, and the name
+# (with the parameters) of the data, a volume key with the same ID and another time replaces the entries of
+# the older one, so the entries of a modified volume are dropped at once, the least recently used entries are
+# evicted when the entries need more than maxBytes:
+#
+#   cache = SegmentorCache(maxBytes = 1024 * 1024 * 1024)
+#   key = (node.GetID(), node.GetImageData().GetMTime())
+#   histogram = cache.histogram(key, volume)
+#   gradient = cache.gradient(key, volume, spacing)
+#
+class SegmentorCache:
+
+  def __init__(self, maxBytes = 1024 * 1024 * 1024):
+    self.maxBytes = maxBytes
+    # (volume key, name) -> (value, bytes), the least recently used first
+    self.entries = collections.OrderedDict()
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    # the entries are computed and used by the segmentation thread too
+    self.lock = threading.RLock()
+
+  #
+  #the cached value of a volume, computed by compute() if it is not cached (the arrays are read-only),
+  #a value bigger than maxBytes is returned but not kept
+  #
+  def get(self, key, name, compute):
+    with self.lock:
+      entry = self.entries.pop((key, name), None)
+      if entry is not None:
+        self.entries[(key, name)] = entry
+        self.hits = self.hits + 1
+        return entry[0]
+      self.misses = self.misses + 1
+      # the entries of an older version of the volume are stale
+      self.invalidate(key[0], key)
+      value = compute()
+      # the arrays are shared by the callers
+      if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+      size = valueBytes(value)
+      if size <= self.maxBytes:
+        self.entries[(key, name)] = (value, size)
+        self.bytes = self.bytes + size
+        self.evict()
+      return value
+
+  #
+  #drop the least recently used entries until they fit into maxBytes
+  #
+  def evict(self):
+    with self.lock:
+      while self.bytes > self.maxBytes and self.entries:
+        (key, name), (value, size) = self.entries.popitem(last = False)
+        self.bytes = self.bytes - size
+        self.evictions = self.evictions + 1
+        logging.debug("cache evicted %s %s (%d bytes)", key, name, size)
+
+  #
+  #drop the entries of a volume (its ID, the first item of its keys), except the ones of the key keep
+  #
+  def invalidate(self, volumeID, keep = None):
+    with self.lock:
+      for key, name in list(self.entries):
+        if key[0] == volumeID and key != keep:
+          value, size = self.entries.pop((key, name))
+          self.bytes = self.bytes - size
+
+  #
+  #drop all the entries
+  #
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.bytes = 0
+
+  #
+  #the histogram of the volume (SegmentorHistogram)
+  #
+  def histogram(self, key, volume, bins = 256):
+    return self.get(key, ('histogram', bins), lambda: SegmentorHistogram(volume, bins))
+
+  #
+  #the volume smoothed by smoothVolume (float32)
+  #
+  def smoothed(self, key, volume):
+    return self.get(key, 'smoothed', lambda: smoothVolume(volume))
+
+  #
+  #the gradient magnitude of the smoothed volume (float32)
+  #
+  def gradient(self, key, volume, spacing = (1.0, 1.0, 1.0)):
+    spacing = tuple(float(s) for s in spacing)
+    return self.get(key, ('gradient', spacing), lambda: gradientMagnitude(self.smoothed(key, volume), spacing))
+
+  #
+  #the intensities of the volume scaled from its min and max to uint8 or uint16
+  #
+  def normalized(self, key, volume, dtype = np.uint8):
+    histogram = self.histogram(key, volume)
+    return self.get(key, ('normalized', np.dtype(dtype).name), lambda: normalizeVolume(volume, histogram.low, histogram.high, dtype))
+
+  #
+  #the statistics of the cache
+  #
+  def result(self):
+    with self.lock:
+      return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
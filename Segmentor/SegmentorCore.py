@@ -0,0 +1,608 @@
+﻿# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# The segmentation core of OneClickCut, without 3D slicer: the volume and the seeding label are
+# numpy arrays (in the order of slicer.util.array), SegmentorLogic.run is a thin adapter for the MRML nodes
+#
+#   core = SegmentorCore(compensateIntensity = 11)
+#   label = core.segment(volume, seeds, spacing = (1.0, 0.7, 0.7))
+#---------------------------------------------------------------------------
+
+import logging
+import tempfile
+import numpy as np
+from SegmentorGrow import SegmentorGrow, SegmentorRegionGrow, SegmentorWindow, shellScale
+from SegmentorRefine import SegmentorRefine
+from SegmentorProfile import SegmentorProfile
+from SegmentorMask import SegmentorMask
+from SegmentorRange import SegmentorRange
+from SegmentorCache import smoothVolume, gradientMagnitude
+from SegmentorPyramid import SegmentorPyramid, dilateMask
+
+#---------------------------------------------------------------------------
+#
+# SegmentorCore
+#
+class SegmentorCore:
+
+  def __init__(self, compensateIntensity = 11, morphology3d = False, refineWorkers = 1, margin = 16,
+               memoryLimit = None, scratchDirectory = None, profile = None, progress = None, incremental = False,
+               multiLabel = False, seedFront = False, maxRadius = None, edgeStop = None, pyramidLevels = 0,
+               anisotropy = 3.0):
+    # compensateIntensity is used to select the voxels within a range
+    self.compensateIntensity = compensateIntensity
+    # smooth the label by 3D morphology instead of slice by slice
+    self.morphology3d = morphology3d
+    # number of threads used by the refinement
+    self.refineWorkers = refineWorkers
+    # initial margin of the working window around the seeds
+    self.margin = margin
+    # bytes of a work array kept in memory (None: no limit), bigger ones are memory-mapped
+    # scratch files in scratchDirectory (default: the temporary directory of the system),
+    # and the full size arrays (which may be numpy.memmap) are scanned and copied slab by slab,
+    # the local statistics of the growth are not kept if they need more, the limit does not bound
+    # the peak memory: the edge gradient, the pyramid band masks and the temporaries of the growth
+    # are window sized arrays in memory
+    self.memoryLimit = memoryLimit
+    self.scratchDirectory = scratchDirectory
+    # the stages of the segmentation are recorded in the profile, which may be shared with the caller
+    self.profile = profile if profile is not None else SegmentorProfile()
+    # progress, cancellation and budget of the segmentation (None: not reported)
+    self.progress = progress
+    # keep the state of the last segmentation for update(), its grown label is run-length encoded (SegmentorMask)
+    self.incremental = incremental
+    self.state = None
+    # grow each label value of the seeds as a separate region, in one competitive sweep (growWindowLabels),
+    # refine them label by label, the output keeps the label values
+    self.multiLabel = multiLabel
+    # grow from the front of all the seed voxels instead of the shells around the brightest one
+    self.seedFront = seedFront
+    # the voxels farther than this (mm, None: no limit) from the seed point are not grown
+    self.maxRadius = maxRadius
+    # the voxels whose gradient is above this times the gradient of the seeds are not grown (None: no edge stop),
+    # the gradient magnitude of the whole volume, computed for each window if None
+    self.edgeStop = edgeStop
+    self.gradient = None
+    # the gradient of the edges, taken from the seeds of the whole segmentation and kept by update()
+    self.edgeThreshold = None
+    # levels of the coarse-to-fine growth (0: the growth is at the full resolution), the window is grown at a
+    # resolution reduced 2 ** pyramidLevels times, then in a band around the coarse boundary at the full resolution,
+    # the update of the incremental and the multi-label segmentations grow at the full resolution
+    self.pyramidLevels = pyramidLevels
+    # the largest over the smallest spacing of thick slices (see SegmentorGrow.shellScale, None: never)
+    self.anisotropy = anisotropy
+    # the estimator of the intensity range from the seed values (bins, tail fraction, method), it may use the
+    # histogram of the whole volume, computed once by the caller:
+    #   core.intensityRange.histogram = SegmentorHistogram(volume)
+    self.intensityRange = SegmentorRange(compensateIntensity)
+    # the label values of the last segmentation
+    self.labels = [1]
+    # the working window, spacing and engines of the last segmentation, and the box of the output it wrote
+    self.window = None
+    self.box = None
+    self.spacing = None
+    self.grow = None
+    self.refine = None
+
+  #
+  #The intensity range of the growth, from the histogram of the seed values (see SegmentorRange)
+  #
+  def GetGrowRange(self, seedingROI_values):
+    self.intensityRange.compensateIntensity = self.compensateIntensity
+    return self.intensityRange.growRange(seedingROI_values)
+
+  #
+  #allocate a zeroed work array, as a memory-mapped scratch file if it is bigger than the memory limit,
+  #the scratch file has no name and is removed with the array
+  #
+  def allocate(self, shape, dtype):
+    if self.memoryLimit is None or int(np.prod(shape)) * np.dtype(dtype).itemsize <= self.memoryLimit:
+      return np.zeros(shape, dtype)
+    scratch = tempfile.TemporaryFile(prefix = 'oneclickcut-', dir = self.scratchDirectory)
+    logging.debug("memory-mapped work array %s %s", shape, np.dtype(dtype))
+    return np.memmap(scratch, dtype = dtype, mode = 'w+', shape = tuple(shape))
+
+  #
+  #number of slices (first axis) of an array scanned or copied at once, within the memory limit
+  #
+  def slabSize(self, array):
+    if self.memoryLimit is None:
+      return max(array.shape[0], 1)
+    # room for the temporaries of the slab (masks, indices)
+    sliceBytes = max(int(np.prod(array.shape[1:])) * 8, 1)
+    return max(self.memoryLimit // (4 * sliceBytes), 1)
+
+  #
+  #copy source into destination slab by slab
+  #
+  def copy(self, source, destination):
+    step = self.slabSize(source)
+    for k in range(0, source.shape[0], step):
+      destination[k : k + step] = source[k : k + step]
+
+  #
+  #the seeding voxel (the brightest one of the seeds) and the seed values,
+  #the seeds are scanned slab by slab, raises ValueError if there is no seed
+  #
+  def seedPoint(self, inputVolumeData, seedingROIData):
+    step = self.slabSize(seedingROIData)
+    coords = ([], [], [])
+    values = []
+    for k in range(0, seedingROIData.shape[0], step):
+      slab = np.nonzero(seedingROIData[k : k + step] > 0)
+      if len(slab[0]) == 0:
+        continue
+      values.append(inputVolumeData[k : k + step][slab])
+      coords[0].append(slab[0] + k)
+      coords[1].append(slab[1])
+      coords[2].append(slab[2])
+    if not values:
+      raise ValueError("the seeding label is empty")
+    seedingROI_coords = tuple(np.concatenate(c) for c in coords)
+    seedingROI_values = np.concatenate(values)
+    seed = tuple(c[seedingROI_values.argmax()] for c in seedingROI_coords)
+    return seed, seedingROI_coords, seedingROI_values
+
+  #
+  #the seed point and the intensity range of each label value of the seeds, as a list of
+  #(label, seed point, ROI_min, ROI_max), and the coordinates of all the seeds
+  #
+  def seedLabels(self, inputVolumeData, seedingROIData):
+    seed, seedingROI_coords, seedingROI_values = self.seedPoint(inputVolumeData, seedingROIData)
+    seedingROI_labels = np.asarray(seedingROIData[seedingROI_coords])
+    seeds = []
+    for label in np.unique(seedingROI_labels):
+      inside = seedingROI_labels == label
+      values = seedingROI_values[inside]
+      ROI_min, ROI_max = self.GetGrowRange(values)
+      labelSeed = tuple(c[inside][values.argmax()] for c in seedingROI_coords)
+      seeds.append((label, labelSeed, ROI_min, ROI_max))
+    return seeds, seedingROI_coords
+
+  #
+  #the scale of the shells and windows along each axis (thick slices, see SegmentorGrow.shellScale), None for cubes
+  #
+  def shellScale(self):
+    return shellScale(self.spacing or (1.0, 1.0, 1.0), self.anisotropy)
+
+  #
+  #a grow-cut engine with the parameters of the core, factors are the sizes of the voxels (of a coarse level)
+  #along each axis, in voxels of the volume
+  #
+  def growEngine(self, factors = (1, 1, 1)):
+    spacing = self.spacing or (1.0, 1.0, 1.0)
+    # the coarse levels of a volume with thick slices are less anisotropic, their shells are scaled anyway
+    anisotropy = self.anisotropy if self.shellScale() is None else 1.0
+    grow = SegmentorGrow(self.compensateIntensity, maxRadius = self.maxRadius, spacing = tuple(s * f for s, f in zip(spacing, factors)),
+                         anisotropy = anisotropy)
+    if self.memoryLimit is not None:
+      grow.statsBytes = min(grow.statsBytes, self.memoryLimit)
+    return grow
+
+  #
+  #a refinement engine with the parameters of the core
+  #
+  def refineEngine(self):
+    return SegmentorRefine(morphology3d = self.morphology3d, workers = self.refineWorkers, spacing = self.spacing, anisotropy = self.anisotropy)
+
+  #
+  #the edge map of a window (the box of the volume, None: the whole volume) with edgeStop, None without,
+  #the edges are the voxels whose gradient magnitude is above edgeStop times the 90th percentile of the
+  #gradient at the seeds (seedingROI_coords, in the window), the threshold is kept (self.edgeThreshold)
+  #until the next whole segmentation, so the windows and the strokes of update() have the same edges
+  #
+  def edgeMap(self, windowVolumeData, seedingROI_coords, box = None):
+    if not self.edgeStop:
+      return None
+    with self.profile.stage('edges'):
+      if self.gradient is not None:
+        gradient = np.asarray(self.gradient[box] if box is not None else self.gradient)
+      else:
+        gradient = gradientMagnitude(smoothVolume(windowVolumeData), self.spacing or (1.0, 1.0, 1.0))
+      if self.edgeThreshold is None:
+        self.edgeThreshold = self.edgeStop * max(float(np.percentile(gradient[seedingROI_coords], 90)), 1e-6)
+      edges = gradient > self.edgeThreshold
+    self.profile.info['edgeThreshold'] = self.edgeThreshold
+    logging.debug("edge threshold %s, edge voxels %d", self.edgeThreshold, np.count_nonzero(edges))
+    return edges
+
+  #
+  #Region growing (flood fill), see SegmentorRegionGrow
+  #
+  def RegionGrow3d(self, inputVolumeData, seedingROIData, outputROIData):
+    seed, seedingROI_coords, seedingROI_values = self.seedPoint(inputVolumeData, seedingROIData)
+    logging.debug("seed-point %s", seed)
+    ROI_min, ROI_max = self.GetGrowRange(seedingROI_values)
+
+    #clear output roi
+    outputROIData[...] = 0
+    grow = SegmentorRegionGrow(self.compensateIntensity)
+    grown = grow.regionGrow(inputVolumeData, outputROIData, seedingROI_coords if self.seedFront else seed, ROI_min, ROI_max)
+    logging.info("region grow voxels %d, removed from waiting list %d", grown, grow.voxelsRemoved)
+    return grow
+
+  #
+  #Region growing (grow-cut) in cube shells around the seeding voxel, or from the front of all
+  #the seeds (seedFront), see SegmentorGrow, outputROIData receives the grown voxels,
+  #box is the box of the volume given as inputVolumeData (a working window), for the edge map
+  #
+  def growCut(self, inputVolumeData, seedingROIData, outputROIData, box = None):
+    with self.profile.stage('seedPoint'):
+      seed, seedingROI_coords, seedingROI_values = self.seedPoint(inputVolumeData, seedingROIData)
+    logging.debug("seed-point %s", seed)
+    with self.profile.stage('GetGrowRange'):
+      ROI_min, ROI_max = self.GetGrowRange(seedingROI_values)
+    self.growRange = (ROI_min, ROI_max)
+    edges = self.edgeMap(inputVolumeData, seedingROI_coords, box)
+
+    pyramid = self.pyramid(inputVolumeData.shape)
+    if pyramid is not None:
+      return self.growPyramid(pyramid, inputVolumeData, outputROIData, seed, seedingROI_coords, ROI_min, ROI_max, edges)
+    grow = self.growEngine()
+    with self.profile.stage('growCut'):
+      if self.seedFront:
+        front = np.ravel_multi_index(seedingROI_coords, inputVolumeData.shape)
+        iterations = grow.growFront(inputVolumeData, outputROIData, ROI_min, ROI_max, front, self.progress, seed, edges = edges)
+      else:
+        iterations = grow.growCut(inputVolumeData, outputROIData, seed, ROI_min, ROI_max, self.progress, edges)
+    self.profile.count('growCut', iterations = iterations, voxelsVisited = grow.voxelsVisited, iterationsSaved = grow.iterationsSaved)
+    logging.info("grow-cut iterations %d (%d saved), visited voxels %d", iterations, grow.iterationsSaved, grow.voxelsVisited)
+    return grow
+
+  #
+  #the levels of the coarse-to-fine growth of a volume (a window) of the given shape, None if the growth
+  #is at the full resolution (no pyramidLevels, or the coarse volume is too small to grow in)
+  #
+  def pyramid(self, shape):
+    if not self.pyramidLevels:
+      return None
+    factor = 2 ** int(self.pyramidLevels)
+    scale = self.shellScale()
+    if scale is not None:
+      # the blocks are about as big along each axis (in mm), the thick slices are not merged
+      factor = tuple(max(2 ** int(np.floor(np.log2(factor / s + 1e-9))), 1) for s in scale)
+    pyramid = SegmentorPyramid(factor)
+    # the coarse growth needs a patch and a shell around the coarse seed point
+    if min(pyramid.coarseShape(shape)) < 5:
+      return None
+    return pyramid
+
+  #
+  #coarse-to-fine grow-cut (see growCut), the seeds of outputROIData are grown in the reduced volume, with the
+  #intensity range of the full resolution seeds, the coarse label is expanded to the full resolution, the voxels
+  #inside of its band are kept grown and the band is grown again from them at the full resolution (growFront),
+  #the voxels out of the band are not grown, returns the engine of the band growth, whose counters (iterations,
+  #visited voxels, voxels grown at the border) are the ones of both growths
+  #
+  def growPyramid(self, pyramid, inputVolumeData, outputROIData, seed, seedingROI_coords, ROI_min, ROI_max, edges = None):
+    with self.profile.stage('pyramid'):
+      coarseVolume = pyramid.reduceVolume(inputVolumeData)
+      coarseROI = pyramid.reduceMask(outputROIData).astype(np.uint8)
+      coarseEdges = None if edges is None else pyramid.reduceMask(edges)
+      coarseSeed = tuple(int(s) // f for s, f in zip(seed, pyramid.factors))
+    coarse = self.growEngine(pyramid.factors)
+    with self.profile.stage('growCut'):
+      if self.seedFront:
+        coarse.growFront(coarseVolume, coarseROI, ROI_min, ROI_max, None, self.progress, coarseSeed, edges = coarseEdges)
+      else:
+        coarse.growCut(coarseVolume, coarseROI, coarseSeed, ROI_min, ROI_max, self.progress, coarseEdges)
+
+    grow = self.growEngine()
+    with self.profile.stage('pyramid'):
+      expanded = pyramid.expandMask(coarseROI, inputVolumeData.shape)
+      inner, outer = pyramid.band(expanded)
+      # the voxels out of the band (and the edges) are not grown at the full resolution
+      blocked = np.logical_not(outer)
+      if edges is not None:
+        blocked |= edges
+      else:
+        # no edge voxel to add around the region, the blocked ones are all out of the band
+        grow.edgeSteps = 0
+      # the band is grown from the voxels inside of it and from the seeds, the front is the ones next to the band
+      grown = np.logical_or(outputROIData > 0, inner)
+      front = np.flatnonzero(np.logical_and(grown, dilateMask(np.logical_not(grown), 1)))
+      outputROIData[np.logical_and(inner, outputROIData == 0)] = 1
+    if coarse.stopped is None:
+      with self.profile.stage('growCut'):
+        grow.growFront(inputVolumeData, outputROIData, ROI_min, ROI_max, front, self.progress, seed, edges = blocked)
+      # the edge voxels added next to the region may be out of the band
+      outputROIData[np.logical_not(outer)] = 0
+    else:
+      # the coarse label, stopped by the budget
+      outputROIData[expanded] = 1
+      grow.stopped = coarse.stopped
+    bandVoxels = int(np.count_nonzero(outer) - np.count_nonzero(inner))
+    grow.iterations = coarse.iterations + grow.iterations
+    grow.iterationsSaved = coarse.iterationsSaved
+    grow.voxelsVisited = coarse.voxelsVisited + grow.voxelsVisited
+    grow.lastShellGrown = coarse.lastShellGrown + grow.lastShellGrown
+    self.profile.count('growCut', iterations = grow.iterations, voxelsVisited = grow.voxelsVisited, iterationsSaved = grow.iterationsSaved)
+    self.profile.count('pyramid', coarseVoxelsVisited = coarse.voxelsVisited, bandVoxels = bandVoxels)
+    self.profile.info['pyramidFactor'] = pyramid.factor
+    logging.info("pyramid grow-cut 1/%d, coarse visited voxels %d, band voxels %d, visited voxels %d",
+                 pyramid.factor, coarse.voxelsVisited, bandVoxels, grow.voxelsVisited)
+    return grow
+
+  #
+  #grow-cut in a working window around the seeds, the window is enlarged until the growth
+  #stops inside it, returns the grown label of the window (self.window.slices() of the volume)
+  #
+  def growWindow(self, inputVolumeData, seedingROIData):
+    #working window, a box around the seeds, only the arrays of this box are allocated and processed
+    with self.profile.stage('seedPoint'):
+      seed, seedingROI_coords, seedingROI_values = self.seedPoint(inputVolumeData, seedingROIData)
+    window = SegmentorWindow(inputVolumeData.shape, seed, seedingROI_coords, self.margin, self.shellScale())
+    self.window = window
+    if self.incremental:
+      self.state = {'shape': inputVolumeData.shape, 'seeds': np.ravel_multi_index(seedingROI_coords, inputVolumeData.shape)}
+
+    #start grow cut algorithm,
+    #that will use initial label and region grow to generate ROI
+    while True:
+      box = window.slices()
+      logging.debug("working window %s %s", window.lower, window.upper)
+      with self.profile.stage('window'):
+        windowROIData = self.allocate(seedingROIData[box].shape, seedingROIData.dtype)
+        self.copy(seedingROIData[box], windowROIData)
+        windowVolumeData = inputVolumeData[box]
+        if self.memoryLimit is not None:
+          #a contiguous copy of the window, the growth reads its voxels many times
+          windowVolumeData = self.allocate(windowROIData.shape, inputVolumeData.dtype)
+          self.copy(inputVolumeData[box], windowVolumeData)
+      self.grow = self.growCut(windowVolumeData, windowROIData, windowROIData, box)
+      #the growth reached the border of the window, grow again in a bigger window,
+      #unless it was stopped by the budget
+      if self.grow.stopped:
+        logging.info("grow-cut stopped by the %s budget", self.grow.stopped)
+        return windowROIData
+      if self.grow.lastShellGrown == 0 or not window.expand(not self.seedFront):
+        return windowROIData
+
+  #
+  #competitive grow-cut of all the labels in one working window, each label has its own window
+  #around its seeds which limits its shells, the working window contains the windows of all the
+  #labels, the labels which reach the border of their window are grown again in a bigger one,
+  #the labels which did not are kept as they are (and block the others), returns the grown
+  #labels of the working window, with seedFront the labels grow from their fronts
+  #(SegmentorGrow.growFrontLabels), the coarse-to-fine growth (pyramidLevels) is not supported
+  #
+  def growWindowLabels(self, inputVolumeData, seedingROIData):
+    with self.profile.stage('seedPoint'):
+      seeds, seedingROI_coords = self.seedLabels(inputVolumeData, seedingROIData)
+    self.labels = [int(label) for label, seed, ROI_min, ROI_max in seeds]
+    logging.debug("labels %s", seeds)
+    seedingROI_labels = seedingROIData[seedingROI_coords]
+    windows = dict((label, SegmentorWindow(inputVolumeData.shape, seed, tuple(c[seedingROI_labels == label] for c in seedingROI_coords), self.margin,
+                                           self.shellScale()))
+                   for label, seed, ROI_min, ROI_max in seeds)
+    self.growRange = dict((int(label), (ROI_min, ROI_max)) for label, seed, ROI_min, ROI_max in seeds)
+
+    growing = seeds
+    grown = None
+    while True:
+      window = SegmentorWindow.union(list(windows.values()))
+      box = window.slices()
+      logging.debug("working window %s %s", window.lower, window.upper)
+      with self.profile.stage('window'):
+        windowROIData = self.allocate(seedingROIData[box].shape, seedingROIData.dtype)
+        self.copy(seedingROIData[box], windowROIData)
+        if grown is not None:
+          #the kept labels of the last (smaller) working window
+          last = tuple(slice(l - n, u - n) for l, u, n in zip(self.window.lower, self.window.upper, window.lower))
+          kept = np.isin(grown, [label for label, seed, ROI_min, ROI_max in growing], invert = True)
+          windowROIData[last][kept] = grown[kept]
+        windowVolumeData = inputVolumeData[box]
+        if self.memoryLimit is not None:
+          windowVolumeData = self.allocate(windowROIData.shape, inputVolumeData.dtype)
+          self.copy(inputVolumeData[box], windowVolumeData)
+      self.window = window
+      localSeeds = [(label, tuple(s - l for s, l in zip(seed, window.lower)), ROI_min, ROI_max)
+                    for label, seed, ROI_min, ROI_max in growing]
+      edges = self.edgeMap(windowVolumeData, tuple(c - l for c, l in zip(seedingROI_coords, window.lower)), box)
+      self.grow = self.growEngine()
+      with self.profile.stage('growCut'):
+        if self.seedFront:
+          iterations = self.grow.growFrontLabels(windowVolumeData, windowROIData, localSeeds, self.progress, edges)
+        else:
+          iterations = self.grow.growCutLabels(windowVolumeData, windowROIData, localSeeds,
+                                               [windows[label].distances() for label, seed, ROI_min, ROI_max in growing], self.progress, edges)
+      self.profile.count('growCut', iterations = iterations, voxelsVisited = self.grow.voxelsVisited, iterationsSaved = self.grow.iterationsSaved)
+      logging.info("multi-label grow-cut of %d labels, iterations %d, visited voxels %d", len(growing), iterations, self.grow.voxelsVisited)
+      if self.grow.stopped:
+        logging.info("grow-cut stopped by the %s budget", self.grow.stopped)
+        return windowROIData
+      #grow again the labels which reached the border of their window, if it can be enlarged
+      growing = [seed for seed in growing if self.grow.labelShellGrown[seed[0]] > 0 and windows[seed[0]].expand(not self.seedFront)]
+      if not growing:
+        return windowROIData
+      grown = windowROIData
+
+  #
+  #refine each label of the window separately, the refined region of a label only takes the
+  #voxels which are empty or grown by this label, returns the number of refined slices
+  #
+  def refineLabels(self, windowROIData):
+    grown = self.allocate(windowROIData.shape, windowROIData.dtype)
+    self.copy(windowROIData, grown)
+    windowROIData[...] = 0
+    refined = 0
+    mask = self.allocate(grown.shape, np.uint8)
+    for label in self.labels:
+      np.copyto(mask, grown == label)
+      refined = refined + self.refine.refine(mask, self.progress)
+      claim = np.logical_and(mask > 0, np.logical_or(grown == 0, grown == label))
+      windowROIData[np.logical_and(claim, windowROIData == 0)] = label
+    return refined
+
+  #
+  #The whole segmentation: grow-cut in a working window around the seeds, then refinement,
+  #inputVolumeData and seedingROIData are 3D arrays of the same shape, spacing is the size
+  #of the voxels (mm) along the axes of the arrays,
+  #the result is written into outputROIData (allocated like the seeds if not given) and returned,
+  #only the working window (self.window) of the output is written
+  #
+  def segment(self, inputVolumeData, seedingROIData, spacing = (1.0, 1.0, 1.0), outputROIData = None):
+    if inputVolumeData.shape != seedingROIData.shape:
+      raise ValueError("input volume %s and seeding label %s have different shapes" % (inputVolumeData.shape, seedingROIData.shape))
+    self.spacing = tuple(float(s) for s in spacing)
+    if self.progress is not None:
+      self.progress.start()
+    self.edgeThreshold = None
+    if self.multiLabel:
+      if self.pyramidLevels:
+        logging.warning("the labels of a multi-label segmentation are grown at the full resolution, pyramidLevels is ignored")
+      windowROIData = self.growWindowLabels(inputVolumeData, seedingROIData)
+    else:
+      self.labels = [1]
+      windowROIData = self.growWindow(inputVolumeData, seedingROIData)
+    if outputROIData is None:
+      outputROIData = self.allocate(seedingROIData.shape, seedingROIData.dtype)
+    self.box = self.window.slices()
+    if self.incremental and not self.multiLabel:
+      #the grown label before refinement (compact), new seeds are grown into it by update
+      grown = SegmentorMask.fromDense(windowROIData)
+      self.state.update({'range': self.growRange, 'lower': self.window.lower, 'upper': self.window.upper, 'grown': grown})
+
+    #optimize the result of grow-cut, convex hull and morphological operations of the slices
+    self.refine = self.refineEngine()
+    with self.profile.stage('refine'):
+      if self.multiLabel:
+        refined = self.refineLabels(windowROIData)
+      else:
+        refined = self.refine.refine(windowROIData, self.progress)
+    self.profile.count('refine', slices = refined)
+    logging.info("refined slices %d", refined)
+
+    #write the result of the window back to the full size label
+    with self.profile.stage('writeBack'):
+      self.copy(windowROIData, outputROIData[self.window.slices()])
+    self.profile.info.update({'shape': list(inputVolumeData.shape), 'spacing': list(self.spacing),
+                              'window': [list(self.window.lower), list(self.window.upper)],
+                              'windowVoxels': int(windowROIData.size), 'stopped': self.grow.stopped,
+                              'labels': self.labels})
+    return outputROIData
+
+  #
+  #enlarge the box of the kept label to contain the given box, returns the (dense) kept label
+  #
+  def extendState(self, grown, lower, upper):
+    state = self.state
+    newLower = tuple(min(a, b) for a, b in zip(state['lower'], lower))
+    newUpper = tuple(max(a, b) for a, b in zip(state['upper'], upper))
+    if newLower != state['lower'] or newUpper != state['upper']:
+      extended = self.allocate(tuple(u - l for l, u in zip(newLower, newUpper)), np.uint8)
+      old = tuple(slice(l - n, u - n) for l, u, n in zip(state['lower'], state['upper'], newLower))
+      extended[old] = grown
+      state.update({'lower': newLower, 'upper': newUpper})
+      return extended
+    return grown
+
+  #
+  #Incremental segmentation: grow from the seeds added since the last segmentation into the
+  #kept label, with the kept intensity range, and refine only the slices the growth changed,
+  #outputROIData must be the label written by the last segmentation (or update),
+  #a whole segmentation is done (and kept) instead if there is no state, seeds were removed,
+  #or most of the new seeds are out of the kept intensity range (the user marked another tissue),
+  #the multi-label segmentation is always done again as a whole:
+  #
+  #   core = SegmentorCore(incremental = True)
+  #   label = core.update(volume, seeds)        # the first update is a whole segmentation
+  #   seeds[...] = ...                          # the user marks another stroke
+  #   core.update(volume, seeds, outputROIData = label)
+  #
+  def update(self, inputVolumeData, seedingROIData, spacing = (1.0, 1.0, 1.0), outputROIData = None):
+    state = self.state
+    if self.multiLabel or state is None or outputROIData is None or state['shape'] != inputVolumeData.shape or 'grown' not in state:
+      self.profile.info['incremental'] = False
+      return self.segment(inputVolumeData, seedingROIData, spacing, outputROIData)
+    self.spacing = tuple(float(s) for s in spacing)
+    if self.progress is not None:
+      self.progress.start()
+
+    with self.profile.stage('seedPoint'):
+      seed, seedingROI_coords, seedingROI_values = self.seedPoint(inputVolumeData, seedingROIData)
+      seeds = np.ravel_multi_index(seedingROI_coords, inputVolumeData.shape)
+      added = np.isin(seeds, state['seeds'], invert = True)
+    ROI_min, ROI_max = state['range']
+    newValues = seedingROI_values[added]
+    if len(state['seeds']) + added.sum() != len(seeds) or \
+       (len(newValues) > 0 and not ROI_min < np.median(newValues) < ROI_max):
+      #the last result is replaced, clear it
+      outputROIData[tuple(slice(l, u) for l, u in zip(state['lower'], state['upper']))] = 0
+      self.profile.info['incremental'] = False
+      return self.segment(inputVolumeData, seedingROIData, spacing, outputROIData)
+    self.profile.info['incremental'] = True
+    state['seeds'] = seeds
+    self.refine = self.refineEngine()
+    # the refinement takes the slices along axis
+    axis = self.refine.axis
+    self.box = tuple(slice(l, u) for l, u in zip(state['lower'], state['upper']))
+    if len(newValues) == 0:
+      #nothing new to grow, the label is unchanged
+      self.grow = self.growEngine()
+      return outputROIData
+
+    #grow from the brightest new seed, in a window around the new seeds, into the kept label
+    newCoords = tuple(c[added] for c in seedingROI_coords)
+    newSeed = tuple(c[newValues.argmax()] for c in newCoords)
+    window = SegmentorWindow(inputVolumeData.shape, newSeed, newCoords, self.margin, self.shellScale())
+    self.window = window
+    changed = set()
+    grown = state['grown'].toDense(self.allocate(state['grown'].shape, np.uint8))
+    while True:
+      box = window.slices()
+      grown = self.extendState(grown, window.lower, window.upper)
+      local = tuple(slice(l - n, u - n) for l, u, n in zip(window.lower, window.upper, state['lower']))
+      with self.profile.stage('window'):
+        before = self.allocate(grown[local].shape, np.uint8)
+        self.copy(grown[local], before)
+        windowROIData = self.allocate(before.shape, np.uint8)
+        self.copy(before, windowROIData)
+        windowROIData[tuple(c - l for c, l in zip(newCoords, window.lower))] = 1
+        windowVolumeData = inputVolumeData[box]
+        if self.memoryLimit is not None:
+          windowVolumeData = self.allocate(windowROIData.shape, inputVolumeData.dtype)
+          self.copy(inputVolumeData[box], windowVolumeData)
+      localCoords = tuple(c - l for c, l in zip(newCoords, window.lower))
+      edges = self.edgeMap(windowVolumeData, localCoords, box)
+      self.grow = self.growEngine()
+      with self.profile.stage('growCut'):
+        if self.seedFront:
+          front = np.ravel_multi_index(localCoords, windowROIData.shape)
+          iterations = self.grow.growFront(windowVolumeData, windowROIData, ROI_min, ROI_max, front, self.progress, window.localSeed(),
+                                           edges = edges)
+        else:
+          iterations = self.grow.growCut(windowVolumeData, windowROIData, window.localSeed(), ROI_min, ROI_max, self.progress, edges)
+      self.profile.count('growCut', iterations = iterations, voxelsVisited = self.grow.voxelsVisited, iterationsSaved = self.grow.iterationsSaved)
+      grown[local] = windowROIData
+      # the slices which changed, along the axis of the refinement, slab by slab
+      changedData = np.moveaxis(windowROIData, axis, 0)
+      beforeData = np.moveaxis(before, axis, 0)
+      step = self.slabSize(changedData)
+      for k in range(0, changedData.shape[0], step):
+        changed.update(np.flatnonzero((changedData[k : k + step] != beforeData[k : k + step]).any(axis = (1, 2))) + k + window.lower[axis])
+      if self.grow.stopped or self.grow.lastShellGrown == 0 or not window.expand(not self.seedFront):
+        break
+    logging.info("incremental grow-cut iterations %d, visited voxels %d", iterations, self.grow.voxelsVisited)
+    state['grown'] = SegmentorMask.fromDense(grown)
+
+    #copy the changed slices of the kept label to the output and refine them
+    self.box = tuple(slice(l, u) for l, u in zip(state['lower'], state['upper']))
+    outputBox = outputROIData[self.box]
+    changed = np.array(sorted(changed), int) - state['lower'][axis]
+    with self.profile.stage('refine'):
+      if self.morphology3d:
+        outputBox[...] = grown
+        refined = self.refine.refine(outputBox, self.progress)
+      else:
+        np.moveaxis(outputBox, axis, 0)[changed] = np.moveaxis(grown, axis, 0)[changed]
+        refined = self.refine.refine(outputBox, self.progress, changed)
+    self.profile.count('refine', slices = refined)
+    logging.info("incremental refined slices %d", refined)
+    self.profile.info.update({'shape': list(inputVolumeData.shape), 'spacing': list(self.spacing),
+                              'window': [list(window.lower), list(window.upper)],
+                              'windowVoxels': int(windowROIData.size), 'stopped': self.grow.stopped})
+    return outputROIData
@@ -0,0 +1,1217 @@
+﻿# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# Vectorized region growing (grow-cut) engine used by SegmentorLogic
+# each iteration of grow-cut visits a cube shell around the seed, instead of
+# looping over the voxels of the shell in python, the whole shell is processed
+# by a few numpy operations (shifted neighbour gathers and min/max reductions)
+# this module only depends on numpy, so it can be used and benchmarked outside of 3D slicer
+#---------------------------------------------------------------------------
+
+import threading
+from collections import deque
+import numpy as np
+
+# tolerance of the shell levels computed from the (float) spacing ratios
+LEVEL_EPSILON = 1e-9
+
+#
+#the scale of the shells along each axis, the spacing over the smallest spacing, of a volume whose largest
+#spacing is anisotropy times its smallest one or more (thick slices, like a CT of 0.7 x 0.7 x 5 mm), None for
+#the cube shells of the voxels, such a volume is segmented in physical units: shell n holds the voxels whose
+#largest distance along an axis is n times the smallest spacing, so the growth takes n in-plane steps for one
+#step across the slices, like a cube shell in millimetres, instead of visiting whole slices far from the lesion,
+#the window margins are scaled alike, the refinement takes the natively acquired slices with kernels scaled by
+#the spacing, and the coarse levels of the pyramid do not reduce the thick axis
+#
+def shellScale(spacing, anisotropy = None):
+  spacing = [float(s) for s in spacing]
+  if not anisotropy or max(spacing) < anisotropy * min(spacing):
+    return None
+  return tuple(s / min(spacing) for s in spacing)
+
+#
+#the largest offset (voxels) along each axis of the shells up to level
+#
+def shellExtents(level, scale = None, axes = 3):
+  if scale is None:
+    return (int(level),) * axes
+  return tuple(int(np.floor(level / s + LEVEL_EPSILON)) for s in scale)
+
+#
+#the shell of each offset (a tuple of arrays, one per axis), its largest distance along an axis in shells
+#
+def offsetLevels(offsets, scale = None):
+  if scale is None:
+    return np.max([np.abs(o) for o in offsets], axis = 0)
+  return np.max([np.ceil(np.abs(o) * s - LEVEL_EPSILON) for o, s in zip(offsets, scale)], axis = 0).astype(np.int64)
+
+#
+#the last shell whose voxels are all within the distances (voxels along each axis) of the centre, -1 if none
+#
+def shellLevels(distances, scale = None):
+  if scale is None:
+    return int(min(distances))
+  return int(min(np.ceil((d + 1) * s - LEVEL_EPSILON) - 1 for d, s in zip(distances, scale)))
+
+#---------------------------------------------------------------------------
+#
+# SegmentorShells, cache of the offsets of the cube shells from their centre
+# the offsets of a shell only depend on its index, so they are generated once and shared by
+# all the engines, clicks and volumes (every growth visits the same first shells), the flat
+# offsets also depend on the strides of the volume and are kept for the last strides only,
+# the shells are cached until a table holds maxBytes, the bigger shells are then generated,
+# the shells of a scale (thick slices, see shellScale) are cached with the scale
+#
+class SegmentorShells:
+
+  def __init__(self, maxBytes = 128 * 1024 * 1024):
+    self.maxBytes = maxBytes
+    # offsets (int16, one row per voxel) of each shell, and their bytes
+    self.offsets = {}
+    self.offsetBytes = 0
+    # flat offsets (int64) of each shell for the strides self.strides, and their bytes
+    self.strides = None
+    self.flatOffsets = {}
+    self.flatBytes = 0
+    self.lock = threading.Lock()
+    # statistics
+    self.hits = 0
+    self.misses = 0
+
+  #
+  #the offsets of the cube shell "iteration" voxels away from the centre, in the same order as
+  #SegmentorUtils.find_new_voxels, the two faces of the first axis, then of the second, then of the third,
+  #with a scale the faces of the box of the shell out of the box of the shell before it (a face is empty
+  #along an axis whose extent did not grow)
+  #
+  def generate(self, iteration, scale = None):
+    k = iteration
+    def cartesian(ax, ay, az):
+      cx, cy, cz = np.meshgrid(ax, ay, az, indexing = 'ij')
+      return np.stack((cx.ravel(), cy.ravel(), cz.ravel()), axis = 1)
+    def faces(inner, outer):
+      return np.concatenate((np.arange(-outer, -inner), np.arange(inner + 1, outer + 1)))
+    ex, ey, ez = shellExtents(k, scale)
+    ix, iy, iz = shellExtents(k - 1, scale)
+    faces_yz = cartesian(faces(ix, ex), np.arange(-ey, ey + 1), np.arange(-ez, ez + 1))
+    faces_xz = cartesian(np.arange(-ix, ix + 1), faces(iy, ey), np.arange(-ez, ez + 1))
+    faces_xy = cartesian(np.arange(-ix, ix + 1), np.arange(-iy, iy + 1), faces(iz, ez))
+    return np.concatenate((faces_yz, faces_xz, faces_xy)).astype(np.int16 if k < 2 ** 15 else np.int64)
+
+  #
+  #the offsets of a shell (read only, shared)
+  #
+  def coords(self, iteration, scale = None):
+    key = iteration if scale is None else (iteration, scale)
+    table = self.offsets.get(key)
+    if table is not None:
+      self.hits = self.hits + 1
+      return table
+    self.misses = self.misses + 1
+    table = self.generate(iteration, scale)
+    table.setflags(write = False)
+    with self.lock:
+      if self.offsetBytes + table.nbytes <= self.maxBytes:
+        self.offsets[key] = table
+        self.offsetBytes = self.offsetBytes + table.nbytes
+    return table
+
+  #
+  #the flat offsets of a shell in a C order volume of the given shape (read only, shared)
+  #
+  def flat(self, iteration, shape, scale = None):
+    strides = (int(shape[1]) * int(shape[2]), int(shape[2]))
+    key = iteration if scale is None else (iteration, scale)
+    with self.lock:
+      if strides != self.strides:
+        self.strides = strides
+        self.flatOffsets = {}
+        self.flatBytes = 0
+      table = self.flatOffsets.get(key)
+    if table is not None:
+      return table
+    coords = self.coords(iteration, scale)
+    table = np.dot(coords.astype(np.int64), np.array([strides[0], strides[1], 1], np.int64))
+    table.setflags(write = False)
+    with self.lock:
+      if strides == self.strides and self.flatBytes + table.nbytes <= self.maxBytes:
+        self.flatOffsets[key] = table
+        self.flatBytes = self.flatBytes + table.nbytes
+    return table
+
+# the cache shared by the engines
+SHELLS = SegmentorShells()
+
+#---------------------------------------------------------------------------
+#
+# SegmentorLocalStats, the statistics of the grown voxels in the patch of every voxel of a volume:
+# their number, and the min and max of their (positive) values, the grown voxels are added as they
+# grow, each one updates the patches it belongs to, a rank map (the position of the candidates of
+# the current shell, -1 elsewhere) finds the neighbours of a candidate among the candidates
+#
+class SegmentorLocalStats:
+
+  def __init__(self, inputFlat, outputFlat, shape, patchOffsets):
+    dx, dy, dz = shape
+    size = len(outputFlat)
+    self.inputFlat = inputFlat
+    self.offsets = (patchOffsets[:, 0].astype(np.int64) * dy + patchOffsets[:, 1]) * dz + patchOffsets[:, 2]
+    dtype = inputFlat.dtype
+    if np.issubdtype(dtype, np.integer):
+      low, high = np.iinfo(dtype).min, np.iinfo(dtype).max
+    else:
+      low, high = -np.inf, np.inf
+    self.count = np.zeros(size, np.uint8)
+    # min above max: no grown voxel with a positive value in the patch
+    self.minimum = np.full(size, high, dtype)
+    self.maximum = np.full(size, low, dtype)
+    self.rank = np.full(size, -1, np.int32)
+    self.add(np.flatnonzero(outputFlat))
+
+  #
+  #bytes used by the statistics of a volume of size voxels
+  #
+  @staticmethod
+  def nbytes(size, dtype):
+    return size * (1 + 2 * np.dtype(dtype).itemsize + 4)
+
+  #
+  #add the newly grown voxels (flat indices, each one once) to the patches they belong to,
+  #the patches out of the volume are skipped
+  #
+  def add(self, flat):
+    if len(flat) == 0:
+      return
+    size = len(self.count)
+    values = np.take(self.inputFlat, flat)
+    positive = values > 0
+    for offset in self.offsets:
+      # the voxels of a batch are distinct, so are their neighbours at the same offset
+      neighbours = flat + offset
+      inside = np.logical_and(neighbours >= 0, neighbours < size)
+      self.count[neighbours[inside]] += 1
+      inside = np.logical_and(inside, positive)
+      neighbours = neighbours[inside]
+      self.minimum[neighbours] = np.minimum(self.minimum[neighbours], values[inside])
+      self.maximum[neighbours] = np.maximum(self.maximum[neighbours], values[inside])
+
+  #
+  #count, min and max (inf and -inf if there is none) of the grown voxels in the patches of the voxels
+  #
+  def local(self, flat):
+    count = np.take(self.count, flat).astype(np.int64)
+    local_min = np.take(self.minimum, flat).astype(np.float64)
+    local_max = np.take(self.maximum, flat).astype(np.float64)
+    none = local_min > local_max
+    local_min[none] = np.inf
+    local_max[none] = -np.inf
+    return count, local_min, local_max
+
+#---------------------------------------------------------------------------
+#
+# SegmentorGrow, the grow-cut engine, the offsets of the shells are cached (SegmentorShells) and the
+# patches of the candidates are read from SegmentorLocalStats, the growths stop when they converge,
+# report their progress to a SegmentorProgress (which can cancel them or stop them at a budget),
+# and take an optional edge map (a boolean array like the volume, the voxels where the gradient of
+# the volume is strong) whose voxels are not candidates, so they also stop at the weak edges
+#
+class SegmentorGrow:
+
+  def __init__(self, compensateIntensity, radius = 1, maxRadius = None, spacing = (1.0, 1.0, 1.0), anisotropy = None):
+    # compensateIntensity is used to select the voxels within a local range
+    self.compensateIntensity = compensateIntensity
+    # the local searching radius
+    self.radius = radius
+    # the voxels farther than maxRadius (mm, None: no limit) from the seed point are not grown,
+    # spacing is the size of the voxels (mm) along the axes of the arrays
+    self.maxRadius = maxRadius
+    self.spacing = tuple(float(s) for s in spacing)
+    # the scale of the shells of thick slices (shellScale), None for the cube shells
+    self.scale = shellScale(self.spacing, anisotropy)
+    r = np.arange(-radius, radius + 1)
+    ox, oy, oz = np.meshgrid(r, r, r, indexing = 'ij')
+    self.patchOffsets = np.stack((ox.ravel(), oy.ravel(), oz.ravel()), axis = 1)
+    # statistics of the last growth
+    self.iterations = 0
+    self.voxelsVisited = 0
+    # voxels grown in the last (outermost) shell, growth was limited by the image (or window) border if not 0
+    self.lastShellGrown = 0
+    # why the last growth stopped before the border of the image (see SegmentorProgress), or None
+    self.stopped = None
+    # the last growth converged (a shell grew nothing) before the border, and the shells it saved
+    self.converged = False
+    self.iterationsSaved = 0
+    # layers of edge voxels added around the grown region after a growth with an edge map
+    self.edgeSteps = 2
+    # the local statistics (SegmentorLocalStats) are kept during a growth if they need less bytes,
+    # the patches of the candidates are gathered otherwise
+    self.statsBytes = 512 * 1024 * 1024
+
+  #
+  #the shell of the farthest voxel grown before the growth (of the label), its chebyshev distance from the
+  #seed point with the cube shells, the shells beyond it only grow from the shells before them
+  #
+  def grownReach(self, outputFlat, shape, seed, label = None):
+    grown = np.flatnonzero(outputFlat if label is None else outputFlat == label)
+    if len(grown) == 0:
+      return 0
+    return int(offsetLevels([c - s for c, s in zip(np.unravel_index(grown, shape), seed)], self.scale).max())
+
+  #
+  #the number of shells between a voxel and the farthest shell of its patch (1 with the cube shells),
+  #the growth converges when as many shells in a row grew nothing, a shell of a thick slices scale
+  #may have no face across the slices
+  #
+  def quietShells(self):
+    if self.scale is None:
+      return 1
+    return int(np.ceil(self.radius * max(self.scale) - LEVEL_EPSILON))
+
+  #
+  #the last shell around the seed point whose patches are inside of the volume of the given shape,
+  #and inside of extent (the distances from the seed point to the faces of a window along each axis) if given
+  #
+  def borderShell(self, seed, shape, extent = None):
+    distances = [min(s, d - 1 - s) for s, d in zip(seed, shape)]
+    if extent is not None:
+      distances = [min(d, e) for d, e in zip(distances, extent)]
+    return shellLevels([d - self.radius - 1 for d in distances], self.scale)
+
+  #
+  #with the scale of thick slices the shells beyond borderShell are cut to the faces of each axis instead
+  #of stopping at the nearest face, a thin axis does not limit the reach across the slices: the largest
+  #offsets from the seed point, towards the lower and the upper face of each axis, of the voxels whose
+  #patch is inside of the volume (and of extent), None with the cube shells
+  #
+  def shellLimits(self, seed, shape, extent = None):
+    if self.scale is None:
+      return None
+    lower = np.array([s - self.radius - 1 for s in seed], np.int64)
+    upper = np.array([d - 2 - self.radius - s for s, d in zip(seed, shape)], np.int64)
+    if extent is not None:
+      lower = np.minimum(lower, np.asarray(extent, np.int64) - self.radius - 1)
+      upper = np.minimum(upper, np.asarray(extent, np.int64) - self.radius - 1)
+    return lower, upper
+
+  #
+  #the last shell with a voxel inside of the limits (shellLimits), -1 if none
+  #
+  def limitShell(self, limits):
+    lower, upper = limits
+    if min(lower.min(), upper.min()) < 0:
+      return -1
+    return int(offsetLevels(list(np.maximum(lower, upper)), self.scale))
+
+  #
+  #the grown voxels (of the label) on the faces of the limits (shellLimits), the growth was limited by
+  #the image (or window) border along an axis if there are some
+  #
+  def limitGrown(self, output, seed, limits, label = None):
+    lower, upper = limits
+    box = [slice(s - l, s + u + 1) for s, l, u in zip(seed, lower, upper)]
+    count = 0
+    for axis in range(len(box)):
+      for face in (seed[axis] - lower[axis], seed[axis] + upper[axis]):
+        faceBox = list(box)
+        faceBox[axis] = slice(face, face + 1)
+        grown = output[tuple(faceBox)]
+        count = count + int(np.count_nonzero(grown if label is None else grown == label))
+    return count
+
+  #
+  #the last shell within maxRadius of the seed point, None if there is no limit
+  #
+  def radiusShells(self):
+    if self.maxRadius is None:
+      return None
+    return int(self.maxRadius / min(self.spacing))
+
+  #
+  #which voxels (an array of coordinates, one row per voxel) are within maxRadius of the centre
+  #
+  def withinRadius(self, coords, centre):
+    distance = ((coords - np.asarray(centre)) * np.asarray(self.spacing)) ** 2
+    return distance.sum(axis = 1) <= self.maxRadius ** 2
+
+  #
+  #coordinates of the cube shell "iteration" voxels away from (sx, sy, sz),
+  #in the same order as SegmentorUtils.find_new_voxels
+  #
+  def shellCoords(self, sx, sy, sz, iteration):
+    return SHELLS.coords(iteration, self.scale) + np.array([sx, sy, sz], np.int64)
+
+  #
+  #flat indices of the cube shell "iteration" voxels away from the seed (scaled by the spacing of thick slices),
+  #in a C order volume of the given shape, only the voxels within maxRadius of the seed if it is set,
+  #and inside of the limits (shellLimits) if given
+  #
+  def shellFlat(self, seed, iteration, shape, limits = None):
+    seedFlat = (int(seed[0]) * shape[1] + int(seed[1])) * shape[2] + int(seed[2])
+    flat = SHELLS.flat(iteration, shape, self.scale)
+    inside = None
+    if limits is not None:
+      coords = SHELLS.coords(iteration, self.scale)
+      inside = np.logical_and(coords >= -limits[0], coords <= limits[1]).all(axis = 1)
+    if self.maxRadius is not None:
+      within = self.withinRadius(SHELLS.coords(iteration, self.scale), (0, 0, 0))
+      inside = within if inside is None else np.logical_and(inside, within)
+    if inside is not None:
+      flat = flat[inside]
+    return flat + seedFlat
+
+  #
+  #the local acceptance test of grow-cut, the voxel needs more than one grown voxel in its patch,
+  #and its value must be in the range of the existing (grown) neighbours
+  #
+  def accept(self, values, count, local_min, local_max):
+    compensate = self.compensateIntensity * 1.2
+    return np.logical_and(count > 1, np.logical_and(values >= local_min - compensate, values <= local_max + compensate))
+
+  #
+  #the local statistics of a growth in a volume, None if they need more than statsBytes
+  #
+  def localStats(self, inputFlat, outputFlat, shape):
+    if SegmentorLocalStats.nbytes(len(outputFlat), inputFlat.dtype) > self.statsBytes:
+      return None
+    return SegmentorLocalStats(inputFlat, outputFlat, shape, self.patchOffsets)
+
+  #
+  #grow one cube shell, returns the number of accepted voxels,
+  #the newly grown voxels are added to the local statistics if given
+  #
+  def growShell(self, inputFlat, outputFlat, shape, shell_flat, ROI_min, ROI_max, stats = None, edgeFlat = None):
+    grown_flat = self.acceptShell(inputFlat, outputFlat, shape, shell_flat, ROI_min, ROI_max, stats = stats, edgeFlat = edgeFlat)
+    if stats is not None:
+      stats.add(grown_flat[np.take(outputFlat, grown_flat) == 0])
+    outputFlat[grown_flat] = 1
+    return len(grown_flat)
+
+  #
+  #the flat indices of the voxels of a cube shell accepted by grow-cut, the output is not changed
+  #voxels of the shell are visited in order by the per-voxel loop, so a voxel grown earlier
+  #in the shell changes the patch of the voxels visited after it, the dependency is resolved
+  #by propagating the newly grown voxels to their later neighbours until nothing changes,
+  #inputFlat and outputFlat are the raveled (C order) volumes of the given shape, shell_flat are the
+  #flat indices of the shell (shellFlat), with a label only the voxels of this label are grown ones,
+  #and the voxels of other labels are not candidates, the patches are read from the local statistics
+  #(SegmentorLocalStats of the grown voxels, without label) if given, instead of being gathered,
+  #the voxels of the raveled edge map edgeFlat (optional) are not candidates
+  #
+  def acceptShell(self, inputFlat, outputFlat, shape, shell_flat, ROI_min, ROI_max, label = None, stats = None, edgeFlat = None):
+    dx, dy, dz = shape
+
+    # Second stop criterion: only the voxels with in the global value range are candidates
+    values = np.take(inputFlat, shell_flat)
+    candidates = np.logical_and(values < ROI_max, values > ROI_min)
+    if label is not None:
+      owner = np.take(outputFlat, shell_flat)
+      candidates = np.logical_and(candidates, np.logical_or(owner == 0, owner == label))
+    if edgeFlat is not None:
+      candidates = np.logical_and(candidates, np.logical_not(np.take(edgeFlat, shell_flat)))
+    flat = shell_flat[candidates]
+    values = values[candidates].astype(np.float64)
+    n = len(flat)
+    if n == 0:
+      return flat
+
+    index = np.arange(n)
+    edges_from = []
+    edges_to = []
+    edges_value = []
+    if stats is not None:
+      # patch statistics of each candidate, before any voxel of this shell is grown
+      count, local_min, local_max = stats.local(flat)
+      stats.rank[flat] = index
+      for offset in stats.offsets:
+        if offset == 0:
+          continue
+        # the candidates of this shell which are visited before the current one, and not grown
+        neighbour_flat = flat + offset
+        rank = np.take(stats.rank, neighbour_flat)
+        earlier = np.flatnonzero(np.logical_and(rank >= 0, rank < index))
+        earlier = earlier[np.take(outputFlat, neighbour_flat[earlier]) == 0]
+        edges_from.append(rank[earlier].astype(np.int64))
+        edges_to.append(earlier)
+        edges_value.append(np.take(inputFlat, neighbour_flat[earlier]).astype(np.float64))
+      stats.rank[flat] = -1
+      return flat[self.propagate(values, count, local_min, local_max, edges_from, edges_to, edges_value)]
+
+    order = np.argsort(flat)
+    sorted_flat = flat[order]
+
+    # patch statistics of each candidate, taken before any voxel of this shell is grown
+    count = np.zeros(n, np.int64)
+    local_min = np.full(n, np.inf)
+    local_max = np.full(n, -np.inf)
+    for ox, oy, oz in self.patchOffsets:
+      neighbour_flat = flat + (int(ox) * dy + int(oy)) * dz + int(oz)
+      if label is None:
+        grown = np.take(outputFlat, neighbour_flat) > 0
+      else:
+        grown = np.take(outputFlat, neighbour_flat) == label
+      neighbour_values = np.take(inputFlat, neighbour_flat).astype(np.float64)
+      count += grown
+      existing = np.logical_and(grown, neighbour_values > 0)
+      np.minimum(local_min, np.where(existing, neighbour_values, np.inf), out = local_min)
+      np.maximum(local_max, np.where(existing, neighbour_values, -np.inf), out = local_max)
+
+      if ox == 0 and oy == 0 and oz == 0:
+        continue
+      # remember the candidates of this shell which are visited before the current one
+      pos = np.minimum(np.searchsorted(sorted_flat, neighbour_flat), n - 1)
+      rank = order[pos]
+      earlier = np.logical_and(sorted_flat[pos] == neighbour_flat, rank < index)
+      earlier = np.logical_and(earlier, np.logical_not(grown))
+      edges_from.append(rank[earlier])
+      edges_to.append(index[earlier])
+      edges_value.append(neighbour_values[earlier])
+
+    return flat[self.propagate(values, count, local_min, local_max, edges_from, edges_to, edges_value)]
+
+  #
+  #the candidates of a shell accepted by grow-cut, given their values, the statistics of their patches
+  #before the shell and the edges (earlier candidate, later candidate, value of the earlier one) between
+  #neighbouring candidates, the newly accepted ones are propagated along the edges until nothing changes,
+  #count, local_min and local_max are updated in place
+  #
+  def propagate(self, values, count, local_min, local_max, edges_from, edges_to, edges_value):
+    n = len(values)
+    accepted = self.accept(values, count, local_min, local_max)
+
+    edges_from = np.concatenate(edges_from)
+    if len(edges_from) > 0:
+      edge_order = np.argsort(edges_from, kind = 'mergesort')
+      edges_to = np.concatenate(edges_to)[edge_order]
+      edges_value = np.concatenate(edges_value)[edge_order]
+      indptr = np.concatenate(([0], np.cumsum(np.bincount(edges_from, minlength = n))))
+
+      newly = np.flatnonzero(accepted)
+      while len(newly) > 0:
+        lengths = indptr[newly + 1] - indptr[newly]
+        total = lengths.sum()
+        if total == 0:
+          break
+        starts = np.repeat(indptr[newly] - (np.cumsum(lengths) - lengths), lengths)
+        selected = starts + np.arange(total)
+        targets = edges_to[selected]
+        target_values = edges_value[selected]
+        # the grown neighbour joins the patch of its later neighbours
+        np.add.at(count, targets, 1)
+        positive = target_values > 0
+        np.minimum.at(local_min, targets[positive], target_values[positive])
+        np.maximum.at(local_max, targets[positive], target_values[positive])
+
+        targets = np.unique(targets)
+        targets = targets[np.logical_not(accepted[targets])]
+        newly = targets[self.accept(values[targets], count[targets], local_min[targets], local_max[targets])]
+        accepted[newly] = True
+
+    return accepted
+
+  #
+  #take the grown voxels on an edge out of the raveled output, they are not grown neighbours during
+  #a growth (the boundary of an earlier growth is not grown through), returns their flat indices and
+  #values for releaseEdges
+  #
+  def holdEdges(self, outputFlat, edgeFlat):
+    if edgeFlat is None:
+      return None
+    held = np.flatnonzero(np.logical_and(edgeFlat, outputFlat != 0))
+    values = outputFlat[held]
+    outputFlat[held] = 0
+    return held, values
+
+  #
+  #put the voxels taken by holdEdges back into the raveled output
+  #
+  def releaseEdges(self, outputFlat, held):
+    if held is not None:
+      outputFlat[held[0]] = held[1]
+
+  #
+  #add the voxels of the edge map next to the grown voxels (of the label) which are not on an edge,
+  #within the global value range, edgeSteps times, output is changed in place, returns the number of added voxels,
+  #they are the boundary of the region, but the growth did not go through them
+  #
+  def growEdges(self, inputVolumeData, output, edges, ROI_min, ROI_max, label = None):
+    # from the grown voxels inside of the edges, so the layers do not move out with each growth
+    grown = np.logical_and(output > 0 if label is None else output == label, np.logical_not(edges))
+    added = 0
+    for step in range(self.edgeSteps):
+      coords = np.nonzero(grown)
+      if len(coords[0]) == 0:
+        break
+      # the box of the grown voxels and their neighbours
+      box = tuple(slice(max(int(c.min()) - 1, 0), int(c.max()) + 2) for c in coords)
+      region = grown[box]
+      # cube dilation, one axis after the other
+      dilated = np.array(region)
+      for axis in range(3):
+        line = np.moveaxis(dilated, axis, 0)
+        shifted = np.array(line)
+        shifted[1:] |= line[:-1]
+        shifted[:-1] |= line[1:]
+        line[...] = shifted
+      values = inputVolumeData[box]
+      new = dilated & ~region & edges[box] & (output[box] == 0) & (values > ROI_min) & (values < ROI_max)
+      count = int(np.count_nonzero(new))
+      if count == 0:
+        break
+      output[box][new] = 1 if label is None else label
+      region |= new
+      added = added + count
+    return added
+
+  #
+  #Region growing in cube shells around the seed point (sx, sy, sz),
+  #gives the same result as the per-voxel loop (growCutLoop), the growth stops when the last shells
+  #grew nothing and no voxel (a seed) is beyond them, the next shells have no grown neighbour and
+  #cannot grow either, so the result is the same as growing up to the border,
+  #maxRadius (mm, optional) limits the growth around the seed point,
+  #progress (SegmentorProgress, optional) is updated after each shell,
+  #the voxels of edges (an edge map like the volume, optional) are not grown
+  #
+  def growCut(self, inputVolumeData, outputROIData, seed, ROI_min, ROI_max, progress = None, edges = None):
+    dx, dy, dz = inputVolumeData.shape
+    # work on raveled views, a temporary copy is only needed for non contiguous arrays
+    inputFlat = np.ravel(inputVolumeData)
+    output = np.ascontiguousarray(outputROIData)
+    outputFlat = output.reshape(-1)
+    edgeFlat = None if edges is None else np.ravel(edges)
+    held = self.holdEdges(outputFlat, edgeFlat)
+
+    self.voxelsVisited = 0
+    self.lastShellGrown = 0
+    self.stopped = None
+    self.converged = False
+    # the last shell inside of the image, the progress is reported up to it, with thick slices
+    # the shells beyond the nearest face go on along the other axes (shellLimits)
+    nearShell = self.borderShell(seed, (dx, dy, dz))
+    limits = self.shellLimits(seed, (dx, dy, dz))
+    borderShell = nearShell if limits is None else self.limitShell(limits)
+    lastIteration = max(borderShell + 1, 1)
+    # the shells with seeds (or other grown voxels) are always grown
+    reach = self.grownReach(outputFlat, (dx, dy, dz), seed)
+    radiusShells = self.radiusShells()
+    stats = self.localStats(inputFlat, outputFlat, (dx, dy, dz))
+    # voxels grown in the last shells, the growth converges when they grew nothing
+    quiet = self.quietShells()
+    lastShells = deque(maxlen = quiet)
+    iteration = 0
+    while True:
+      iteration = iteration + 1
+      # First stop criterion: reach the boundary of the image
+      if iteration > borderShell:
+        break
+      # the shells out of the radius, the growth was not limited by the border
+      if radiusShells is not None and iteration > radiusShells:
+        self.lastShellGrown = 0
+        break
+
+      shell = self.shellFlat(seed, iteration, (dx, dy, dz), None if iteration <= nearShell else limits)
+      self.voxelsVisited = self.voxelsVisited + len(shell)
+      lastShells.append(self.growShell(inputFlat, outputFlat, (dx, dy, dz), shell, ROI_min, ROI_max, stats, edgeFlat))
+      self.lastShellGrown = sum(lastShells)
+      if progress is not None and not progress.update('growCut', iteration / float(lastIteration), len(shell)):
+        self.stopped = progress.stopReason
+        iteration = iteration + 1
+        break
+      # Convergence: the last shells grew nothing and no voxel beyond them is grown, nothing can grow any more
+      if self.lastShellGrown == 0 and iteration >= reach + quiet:
+        self.converged = True
+        iteration = iteration + 1
+        break
+
+    if limits is not None:
+      self.lastShellGrown = self.limitGrown(output, seed, limits)
+    if edges is not None:
+      self.releaseEdges(outputFlat, held)
+      self.growEdges(inputVolumeData, output, edges, ROI_min, ROI_max)
+    if not np.may_share_memory(output, outputROIData):
+      outputROIData[...] = output
+    self.iterations = iteration - 1
+    # the shells up to the border which were not grown
+    self.iterationsSaved = int(max(borderShell, 0) - self.iterations)
+    return self.iterations
+
+  #
+  #the flat offsets of the patch of a voxel in a C order volume of the given shape
+  #
+  def flatOffsets(self, shape):
+    dx, dy, dz = shape
+    return (self.patchOffsets[:, 0] * dy + self.patchOffsets[:, 1]) * dz + self.patchOffsets[:, 2]
+
+  #
+  #which voxels (flat indices in a volume of the given shape) have their patch inside of the volume
+  #
+  def innerVoxels(self, flat, shape):
+    dx, dy, dz = shape
+    radius = self.radius
+    x, rest = np.divmod(flat, dy * dz)
+    y, z = np.divmod(rest, dz)
+    return (x >= radius) & (x < dx - radius) & (y >= radius) & (y < dy - radius) & (z >= radius) & (z < dz - radius)
+
+  #
+  #count, min and max (inf and -inf if there is none) of the grown voxels (of the label) in the patches of the
+  #voxels flat, gathered at the patch offsets (flatOffsets), the candidates of a front are mostly tested once
+  #(the local statistics would update as many patches as they save)
+  #
+  def gatherPatches(self, inputFlat, outputFlat, flat, offsets, label = None):
+    count = np.zeros(len(flat), np.int64)
+    local_min = np.full(len(flat), np.inf)
+    local_max = np.full(len(flat), -np.inf)
+    for offset in offsets:
+      neighbour_flat = flat + offset
+      if label is None:
+        grown = np.take(outputFlat, neighbour_flat) > 0
+      else:
+        grown = np.take(outputFlat, neighbour_flat) == label
+      neighbour_values = np.take(inputFlat, neighbour_flat).astype(np.float64)
+      count += grown
+      existing = np.logical_and(grown, neighbour_values > 0)
+      np.minimum(local_min, np.where(existing, neighbour_values, np.inf), out = local_min)
+      np.maximum(local_max, np.where(existing, neighbour_values, -np.inf), out = local_max)
+    return count, local_min, local_max
+
+  #
+  #the neighbours (flat offsets) of the voxels of a front which are not grown, not on an edge (edgeFlat, optional)
+  #and in the global value range, each one once, gathered chunkSize voxels of the front at a time
+  #
+  def frontCandidates(self, inputFlat, outputFlat, front, neighbours, ROI_min, ROI_max, edgeFlat = None, chunkSize = 1 << 18):
+    candidates = []
+    for c in range(0, len(front), chunkSize):
+      flat = (front[c : c + chunkSize, None] + neighbours[None, :]).ravel()
+      flat = flat[np.take(outputFlat, flat) == 0]
+      if edgeFlat is not None:
+        flat = flat[np.logical_not(np.take(edgeFlat, flat))]
+      values = np.take(inputFlat, flat)
+      # most of the neighbours are grown or out of the range, the duplicates are only removed from the others
+      candidates.append(np.unique(flat[np.logical_and(values < ROI_max, values > ROI_min)]))
+    if not candidates:
+      return np.zeros(0, np.int64)
+    return np.unique(np.concatenate(candidates)) if len(candidates) > 1 else candidates[0]
+
+  #
+  #Region growing from a front of voxels, all the grown voxels of outputROIData (the seeds) by default,
+  #or the flat indices front, instead of the shells around one seed point, so the work is bounded by
+  #the grown region, each iteration visits the neighbours of the front which are not grown,
+  #accepts them by the same local test as grow-cut (all at once, with the patches of the last
+  #iteration), and the accepted voxels are the next front, the growth stops when nothing is accepted,
+  #the voxels closer than the radius to the border are not grown, lastShellGrown is the number of
+  #such voxels the growth reached (it was limited by the image or window border if not 0),
+  #with maxRadius the voxels farther than it from the centre (the seed point) are not grown,
+  #nor the voxels of edges (an edge map like the volume, optional),
+  #progress (SegmentorProgress, optional) is updated after each iteration
+  #
+  def growFront(self, inputVolumeData, outputROIData, ROI_min, ROI_max, front = None, progress = None, centre = None, chunkSize = 1 << 18,
+                edges = None):
+    dx, dy, dz = inputVolumeData.shape
+    radius = self.radius
+    inputFlat = np.ravel(inputVolumeData)
+    output = np.ascontiguousarray(outputROIData)
+    outputFlat = output.reshape(-1)
+    offsets = self.flatOffsets((dx, dy, dz))
+    neighbours = offsets[offsets != 0]
+    edgeFlat = None if edges is None else np.ravel(edges)
+    inner = lambda flat: self.innerVoxels(flat, (dx, dy, dz))
+
+    held = self.holdEdges(outputFlat, edgeFlat)
+    if front is None:
+      front = np.flatnonzero(outputFlat)
+    else:
+      front = np.asarray(front, np.int64)
+      if edgeFlat is not None:
+        front = front[np.logical_not(np.take(edgeFlat, front))]
+      outputFlat[front[outputFlat[front] == 0]] = 1
+    # the neighbours of the voxels at the border are out of the image
+    front = front[inner(front)]
+
+    self.voxelsVisited = 0
+    self.lastShellGrown = 0
+    self.stopped = None
+    # the growth stops with its front
+    self.converged = True
+    self.iterationsSaved = 0
+    # an estimate of the iterations, for the progress
+    lastIteration = max(max(dx, dy, dz) // 2 - radius, 1)
+    iteration = 0
+    while len(front) > 0:
+      iteration = iteration + 1
+      flat = self.frontCandidates(inputFlat, outputFlat, front, neighbours, ROI_min, ROI_max, edgeFlat, chunkSize)
+      if self.maxRadius is not None and centre is not None:
+        flat = flat[self.withinRadius(np.stack(np.unravel_index(flat, (dx, dy, dz)), axis = 1), centre)]
+      inside = inner(flat)
+      self.lastShellGrown = self.lastShellGrown + int(len(flat) - np.count_nonzero(inside))
+      flat = flat[inside]
+      self.voxelsVisited = self.voxelsVisited + len(flat)
+
+      values = np.take(inputFlat, flat).astype(np.float64)
+      count, local_min, local_max = self.gatherPatches(inputFlat, outputFlat, flat, offsets)
+      front = flat[self.accept(values, count, local_min, local_max)]
+      outputFlat[front] = 1
+      if progress is not None and not progress.update('growCut', min(iteration / float(lastIteration), 1.0), len(flat)):
+        self.stopped = progress.stopReason
+        break
+
+    if edges is not None:
+      self.releaseEdges(outputFlat, held)
+      self.growEdges(inputVolumeData, output, edges, ROI_min, ROI_max)
+    if not np.may_share_memory(output, outputROIData):
+      outputROIData[...] = output
+    self.iterations = iteration
+    return self.iterations
+
+  #
+  #Competitive growth of several labels from their fronts, seeds is a list of (label, seed point, ROI_min,
+  #ROI_max), outputROIData holds the seeds (with their label values) and receives the grown voxels, the front
+  #of each label starts from all its voxels, each iteration grows the fronts of all labels (like growFront,
+  #the patch of a candidate only counts the voxels of its label), a voxel accepted by several labels in the
+  #same iteration goes to the label whose range center is the closest to its value, the growth stops when
+  #all the fronts are empty, labelShellGrown is the number of voxels of each label which reached the border,
+  #with maxRadius a label does not grow farther than it from its seed point,
+  #progress (SegmentorProgress, optional) is updated after each iteration,
+  #the voxels of edges (an edge map like the volume, optional) are not grown
+  #
+  def growFrontLabels(self, inputVolumeData, outputROIData, seeds, progress = None, edges = None, chunkSize = 1 << 18):
+    dx, dy, dz = inputVolumeData.shape
+    inputFlat = np.ravel(inputVolumeData)
+    output = np.ascontiguousarray(outputROIData)
+    outputFlat = output.reshape(-1)
+    offsets = self.flatOffsets((dx, dy, dz))
+    neighbours = offsets[offsets != 0]
+    edgeFlat = None if edges is None else np.ravel(edges)
+
+    held = self.holdEdges(outputFlat, edgeFlat)
+    fronts = {}
+    for label, seed, ROI_min, ROI_max in seeds:
+      front = np.flatnonzero(outputFlat == label)
+      fronts[label] = front[self.innerVoxels(front, (dx, dy, dz))]
+
+    self.voxelsVisited = 0
+    self.lastShellGrown = 0
+    self.stopped = None
+    self.converged = True
+    self.iterationsSaved = 0
+    self.labelShellGrown = dict((label, 0) for label, seed, ROI_min, ROI_max in seeds)
+    lastIteration = max(max(dx, dy, dz) // 2 - self.radius, 1)
+    iteration = 0
+    while any(len(front) > 0 for front in fronts.values()):
+      iteration = iteration + 1
+      accepted = []
+      visited = 0
+      for label, seed, ROI_min, ROI_max in seeds:
+        if len(fronts[label]) == 0:
+          continue
+        flat = self.frontCandidates(inputFlat, outputFlat, fronts[label], neighbours, ROI_min, ROI_max, edgeFlat, chunkSize)
+        if self.maxRadius is not None:
+          flat = flat[self.withinRadius(np.stack(np.unravel_index(flat, (dx, dy, dz)), axis = 1), seed)]
+        inside = self.innerVoxels(flat, (dx, dy, dz))
+        self.labelShellGrown[label] = self.labelShellGrown[label] + int(len(flat) - np.count_nonzero(inside))
+        flat = flat[inside]
+        visited = visited + len(flat)
+        values = np.take(inputFlat, flat).astype(np.float64)
+        count, local_min, local_max = self.gatherPatches(inputFlat, outputFlat, flat, offsets, label)
+        flat = flat[self.accept(values, count, local_min, local_max)]
+        accepted.append((label, flat, np.abs(np.take(inputFlat, flat) - (ROI_min + ROI_max) / 2.0)))
+      self.voxelsVisited = self.voxelsVisited + visited
+
+      labels = np.concatenate([np.full(len(f), l, outputFlat.dtype) for l, f, c in accepted])
+      flat = np.concatenate([f for l, f, c in accepted])
+      cost = np.concatenate([c for l, f, c in accepted])
+      # the voxels accepted by several labels go to the label of the lowest cost
+      order = np.lexsort((cost, flat))
+      flat = flat[order]
+      labels = labels[order]
+      first = np.ones(len(flat), bool)
+      first[1:] = flat[1:] != flat[:-1]
+      flat = flat[first]
+      labels = labels[first]
+      outputFlat[flat] = labels
+      for label in fronts:
+        fronts[label] = flat[labels == label]
+      if progress is not None and not progress.update('growCut', min(iteration / float(lastIteration), 1.0), visited):
+        self.stopped = progress.stopReason
+        break
+
+    if edges is not None:
+      self.releaseEdges(outputFlat, held)
+      for label, seed, ROI_min, ROI_max in seeds:
+        self.growEdges(inputVolumeData, output, edges, ROI_min, ROI_max, label)
+    if not np.may_share_memory(output, outputROIData):
+      outputROIData[...] = output
+    self.lastShellGrown = sum(self.labelShellGrown.values())
+    self.iterations = iteration
+    return self.iterations
+
+  #
+  #Competitive grow-cut of several labels in one sweep, seeds is a list of (label, seed point,
+  #ROI_min, ROI_max), outputROIData holds the seeds (with their label values) and receives
+  #the grown voxels, the shells of all labels are grown in turn (shell 1 of each label, then
+  #shell 2, ...), so the labels meet at their boundaries, a voxel accepted by several labels
+  #in the same turn goes to the label whose range center is the closest to its value,
+  #extents (optional) limits the shells of each label like the border of its own window (the distances
+  #from the seed of the label to the faces of its window along each axis, SegmentorWindow.distances),
+  #progress (SegmentorProgress, optional) is updated after each turn,
+  #the voxels of edges (an edge map like the volume, optional) are not grown
+  #
+  def growCutLabels(self, inputVolumeData, outputROIData, seeds, extents = None, progress = None, edges = None):
+    dx, dy, dz = inputVolumeData.shape
+    inputFlat = np.ravel(inputVolumeData)
+    output = np.ascontiguousarray(outputROIData)
+    outputFlat = output.reshape(-1)
+    edgeFlat = None if edges is None else np.ravel(edges)
+    held = self.holdEdges(outputFlat, edgeFlat)
+
+    self.voxelsVisited = 0
+    self.lastShellGrown = 0
+    self.stopped = None
+    self.converged = False
+    # the last shell inside of the image (and of the extent) of each label, a label stops growing at the border
+    if extents is None:
+      extents = [None] * len(seeds)
+    nearIterations = [self.borderShell(seed, (dx, dy, dz), extent) for (label, seed, ROI_min, ROI_max), extent in zip(seeds, extents)]
+    limits = [self.shellLimits(seed, (dx, dy, dz), extent) for (label, seed, ROI_min, ROI_max), extent in zip(seeds, extents)]
+    borderIterations = [near if limit is None else self.limitShell(limit) for near, limit in zip(nearIterations, limits)]
+    lastIterations = list(borderIterations)
+    radiusShells = self.radiusShells()
+    if radiusShells is not None:
+      lastIterations = [min(last, radiusShells) for last in lastIterations]
+    reaches = [self.grownReach(outputFlat, (dx, dy, dz), seed, label) for label, seed, ROI_min, ROI_max in seeds]
+    # voxels grown in the last shell (shells, see quietShells) of each label
+    self.labelShellGrown = dict((label, 0) for label, seed, ROI_min, ROI_max in seeds)
+    quiet = self.quietShells()
+    lastShells = dict((label, deque(maxlen = quiet)) for label, seed, ROI_min, ROI_max in seeds)
+    lastIteration = max(max(lastIterations), 1)
+    iteration = 0
+    while iteration < max(lastIterations):
+      iteration = iteration + 1
+      accepted = []
+      visited = 0
+      for (label, seed, ROI_min, ROI_max), last, near, limit in zip(seeds, lastIterations, nearIterations, limits):
+        # First stop criterion: reach the boundary of the image (or the radius, or converged)
+        if iteration > last:
+          continue
+        shell = self.shellFlat(seed, iteration, (dx, dy, dz), None if iteration <= near else limit)
+        visited = visited + len(shell)
+        flat = self.acceptShell(inputFlat, outputFlat, (dx, dy, dz), shell, ROI_min, ROI_max, label, edgeFlat = edgeFlat)
+        cost = np.abs(np.take(inputFlat, flat) - (ROI_min + ROI_max) / 2.0)
+        accepted.append((label, flat, cost))
+      self.voxelsVisited = self.voxelsVisited + visited
+
+      if accepted:
+        labels = np.concatenate([np.full(len(f), l, outputFlat.dtype) for l, f, c in accepted])
+        flat = np.concatenate([f for l, f, c in accepted])
+        cost = np.concatenate([c for l, f, c in accepted])
+        # the voxels accepted by several labels go to the label of the lowest cost
+        order = np.lexsort((cost, flat))
+        flat = flat[order]
+        labels = labels[order]
+        first = np.ones(len(flat), bool)
+        first[1:] = flat[1:] != flat[:-1]
+        outputFlat[flat[first]] = labels[first]
+        for l, f, c in accepted:
+          lastShells[l].append(int(np.count_nonzero(labels[first] == l)))
+          self.labelShellGrown[l] = sum(lastShells[l])
+      # Convergence of each label, its last shells grew nothing and none of its voxels is beyond them
+      for n, (label, seed, ROI_min, ROI_max) in enumerate(seeds):
+        if iteration <= lastIterations[n] and self.labelShellGrown[label] == 0 and iteration >= reaches[n] + quiet:
+          lastIterations[n] = iteration
+      if progress is not None and not progress.update('growCut', iteration / float(lastIteration), visited):
+        self.stopped = progress.stopReason
+        break
+
+    # the growth of a label was limited by the image (or window) border if its last shell grew,
+    # not if it converged or was limited by the radius, with thick slices if it grew on a face of its limits
+    for n, (label, seed, ROI_min, ROI_max) in enumerate(seeds):
+      if limits[n] is not None:
+        self.labelShellGrown[label] = self.limitGrown(output, seed, limits[n], label)
+      elif lastIterations[n] < borderIterations[n]:
+        self.labelShellGrown[label] = 0
+    if edges is not None:
+      self.releaseEdges(outputFlat, held)
+      for label, seed, ROI_min, ROI_max in seeds:
+        self.growEdges(inputVolumeData, output, edges, ROI_min, ROI_max, label)
+    if not np.may_share_memory(output, outputROIData):
+      outputROIData[...] = output
+    self.lastShellGrown = sum(self.labelShellGrown.values())
+    self.converged = self.stopped is None and self.lastShellGrown == 0
+    self.iterations = iteration
+    self.iterationsSaved = int(max(max(borderIterations), 0) - iteration)
+    return self.iterations
+
+  #
+  #The original grow-cut loop, visit the voxels of each shell one by one in python,
+  #kept as the reference of the vectorized engine (consistency check and benchmark)
+  #
+  def growCutLoop(self, inputVolumeData, outputROIData, seed, ROI_min, ROI_max):
+    sx, sy, sz = seed
+    dx, dy, dz = inputVolumeData.shape
+    radius = self.radius
+    compensateIntensity = self.compensateIntensity
+
+    self.voxelsVisited = 0
+    self.lastShellGrown = 0
+    iteration = 0
+    while True:
+      iteration = iteration + 1
+      searching_extend = np.array([iteration+radius-sx, sx+iteration+radius+1-dx, \
+                                   iteration+radius-sy, sy+iteration+radius+1-dy, \
+                                   iteration+radius-sz, sz+iteration+radius+1-dz])
+      if (searching_extend >= 0).any():
+        break
+
+      new_voxel_coords = self.shellCoords(sx, sy, sz, iteration)
+      self.voxelsVisited = self.voxelsVisited + len(new_voxel_coords)
+      new_voxel_values = inputVolumeData[new_voxel_coords[:, 0], new_voxel_coords[:, 1], new_voxel_coords[:, 2]]
+      glb_voxel_indices = np.where(np.logical_and(new_voxel_values < ROI_max, new_voxel_values > ROI_min))
+      self.lastShellGrown = 0
+
+      for i in glb_voxel_indices[0]:
+        lx, ly, lz = new_voxel_coords[i, :]
+        patch_boolen = outputROIData[lx - radius : lx + radius + 1, ly - radius : ly + radius + 1, lz - radius : lz + radius + 1] > 0
+
+        if patch_boolen.sum() > 1:
+          local_value = inputVolumeData[lx, ly, lz]
+          patch_values = inputVolumeData[lx - radius : lx + radius + 1, ly - radius : ly + radius + 1, lz - radius : lz + radius + 1]
+          existing_values = patch_values[np.logical_and(patch_boolen, patch_values > 0)]
+          if len(existing_values) > 0:
+            local_min = existing_values.min() - compensateIntensity*1.2
+            local_max = existing_values.max() + compensateIntensity*1.2
+            # Third stop criterion: the voxel value is beyond the range of local existing neighbors
+            if local_value <= local_max and local_value >= local_min:
+              outputROIData[lx, ly, lz] = 1
+              self.lastShellGrown = self.lastShellGrown + 1
+
+    self.iterations = iteration - 1
+    return self.iterations
+
+#---------------------------------------------------------------------------
+#
+# SegmentorWindow, the working window of the segmentation
+# a box centered at the seed point which contains all the seeds, grow-cut and refinement only
+# allocate and process the arrays of this box, the box is expanded when the growth reaches its border,
+# with the scale of the shells (thick slices) the box is measured in shells, not in voxels
+#
+class SegmentorWindow:
+
+  def __init__(self, shape, seed, seedingROI_coords, margin = 16, scale = None):
+    self.shape = tuple(shape)
+    self.seed = tuple(int(s) for s in seed)
+    self.scale = scale
+    # shell of the farthest seed voxel from the seed point (their chebyshev distance with the cube shells)
+    self.reach = int(max(np.max(offsetLevels([np.asarray(c) - s for c, s in zip(seedingROI_coords, self.seed)], scale)), 0))
+    # number of shells added around the seeds, doubled each time the window is expanded
+    self.margin = margin
+    self.update()
+
+  def update(self):
+    half = shellExtents(self.reach + self.margin, self.scale, len(self.shape))
+    self.lower = tuple(max(s - h, 0) for s, h in zip(self.seed, half))
+    self.upper = tuple(min(s + h + 1, d) for s, h, d in zip(self.seed, half, self.shape))
+
+  #
+  #the slices of the window, used to crop the full size arrays
+  #
+  def slices(self):
+    return tuple(slice(l, u) for l, u in zip(self.lower, self.upper))
+
+  #
+  #the seed point in the coordinates of the window
+  #
+  def localSeed(self):
+    return tuple(s - l for s, l in zip(self.seed, self.lower))
+
+  #
+  #distances from the seed point to the nearest face of the window along each axis
+  #
+  def distances(self):
+    return tuple(min(s - l, u - 1 - s) for s, l, u in zip(self.seed, self.lower, self.upper))
+
+  #
+  #the last shell around the seed point inside of the window (the distance from the seed point to the
+  #nearest face with the cube shells), grow-cut shells stop at this face
+  #
+  def extent(self):
+    return shellLevels(self.distances(), self.scale)
+
+  #
+  #expand the window, returns False if the shells are already limited by the image border,
+  #in that case growing in a bigger window gives the same result,
+  #a growth which is not in shells (shells = False) is only limited by the image itself, and so are the
+  #shells of thick slices, which stop along each axis at its own faces (SegmentorGrow.shellLimits)
+  #
+  def expand(self, shells = True):
+    if shells and self.scale is None and self.extent() >= shellLevels([min(s, d - 1 - s) for s, d in zip(self.seed, self.shape)], self.scale):
+      return False
+    if self.lower == (0,) * len(self.shape) and self.upper == self.shape:
+      return False
+    self.margin = self.margin * 2
+    self.update()
+    return True
+
+  #
+  #the box containing the given windows (the windows of the labels of a multi-label segmentation),
+  #as a window centered at the seed of the first one, which is not expanded
+  #
+  @classmethod
+  def union(cls, windows):
+    window = cls(windows[0].shape, windows[0].seed, [[s] for s in windows[0].seed], 0, windows[0].scale)
+    window.lower = tuple(min(w.lower[a] for w in windows) for a in range(len(window.shape)))
+    window.upper = tuple(max(w.upper[a] for w in windows) for a in range(len(window.shape)))
+    return window
+
+#---------------------------------------------------------------------------
+#
+# SegmentorRegionGrow, flood-fill engine of SegmentorLogic.RegionGrow3d
+# the waiting list is a deque of flat voxel indices, a uint8 bitmap records the state of each voxel,
+# and the waiting voxels are also indexed in spatial buckets, so the voxels close to a blocked
+# voxel can be removed without scanning the whole waiting list
+#
+class SegmentorRegionGrow:
+
+  # states of the voxels in the visited bitmap
+  UNSEEN = 0
+  WAITING = 1
+  GROWN = 2
+  REMOVED = 3
+
+  def __init__(self, compensateIntensity, boundaryDifference = 15, nearby = 5, margin = 3):
+    # compensateIntensity is used to select the voxels within a local range
+    self.compensateIntensity = compensateIntensity
+    # block the growth in a direction if the local range is this far from the seed range
+    self.boundaryDifference = boundaryDifference
+    # waiting voxels closer than this (in each axis) to a blocked voxel are removed
+    self.nearby = nearby
+    # voxels closer than this to the image edges are not grown further
+    self.margin = margin
+    # statistics of the last growth
+    self.voxelsVisited = 0
+    self.voxelsRemoved = 0
+
+  #
+  #Region growing from the seed point, or from all the seeds if seed is a tuple of coordinate arrays
+  #(like np.nonzero), the range (ROI_min, ROI_max) is given by GetGrowRange,
+  #returns the number of grown voxels
+  #
+  def regionGrow(self, inputVolumeData, outputROIData, seed, ROI_min, ROI_max):
+    dx, dy, dz = inputVolumeData.shape
+    inputFlat = np.ravel(inputVolumeData)
+    output = np.ascontiguousarray(outputROIData)
+    outputFlat = output.reshape(-1)
+    state = np.zeros(dx * dy * dz, np.uint8)
+
+    compensate = self.compensateIntensity
+    # the seed range without the compensation, used to decide whether to block a direction
+    minV = ROI_min + compensate
+    maxV = ROI_max - compensate
+    margin = self.margin
+    nearby = self.nearby
+    stride_x = dy * dz
+
+    r = np.arange(-1, 2)
+    ox, oy, oz = np.meshgrid(r, r, r, indexing = 'ij')
+    patch = ((ox * dy + oy) * dz + oz).ravel()
+    # the 6 neighbours, same order as the original waiting list
+    steps = [stride_x, -stride_x, 1, -1, dz, -dz]
+
+    # waiting voxels indexed by the bucket (nearby x nearby x nearby block) they belong to
+    bucket_y = (dy + nearby - 1) // nearby
+    bucket_z = (dz + nearby - 1) // nearby
+    buckets = {}
+    items = deque()
+
+    def enqueue(f):
+      state[f] = self.WAITING
+      items.append(f)
+      x, rest = divmod(f, stride_x)
+      y, z = divmod(rest, dz)
+      key = ((x // nearby) * bucket_y + y // nearby) * bucket_z + z // nearby
+      bucket = buckets.get(key)
+      if bucket is None:
+        buckets[key] = [f]
+      else:
+        bucket.append(f)
+
+    def remove(xx, yy, zz):
+      # only the buckets overlapping the nearby box need to be checked
+      for bx in range(max(xx - nearby + 1, 0) // nearby, (xx + nearby - 1) // nearby + 1):
+        for by in range(max(yy - nearby + 1, 0) // nearby, (yy + nearby - 1) // nearby + 1):
+          for bz in range(max(zz - nearby + 1, 0) // nearby, (zz + nearby - 1) // nearby + 1):
+            key = (bx * bucket_y + by) * bucket_z + bz
+            bucket = buckets.get(key)
+            if not bucket:
+              continue
+            keep = []
+            for f in bucket:
+              # drop the stale entries of voxels which already left the waiting list
+              if state[f] != self.WAITING:
+                continue
+              a, rest = divmod(f, stride_x)
+              b, c = divmod(rest, dz)
+              if abs(a - xx) < nearby and abs(b - yy) < nearby and abs(c - zz) < nearby:
+                state[f] = self.REMOVED
+                self.voxelsRemoved = self.voxelsRemoved + 1
+              else:
+                keep.append(f)
+            if keep:
+              buckets[key] = keep
+            else:
+              del buckets[key]
+
+    self.voxelsVisited = 0
+    self.voxelsRemoved = 0
+    grown_count = 0
+    seeds = set(int(f) for f in np.atleast_1d(np.ravel_multi_index(seed, (dx, dy, dz))))
+    for f in sorted(seeds):
+      enqueue(f)
+    while items:
+      f = items.popleft()
+      # removed from the waiting list
+      if state[f] != self.WAITING:
+        continue
+      state[f] = self.GROWN
+      outputFlat[f] = 1
+      grown_count = grown_count + 1
+      self.voxelsVisited = self.voxelsVisited + 1
+
+      x, rest = divmod(f, stride_x)
+      y, z = divmod(rest, dz)
+      # reach the image edges, not grow further from this voxel
+      if x + margin >= dx or x - margin <= 0 or y + margin >= dy or y - margin <= 0 or z + margin >= dz or z - margin <= 0:
+        continue
+
+      patch_flat = patch + f
+      patch_values = inputFlat[patch_flat]
+      #for the visit of a seed, use the default voxel group to extract voxels values
+      if f in seeds:
+        existing_values = patch_values[patch_values > 0]
+      else:
+        existing_values = patch_values[np.logical_and(outputFlat[patch_flat] > 0, patch_values > 0)]
+      if len(existing_values) == 0:
+        continue
+
+      #get local max, min info
+      existing_min = existing_values.min()
+      existing_max = existing_values.max()
+      local_min = existing_min - compensate
+      local_max = existing_max + compensate
+      added = False
+      for step in steps:
+        n = f + step
+        v = inputFlat[n]
+        #match the intensity range
+        if v >= ROI_min and v <= ROI_max and v > local_min and v < local_max:
+          added = True
+          if state[n] == self.UNSEEN or state[n] == self.REMOVED:
+            enqueue(n)
+      #stop criteria, none of the neighbours match the intensity range and the local range is far from the seed range
+      if not added and abs(existing_min - minV) > self.boundaryDifference and abs(existing_max - maxV) > self.boundaryDifference:
+        remove(x, y, z)
+
+    if not np.may_share_memory(output, outputROIData):
+      outputROIData[...] = output
+    return grown_count
@@ -0,0 +1,213 @@
+﻿# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# Reading and writing of volumes without 3D slicer, used by the batch segmentation
+# NRRD files are read by pynrrd, NIfTI files by nibabel, the arrays are returned
+# in KJI order (the order of slicer.util.array), the same as SegmentorCore expects
+#---------------------------------------------------------------------------
+
+import os
+import csv
+import logging
+import numpy as np
+from SegmentorMask import SegmentorMask
+
+# pynrrd and nibabel are only needed for the files of their format
+try:
+  import nrrd
+except ImportError:
+  nrrd = None
+try:
+  import nibabel
+except ImportError:
+  nibabel = None
+
+#---------------------------------------------------------------------------
+#
+# SegmentorIO, the seeds can also be given as a CSV of seed points (i, j, k voxel indices), the raw NRRD
+# and uncompressed NIfTI files of the volumes bigger than the memory can be opened as numpy.memmap (only
+# the pages touched by the segmentation are read), memory-mapped labels are written slab by slab, and the
+# labels can be exported as run-length encoded masks (SegmentorMask, .npz)
+#
+class SegmentorIO:
+
+  NRRD_EXTENSIONS = ('.nrrd', '.nhdr')
+  NIFTI_EXTENSIONS = ('.nii.gz', '.nii')
+  # numpy types of the NRRD types
+  NRRD_TYPES = {'int8': 'i1', 'uint8': 'u1', 'int16': 'i2', 'uint16': 'u2', 'int32': 'i4', 'uint32': 'u4',
+                'int64': 'i8', 'uint64': 'u8', 'float': 'f4', 'double': 'f8'}
+
+  def __init__(self, slabBytes = 64 * 1024 * 1024):
+    # size of the slabs written at once for the memory-mapped labels
+    self.slabBytes = slabBytes
+
+  #
+  #the extension of a volume file (".nii.gz" is one extension), or None if not a volume
+  #
+  def volumeExtension(self, path):
+    name = path.lower()
+    for extension in self.NRRD_EXTENSIONS + self.NIFTI_EXTENSIONS:
+      if name.endswith(extension):
+        return extension
+    return None
+
+  #
+  #read a volume, returns the array (KJI order), the spacing along the array axes and
+  #the header of the file, which is used to write the label of the volume,
+  #if mmap is True the array is memory-mapped when the file is not compressed
+  #
+  def readVolume(self, path, mmap = False):
+    extension = self.volumeExtension(path)
+    if extension in self.NRRD_EXTENSIONS:
+      if nrrd is None:
+        raise ImportError("pynrrd is required to read %s" % path)
+      if mmap:
+        header = nrrd.read_header(path)
+        if header.get('encoding', 'raw') == 'raw':
+          data = self.mapNrrd(path, header)
+          return data, self.nrrdSpacing(header)[::-1], ('nrrd', header)
+        logging.warning("%s is compressed (%s), read into memory", path, header.get('encoding'))
+      data, header = nrrd.read(path, index_order = 'C')
+      spacing = self.nrrdSpacing(header)
+      return data, spacing[::-1], ('nrrd', header)
+    if extension in self.NIFTI_EXTENSIONS:
+      if nibabel is None:
+        raise ImportError("nibabel is required to read %s" % path)
+      # the voxels of an uncompressed NIfTI file are memory-mapped by nibabel
+      image = nibabel.load(path, mmap = 'r' if mmap else False)
+      data = np.asanyarray(image.dataobj).T
+      spacing = tuple(float(s) for s in image.header.get_zooms()[:3])
+      return data, spacing[::-1], ('nifti', image)
+    raise ValueError("unknown volume format: %s" % path)
+
+  #
+  #memory-map the raw data of a NRRD file (attached or detached header), in KJI order
+  #
+  def mapNrrd(self, path, header):
+    dtype = np.dtype(self.NRRD_TYPES[header['type']] if header['type'] in self.NRRD_TYPES else header['type'])
+    if dtype.itemsize > 1:
+      dtype = dtype.newbyteorder('>' if header.get('endian', 'little') == 'big' else '<')
+    shape = tuple(int(s) for s in header['sizes'])[::-1]
+
+    dataFile = header.get('data file') or header.get('datafile')
+    if dataFile:
+      dataFile = os.path.join(os.path.dirname(os.path.abspath(path)), dataFile)
+      offset = 0
+    else:
+      dataFile = path
+      # the data follows the empty line which ends the header
+      offset = 0
+      with open(path, 'rb') as f:
+        for line in f:
+          offset = offset + len(line)
+          if not line.strip():
+            break
+    byteSkip = int(header.get('byte skip', 0))
+    if byteSkip == -1:
+      offset = os.path.getsize(dataFile) - int(np.prod(shape)) * dtype.itemsize
+    else:
+      offset = offset + byteSkip
+    return np.memmap(dataFile, dtype = dtype, mode = 'r', offset = offset, shape = shape)
+
+  #
+  #voxel size of a NRRD header (IJK order), from "space directions" or "spacings"
+  #
+  def nrrdSpacing(self, header):
+    directions = header.get('space directions')
+    if directions is not None:
+      directions = [d for d in directions if d is not None and not np.isnan(np.asarray(d, float)).any()]
+      return tuple(float(np.linalg.norm(d)) for d in directions[:3])
+    spacings = header.get('spacings')
+    if spacings is not None:
+      return tuple(float(s) for s in spacings[:3])
+    return (1.0, 1.0, 1.0)
+
+  #
+  #write a label (KJI order) with the geometry of the volume it was segmented from,
+  #the file is written under a temporary name and renamed, so it is either complete or missing
+  #
+  def writeLabel(self, path, label, header):
+    kind, source = header
+    directory, name = os.path.split(path)
+    temporary = os.path.join(directory, '.partial-' + name)
+    if kind == 'nrrd' and isinstance(label, np.memmap):
+      self.writeRawNrrd(temporary, label, source)
+    elif kind == 'nrrd':
+      keep = ('space', 'space directions', 'space origin', 'kinds', 'endian', 'encoding', 'spacings')
+      nrrd.write(temporary, label, dict((k, v) for k, v in source.items() if k in keep), index_order = 'C')
+    else:
+      image = nibabel.Nifti1Image(label.T, source.affine, source.header)
+      image.set_data_dtype(label.dtype)
+      nibabel.save(image, temporary)
+    os.rename(temporary, path)
+
+  #
+  #write a label as a run-length encoded mask (.npz), renamed into place like writeLabel,
+  #label is a dense array or a SegmentorMask, returns the mask
+  #
+  def writeMask(self, path, label):
+    mask = label if isinstance(label, SegmentorMask) else SegmentorMask.fromDense(label)
+    directory, name = os.path.split(path)
+    temporary = os.path.join(directory, '.partial-' + name)
+    mask.save(temporary)
+    os.rename(temporary, path)
+    return mask
+
+  #
+  #read a mask written by writeMask, as a dense uint8 label (KJI order)
+  #
+  def readMask(self, path):
+    return SegmentorMask.load(path).toDense()
+
+  #
+  #write a (memory-mapped) label to a raw NRRD file slab by slab, without a copy of the whole label
+  #
+  def writeRawNrrd(self, path, label, source):
+    types = dict((v, k) for k, v in self.NRRD_TYPES.items())
+    lines = ['NRRD0004', 'type: %s' % types[label.dtype.str[1:]], 'dimension: 3']
+    if 'space' in source:
+      lines.append('space: %s' % source['space'])
+    lines.append('sizes: %s' % ' '.join(str(s) for s in label.shape[::-1]))
+    if 'space directions' in source:
+      lines.append('space directions: %s' % nrrd.format_optional_matrix(np.asarray(source['space directions'], float)))
+    elif 'spacings' in source:
+      lines.append('spacings: %s' % nrrd.format_number_list(source['spacings']))
+    if 'kinds' in source:
+      lines.append('kinds: %s' % ' '.join(source['kinds']))
+    if label.dtype.itemsize > 1:
+      lines.append('endian: %s' % ('big' if label.dtype.str[0] == '>' else 'little'))
+    lines.append('encoding: raw')
+    if 'space origin' in source:
+      lines.append('space origin: %s' % nrrd.format_vector(source['space origin']))
+
+    step = max(1, self.slabBytes // max(label[0].nbytes, 1))
+    with open(path, 'wb') as f:
+      f.write(('\n'.join(lines) + '\n\n').encode('ascii'))
+      for k in range(0, label.shape[0], step):
+        f.write(np.ascontiguousarray(label[k : k + step]).tobytes())
+
+  #
+  #seeding label from a CSV of seed points, one "i,j,k" voxel index per row (a header row is allowed),
+  #optionally followed by the label of the point (default 1),
+  #a ball of the given radius (voxels) is marked around each point
+  #
+  def readSeedPoints(self, path, shape, radius = 2):
+    seeds = np.zeros(shape, np.uint8)
+    r = np.arange(-radius, radius + 1)
+    ok, oj, oi = np.meshgrid(r, r, r, indexing = 'ij')
+    ball = (ok ** 2 + oj ** 2 + oi ** 2) <= radius * radius
+    with open(path) as f:
+      for row in csv.reader(f):
+        try:
+          i, j, k = [int(round(float(v))) for v in row[:3]]
+          label = int(row[3]) if len(row) > 3 and row[3].strip() else 1
+        except ValueError:
+          continue
+        kk = np.clip(k + ok[ball], 0, shape[0] - 1)
+        jj = np.clip(j + oj[ball], 0, shape[1] - 1)
+        ii = np.clip(i + oi[ball], 0, shape[2] - 1)
+        seeds[kk, jj, ii] = label
+    return seeds
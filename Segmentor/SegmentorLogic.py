@@ -9,6 +9,8 @@
 # the UI model will call the run fucntion after user marked the inital seeds
 # region-grow(grow-cut) algorithm was first used, then Opencv was used for refinement of 
 # the output of grow-cut, then the 3D model was presented in 3D view
+# the algorithms are implemented by SegmentorCore (without 3D slicer), this class reads
+# and writes the MRML nodes
 #---------------------------------------------------------------------------
 
 import os
@@ -16,9 +18,9 @@ import unittest
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
+import threading
 import numpy as np
 from vtk.util.numpy_support import vtk_to_numpy as v2n
-from SegmentorUtils import SegmentorUtils
 
 #---------------------------------------------------------------------------
 #Dynamically load Opencv library before import Opencv, since other PC may not have this library installed
@@ -40,6 +42,13 @@ except ImportError:
     print 'Loading cv2 from ',cv2File
     cv2 = imp.load_dynamic('cv2', cv2File)
     print 'Imported from File!'
+
+# the segmentation core imports cv2, which is loaded above
+from SegmentorCore import SegmentorCore
+from SegmentorProfile import SegmentorProfile
+from SegmentorProgress import SegmentorCancelled
+from SegmentorSnapshot import SegmentorSnapshot
+from SegmentorCache import SegmentorCache
 #---------------------------------------------------------------------------
 
 #
@@ -144,149 +153,19 @@ class SegmentorLogic(ScriptedLoadableModuleLogic):
       result = cv2.warpAffine(image, rot_mat, image.shape,flags=cv2.INTER_LINEAR)
       return result
 
+  #
+  #The intensity range of the growth, from the histogram of the seed values
+  #
   def GetGrowRange(self, seedingROI_values, compensateIntensity):
-    # compensateIntensity is used to select the voxels within a range  
-    svalues = np.sort(seedingROI_values)
-    strs = ""
-    for idx, val in enumerate(svalues):
-      strs = strs + str(val) + ","
-    print "seed values: [", strs, "]"
-
-    hist, bins = np.histogram(svalues)
-    minV = int(bins[0])
-    maxV = int(bins[len(bins)-1])
-
-    for inx, val in enumerate(hist):
-        if hist.sum()>0 and val*1.0/hist.sum() > 0.05:
-            minV = int(bins[inx])
-            break
-    for inx, val in reversed(list(enumerate(hist))):
-        if hist.sum()>0 and val*1.0/hist.sum() > 0.05:
-         maxV = int(bins[inx])
-         break
-
-
-    print "hist ", hist
-    print "bins", bins
-    print "min-max ", minV, maxV
- 
-    # compensateIntensity is used to select the voxels within a range  
-    ROI_min = minV - compensateIntensity
-    ROI_max = maxV + compensateIntensity
-
-    if ROI_min < int(bins[0]):
-        ROI_min = int(bins[0])
-    if ROI_max > int(bins[len(bins)-1]):
-        ROI_max = int(bins[len(bins)-1])
-    print "min-max compensate ", ROI_min, ROI_max
-
-    return (ROI_min,ROI_max)
+    return SegmentorCore(compensateIntensity).GetGrowRange(seedingROI_values)
+
   #
   #Region growing algorithm in 3D space, detection local difference, if beyond predefined intensity range,
   # and exceed the boundary difference, block growth in that direction,
   #However, the result of this algorithm is rough, need further refinement
   #
   def RegionGrow3d(self, inputVolumeData, seedingROIData, outputROIData, compensateIntensity):
-
-    # Get the mean of the seeding ROI
-    seedingROI_coords   = np.where(seedingROIData > 0)
-    seedingROI_values   = inputVolumeData[seedingROI_coords]
-    
-    #clear output roi
-    for i in range(dx):
-      #each of the slice
-      oneslice = outputROIData[i:i+1, 0:dy,0:dz][0]
-      mul_array = np.full((dy,dz),0,np.float32);
-      oneslice = oneslice * mul_array
-      outputROIData[i:i+1, 0:dy,0:dz][0] = oneslice
-
-    # # the location of the seeding voxel
-    sx = seedingROI_coords[0][seedingROI_values.argmax()]
-    sy = seedingROI_coords[1][seedingROI_values.argmax()]
-    sz = seedingROI_coords[2][seedingROI_values.argmax()]
-
-    print "seed-point ", sx, sy,sz
-    
-
-
-    ROI_min, ROI_max = self.GetGrowRange(seedingROI_values, compensateIntensity)
-    # Dimension of the input volume 
-    dx, dy, dz = inputVolumeData.shape
-    print "inputVolumeData shape", dx, dy, dz
-
-    items = []
-
-    boundary_dif = 15
-
-    def enqueue(item):
-        items.insert(0,item)
-
-    def dequeue():
-        s = items.pop()
-        #visited.append(s)
-        return s
-    def remove(xx,yy,zz):
-        for item in items[:]:
-            a,b,c = item
-            if abs(a-xx)<5 or abs(b-yy)<5 or abs(c-zz)<5:
-                #print "remove", item
-                items.remove(item) 
-
-    enqueue((sx, sy, sz))
-    first = True
-    while not items==[]:
-        
-        x,y,z = dequeue()
-        #if not visited
-        if outputROIData[x,y,z] != 1:
-           outputROIData[x,y,z] = 1
-
-           #reach the image edges
-           if x+3>= dx or x-3 <=0:
-               break
-           if y+3>= dy or y-3 <=0:
-               break
-           if z+3>= dz or z-3 <=0:
-               break
-           tmpList = []
-           #used to extract visited voxels
-           patch_boolen  = outputROIData[x - 1 : x + 2, y - 1 : y + 2, z - 1 : z + 2]   
-           if patch_boolen.sum() > 0:
-               #voxels group, which use x,y,z as center
-                patch_values    = inputVolumeData[x - 1 : x + 2, y - 1 : y + 2, z - 1 : z + 2] 
-                #to make patch, must have same shape
-                if patch_boolen.shape == patch_values.shape:
-                    #patch it, get unvisited values and voxels
-                    boolen_values   = patch_values[:] * patch_boolen[:]
-                    existing_values = boolen_values[np.where(boolen_values > 0)]
-                    #for the first visit, use the default voxel group to extract voxels values 
-                    if first:
-                        existing_values = patch_values[np.where(patch_values > 0)]
-                        first = False
-                    #if growed to this region
-                    if len(existing_values)>0:
-                      #get local max, min info
-                      local_min       = existing_values.min() - compensateIntensity
-                      local_max       = existing_values.max() + compensateIntensity  
-                      added = False
-                      tmpList[:] = []
-  
-                      tmpList.insert(0,(x,y-1,z))
-                      tmpList.insert(0,(x,y+1,z))
-                      tmpList.insert(0,(x,y,z-1))
-                      tmpList.insert(0,(x,y,z+1))
-                      tmpList.insert(0,(x-1,y,z))
-                      tmpList.insert(0,(x+1,y,z))
-                      for tmp in tmpList:
-                          x1,y1,z1 = tmp
-                          v = inputVolumeData[x1, y1, z1] #get its value
-                          if v >= ROI_min and v<=ROI_max and v>local_min and v<local_max: #match the intensity range
-                            enqueue((x1, y1, z1)) #add to waiting list
-                            added = True
-                      #for each voxels in current group (use x, y, z as center), if not visited and match the intensity range
-                      #stop criteria, if all of the voxels in the group not match predefined intensity range and beyond the boundary difference criteria
-                      if not added and abs(existing_values.min()-minV) >boundary_dif and abs(existing_values.max()-maxV)>boundary_dif:
-                            remove(x,y,z) # not grow at this direction, remove voxels who have similar location from the waiting list
+    SegmentorCore(compensateIntensity).RegionGrow3d(inputVolumeData, seedingROIData, outputROIData)
     pass
 
   #
@@ -294,69 +173,7 @@ class SegmentorLogic(ScriptedLoadableModuleLogic):
   #However, the result of this grow-cut algorithm is rough, need further refinement
   #
   def growCut(self, inputVolumeData, seedingROIData, outputROIData, compensateIntensity):
-
-    # Get the mean of the seeding ROI
-    seedingROI_coords   = np.where(seedingROIData > 0)
-    seedingROI_values   = inputVolumeData[seedingROI_coords]
-    
-    # # the location of the seeding voxel
-    sx = seedingROI_coords[0][seedingROI_values.argmax()]
-    sy = seedingROI_coords[1][seedingROI_values.argmax()]
-    sz = seedingROI_coords[2][seedingROI_values.argmax()]
-
-    print "seed-point ", sx, sy,sz
-
-    ROI_min, ROI_max = self.GetGrowRange(seedingROI_values, compensateIntensity)
-    
-
-    # Dimension of the input volume 
-    dx, dy, dz = inputVolumeData.shape
-    print "inputVolumeData shape", dx, dy, dz
-
-    iteration = 0
-    # the local searching radius
-    radius = 1
-    segutil = SegmentorUtils()
-    while True:
-        
-        iteration = iteration + 1 
-        # First stop criterion: reach the boundary of the image
-        searching_extend    = np.array([iteration+radius-sx, sx+iteration+radius+1-dx, \
-                                         iteration+radius-sy, sy+iteration+radius+1-dy, \
-                                         iteration+radius-sz, sz+iteration+radius+1-dz])
-        if (searching_extend >= 0).any(): 
-            break
-
-        # Second stop criterion: there is no new voxel with in the global value range 
-        new_voxel_coords    = segutil.find_new_voxels(sx, sy, sz, iteration)
-        new_voxel_values    = inputVolumeData[new_voxel_coords[:, 0], new_voxel_coords[:, 1], new_voxel_coords[:, 2]]
-        glb_voxel_indices   = np.where(np.logical_and(new_voxel_values < ROI_max, new_voxel_values > ROI_min))        
-        
-        if not glb_voxel_indices: 
-            break
-        
-        else:
-            for i in glb_voxel_indices[0]:
-                lx, ly, lz          = new_voxel_coords[i, :] 
-                patch_boolen        = outputROIData[lx - 1 : lx + 2, ly - 1 : ly + 2, lz - 1 : lz + 2]   
-
-                if patch_boolen.sum() > 1:
-                    local_value     = inputVolumeData[lx, ly, lz] 
-                    patch_values    = inputVolumeData[lx - 1 : lx + 2, ly - 1 : ly + 2, lz - 1 : lz + 2] 
-   
-                    if patch_boolen.shape == patch_values.shape:
-                        boolen_values   = patch_values[:] * patch_boolen[:]
-                        existing_values = boolen_values[np.where(boolen_values > 0)]
-                        if len(existing_values)>0:
-                            local_min       = existing_values.min() - compensateIntensity*1.2
-                            local_max       = existing_values.max() + compensateIntensity*1.2  
-                                         
-                            # Third stop criterion: the voxel value is beyond the range of local existing neighbors
-                            if local_value <= local_max and local_value >= local_min :
-                                outputROIData[lx, ly, lz] = 1
-                            
-
-    pass
+    return SegmentorCore(compensateIntensity).growCut(inputVolumeData, seedingROIData, outputROIData)
 
   #This function modified from "Model Maker" in 3D slicer
   # create a model using the command line module
@@ -421,113 +238,343 @@ class SegmentorLogic(ScriptedLoadableModuleLogic):
     pass
 
 
+  #
+  #The processed volume, a copy of the input volume with the ROI highlighted,
+  #a single node is kept for each input volume and updated in place on every run,
+  #the box highlighted by the last run is kept in the volume cache (volumeKey, see markProcessedVolume),
+  #only this box is restored if the input volume was not modified since, the whole volume otherwise
+  #
+  def getProcessedVolume(self, inputVolume, volumeKey):
+    outputVolume_name = inputVolume.GetName() + '_processed'
+    outputVolume = slicer.mrmlScene.GetFirstNodeByName(outputVolume_name)
+    if not outputVolume or not outputVolume.IsA("vtkMRMLScalarVolumeNode"):
+      volumesLogic = slicer.modules.volumes.logic()
+      outputVolume = volumesLogic.CloneVolume(slicer.mrmlScene, inputVolume, outputVolume_name)
+      #a fresh copy, nothing to restore
+      self.processedRecord(volumeKey, outputVolume)['box'] = ()
+      return outputVolume
+
+    #restore the intensities of the last run
+    box = self.processedRecord(volumeKey, outputVolume).pop('box', None)
+    outputVolumeData = slicer.util.array(outputVolume.GetID())
+    inputVolumeData = slicer.util.array(inputVolume.GetID())
+    if outputVolumeData.shape != inputVolumeData.shape:
+      outputVolume.GetImageData().DeepCopy(inputVolume.GetImageData())
+    elif box is None:
+      outputVolumeData[...] = inputVolumeData
+    elif box:
+      outputVolumeData[box] = inputVolumeData[box]
+    return outputVolume
+
+  #
+  #the record of the processed volume in the volume cache, its entries are dropped with the
+  #ones of the input volume when it is modified
+  #
+  def processedRecord(self, volumeKey, outputVolume):
+    return self.getVolumeCache().get(volumeKey, ('processed', outputVolume.GetID()), dict)
+
+  #
+  #keep the box of the processed volume highlighted by a run, restored by the next one
+  #
+  def markProcessedVolume(self, volumeKey, outputVolume, box):
+    self.processedRecord(volumeKey, outputVolume)['box'] = box
+
+  #
+  #The output label of the segmentation, a single node is kept for each seeding label and
+  #updated in place on every run, returns the node and True if it was created
+  #
+  def getOutputLabel(self, seedingROI):
+    outputROI_name = seedingROI.GetName() + '_grow'
+    seedingOutputROI = slicer.mrmlScene.GetFirstNodeByName(outputROI_name)
+    if not seedingOutputROI or not seedingOutputROI.IsA("vtkMRMLScalarVolumeNode"):
+      # Copy seeding node, create a new volume node as the result of region grow
+      volumesLogic = slicer.modules.volumes.logic()
+      return volumesLogic.CloneVolume(slicer.mrmlScene, seedingROI, outputROI_name), True
+
+    #the seeding label was replaced by one of another size, take its geometry
+    if slicer.util.array(seedingOutputROI.GetID()).shape != slicer.util.array(seedingROI.GetID()).shape:
+      seedingOutputROI.GetImageData().DeepCopy(seedingROI.GetImageData())
+      seedingOutputROI.CopyOrientation(seedingROI)
+    return seedingOutputROI, False
+
+  #
+  #keep a snapshot of the output label before it is overwritten, at most undoLimit snapshots are kept
+  #(the last one is also used to restore the label if the run is cancelled)
+  #
+  def pushUndo(self, seedingOutputROI, outputROIData, undoLimit):
+    if not hasattr(self, 'undoSnapshots'):
+      self.undoSnapshots = []
+    self.undoSnapshots.append((seedingOutputROI.GetID(), SegmentorSnapshot(outputROIData)))
+    del self.undoSnapshots[:-max(undoLimit, 1)]
+
+  #
+  #the cache of the data derived from the input volumes, created at its first use
+  #
+  def getVolumeCache(self):
+    if getattr(self, 'volumeCache', None) is None:
+      self.volumeCache = SegmentorCache()
+    return self.volumeCache
+
+  #
+  #the key of a volume node in the cache, its ID and the last modification of its voxels
+  #
+  def volumeKey(self, volumeNode):
+    imageData = volumeNode.GetImageData()
+    scalars = imageData.GetPointData().GetScalars()
+    return (volumeNode.GetID(), max(imageData.GetMTime(), scalars.GetMTime() if scalars else 0))
+
+  #
+  #restore the output label of the previous run, returns False if there is nothing to undo,
+  #a running segmentation is undone by cancelling it (its label is restored by pollTask)
+  #
+  def undo(self):
+    if self.cancel():
+      return True
+    return self.restoreSnapshot()
+
+  #
+  #restore the last snapshot of the undo stack (and drop it), returns False if there is none
+  #
+  def restoreSnapshot(self):
+    while getattr(self, 'undoSnapshots', None):
+      nodeID, snapshot = self.undoSnapshots.pop()
+      seedingOutputROI = slicer.mrmlScene.GetNodeByID(nodeID)
+      if not seedingOutputROI:
+        continue
+      outputROIData = slicer.util.array(nodeID)
+      if outputROIData.shape != snapshot.shape:
+        continue
+      snapshot.restore(outputROIData)
+      seedingOutputROI.GetImageData().Modified()
+      #the incremental state does not match the restored label any more
+      self.session = None
+      return True
+    return False
+
   #
   #The actual segmentation algorithms implemented in this function
   #firstly, use grow cut to make initla ROI
   #then, use opencv(convex hull, morphological operation) to refine the ROI
   #fianlly, present the ROI model in 3D view
+  #the ROI is presented by the label (on top of the input volume in the slice views),
+  #the full size processed volume is only written if processedVolume is True,
+  #the label is smoothed slice by slice, or by 3D morphology if morphology3d is True,
+  #the slices are refined by refineWorkers threads,
+  #progress (SegmentorProgress) reports the progress and holds the cancellation and budget,
+  #if background is True the segmentation runs in a thread and run returns at once,
+  #onProgress(stage, fraction) and onFinished(success) are then called on the main thread,
+  #if incremental is True the output label and the state of the last run (same volume, seeds and
+  #parameters) are kept, and a new run only grows the newly marked seeds (SegmentorCore.update),
+  #the previous result of the output label is kept for undo (at most undoLimit runs),
+  #if multiLabel is True each label value of the seeding label is segmented as a separate region,
+  #all in one pass (SegmentorCore.growWindowLabels, without pyramidLevels), and a model is made for each label,
+  #if seedFront is True the growth starts from all the marked voxels (SegmentorGrow.growFront),
+  #maxRadius (mm) limits the growth around the seed point (None: no limit),
+  #with volumeHistogram (bins) the intensity range is estimated in the histogram of the input volume
+  #(SegmentorRange), which is kept in the volume cache,
+  #with edgeStop the growth stops at the edges of the input volume (SegmentorCore), its gradient
+  #magnitude is kept in the volume cache,
+  #with pyramidLevels the growth is coarse-to-fine, at a resolution halved pyramidLevels times and then
+  #in a band around the coarse boundary at the full resolution (SegmentorCore),
+  #the time and memory of the stages are kept in self.profile (SegmentorProfile.result()), logged,
+  #and appended to traceFile as JSON if given,
+  #with traceMemory the peak allocation of each stage is traced (python 3, SegmentorProfile)
   #
-  def run(self, inputVolume,seedingROI, paintSize, automodel, compensateIntensity, labelNumber, smoothValue):
+  def run(self, inputVolume,seedingROI, paintSize, automodel, compensateIntensity, labelNumber, smoothValue, processedVolume = False, morphology3d = False, refineWorkers = 1, traceFile = None,
+          progress = None, background = False, onProgress = None, onFinished = None, incremental = False, undoLimit = 10,
+          multiLabel = False, seedFront = False, maxRadius = None, volumeHistogram = 0, edgeStop = None, pyramidLevels = 0,
+          traceMemory = False):
 
     if not self.isValidInputOutputData(inputVolume, seedingROI):
        slicer.util.errorDisplay('Please select a input volume first!')
        return False
 
+    #a new segmentation replaces the running one (auto mode segments after each marking)
+    self.cancel()
+
     slicer.util.showStatusMessage( "Segmentation Started...", 500 )
-    # Read in the input volume
-    inputVolumeData = slicer.util.array(inputVolume.GetID())
-    
-    # Read in the seeding ROI, the initial label marked by user
-    seedingROIData  = slicer.util.array(seedingROI.GetID())
+    profile = SegmentorProfile(traceFile, traceMemory)
+    self.profile = None
+    with profile.stage('readArrays'):
+      # Read in the input volume
+      inputVolumeData = slicer.util.array(inputVolume.GetID())
+
+      # Read in the seeding ROI, the initial label marked by user
+      seedingROIData  = slicer.util.array(seedingROI.GetID())
+      if not seedingROIData.any():
+         slicer.util.errorDisplay('Please mark the ROI first!')
+         return False
     
-    # Copy seeding node, create a new volume node as the result of region grow
-    outputROI_name  = seedingROI.GetName() + '_grow'
-    seedingOutputROI       = slicer.modules.volumes.logic().CloneVolume(slicer.mrmlScene, seedingROI, outputROI_name)
-    outputROIData   = slicer.util.array(seedingOutputROI.GetID())
-
-
-    #create output node
-    outputVolume_name = inputVolume.GetName() + '_processed'
-    volumesLogic = slicer.modules.volumes.logic()
-    outputVolume = volumesLogic.CloneVolume(slicer.mrmlScene, inputVolume, outputVolume_name)
-    outputVolumeData = slicer.util.array(outputVolume.GetID())
+    # the output label of this seeding label, kept for the session and updated in place
+    with profile.stage('outputLabel'):
+      seedingOutputROI, created = self.getOutputLabel(seedingROI)
+      outputROIData   = slicer.util.array(seedingOutputROI.GetID())
+      if not created:
+        self.pushUndo(seedingOutputROI, outputROIData, undoLimit)
+
+    # the incremental session: the core (with its state) of the last run, which grows into its result,
+    # the labels of a multi-label segmentation are always segmented again
+    incremental = incremental and not multiLabel
+    session = getattr(self, 'session', None)
+    # a modified input volume has another key, its session is not reused
+    volumeKey = self.volumeKey(inputVolume)
+    key = (volumeKey, seedingROI.GetID(), compensateIntensity, morphology3d, seedFront, maxRadius, volumeHistogram, edgeStop, pyramidLevels)
+    reused = incremental and session is not None and session['key'] == key and session['output'].GetID() == seedingOutputROI.GetID()
+    if not reused:
+      self.session = None
+      if not created:
+        #start again from the seeds, like a new copy of the seeding label
+        with profile.stage('outputLabel'):
+          outputROIData[...] = seedingROIData
+
+
+    #reuse (or create) the processed volume node if required
+    outputVolume = None
+    if processedVolume:
+      with profile.stage('processedVolume'):
+        outputVolume = self.getProcessedVolume(inputVolume, volumeKey)
 
 
     # Dimension of the input volume 
     dx, dy, dz = inputVolumeData.shape
     print "Start Performe Grow-Cut: inputVolumeData shape", dx, dy, dz
 
-    #start grow cut algorithm, 
-    #that will use initial label and region grow to generate ROI ##########
-    self.growCut(inputVolumeData,seedingROIData,outputROIData, compensateIntensity)
-    
-    dx, dy, dz = outputROIData.shape
-    print "Start to Find ROI Convexhull: outputROIData shape", dx, dy, dz
-    
+    #grow cut and refinement are done by the segmentation core, the arrays are in KJI order
+    if reused:
+      core = session['core']
+      core.profile = profile
+      core.progress = progress
+      core.refineWorkers = refineWorkers
+    else:
+      core = SegmentorCore(compensateIntensity, morphology3d, refineWorkers, profile = profile, progress = progress, incremental = incremental,
+                           multiLabel = multiLabel, seedFront = seedFront, maxRadius = maxRadius, edgeStop = edgeStop,
+                           pyramidLevels = pyramidLevels)
+    if volumeHistogram:
+      with profile.stage('histogram'):
+        core.intensityRange.histogram = self.getVolumeCache().histogram(volumeKey, inputVolumeData, volumeHistogram)
+      profile.info['cache'] = self.getVolumeCache().result()
+    if incremental:
+      self.session = {'key': key, 'core': core, 'output': seedingOutputROI}
+    segment = core.update if incremental else core.segment
+    spacing = inputVolume.GetSpacing()[::-1]
+    if edgeStop:
+      with profile.stage('gradient'):
+        core.gradient = self.getVolumeCache().gradient(volumeKey, inputVolumeData, spacing)
+      profile.info['cache'] = self.getVolumeCache().result()
+
+    #present the result, on the main thread
+    def finish():
+      box = core.box
+      logging.info("segmentation window %s %s, refined slices %d", core.window.lower, core.window.upper, core.refine.slicesRefined)
+
+      with profile.stage('display'):
+        if outputVolume:
+          outputVolumeData = slicer.util.array(outputVolume.GetID())
+          outputVolumeData[box][outputROIData[box]>0] = 100
+          outputVolume.GetImageData().Modified()
+          self.markProcessedVolume(volumeKey, outputVolume, box)
+        seedingOutputROI.GetImageData().Modified()
+
+        # make the output volume appear in all the slice views
+        selectionNode = slicer.app.applicationLogic().GetSelectionNode()
+        selectionNode.SetReferenceActiveLabelVolumeID(seedingOutputROI.GetID())
+        slicer.app.applicationLogic().PropagateVolumeSelection(0)
 
+      
+      #Segmentation Complete, Start to Present 3D Result##########
+      if automodel:
+        #the model maker runs in the background, this stage is the time to start it
+        with profile.stage('makeModel'):
+          labels = ','.join(str(label) for label in core.labels) if multiLabel else labelNumber
+          self.makeModel(seedingOutputROI, labels, smoothValue)
+
+      profile.info['volume'] = inputVolume.GetName()
+      self.profile = profile.write()
+      logging.info("segmentation stages: %s", profile.summary())
+      if core.grow.stopped:
+        slicer.util.showStatusMessage( "Segmentation stopped by the %s budget in %.1f s" % (core.grow.stopped, self.profile['wallSeconds']), 2000 )
+      else:
+        slicer.util.showStatusMessage( "Segmentation Complete in %.1f s, 3D Result Presented!" % self.profile['wallSeconds'], 2000 )
+
+    if not background:
+      segment(inputVolumeData, seedingROIData, spacing, outputROIData)
+      finish()
+      return True
+
+    #segment in a thread, the label is written by the thread but only presented (and the
+    #MRML nodes modified) by finish, which is called on the main thread by pollTask
+    task = {'error': None, 'progress': progress, 'finish': finish, 'output': seedingOutputROI, 'created': created,
+            'onProgress': onProgress, 'onFinished': onFinished}
+    def work():
+      try:
+        segment(inputVolumeData, seedingROIData, spacing, outputROIData)
+      except Exception as e:
+        task['error'] = e
+    task['thread'] = threading.Thread(target = work)
+    task['thread'].daemon = True
+    self.task = task
+    task['thread'].start()
+
+    self.pollTimer = qt.QTimer()
+    self.pollTimer.setInterval(100)
+    self.pollTimer.connect('timeout()', self.pollTask)
+    self.pollTimer.start()
+    return True
 
-    #Start to optimize the result of grow-cut############
-    #since the result of grow-cut need postproceesing
-    #use the opencv to find convex hull of each slice (generated by grow cuts)
-    #then draw the convex hull and do morphological operation to optimize the results
-    for i in range(dx):
-      #each of the slice
-      oneslice = outputROIData[i:i+1, 0:dy,0:dz][0]
+  #
+  #check the segmentation thread (timer on the main thread), report its progress,
+  #and present its result (or its error) when it has finished
+  #
+  def pollTask(self):
+    task = getattr(self, 'task', None)
+    if task is None:
+      return
+    if task['thread'].is_alive():
+      if task['onProgress'] and task['progress'] is not None and task['progress'].stage:
+        task['onProgress'](task['progress'].stage, task['progress'].fraction)
+      return
 
-      mul_array = np.full((dy,dz),255,np.float32);
-      #convert each slice to the format that Opencv can process, range from 0-1 to 0-255
-      oneslice = oneslice * mul_array
-      
-      #if the slice have label info(region grow algorithm is grown to this slice)
-      if oneslice.max()>0:
-        #convert to image that Opencv can process
-        img = cv2.convertScaleAbs(oneslice)
-
-        #a binary threshold to change the slice to binary, that will enable us to further postprocessing
-        ret, img = cv2.threshold(oneslice, 1, 255,cv2.THRESH_BINARY)
-
-        #find the label areas
-        points = np.argwhere(img==255)
-        #using the label areas(contains many pixels) to generate a convex hull
-        ##(the minimized region that can contain label areas)
-        poly = cv2.convexHull(points)
-        img[img>=0] = 0
-        contours = []
-        contours.append(poly)
-
-        #use the convex hull as new label area
-        cv2.drawContours(img,contours, -1, (255,255,255), -1)
-
-        #rotate the image to match the original dimension
-        img = self.rotateImage(img,90)
-        img = img[::-1,:]
-
-        #morphological operation to smooth the label area
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE,(5,5))
-        img = cv2.morphologyEx(img, cv2.MORPH_OPEN, kernel)
-        img = cv2.morphologyEx(img, cv2.MORPH_CLOSE, kernel)
-
-        #convert the new label image to original format
-        oneslice = img / mul_array
-        outputROIData[i:i+1, 0:dy,0:dz][0] = oneslice
-
-    valid_output_values = np.where(outputROIData>0);
-    outputVolumeData[outputROIData>0] = 100
-    #outputVolumeData[outputROIData>0] = inputVolumeData[valid_output_values]
-
-    outputVolume.GetImageData().Modified()
-    seedingOutputROI.GetImageData().Modified()
-    
-    # make the output volume appear in all the slice views
-    selectionNode = slicer.app.applicationLogic().GetSelectionNode()
-    selectionNode.SetReferenceActiveLabelVolumeID(seedingOutputROI.GetID())
-    slicer.app.applicationLogic().PropagateVolumeSelection(0)
+    self.pollTimer.stop()
+    self.task = None
+    error = task['error']
+    if error is None:
+      task['finish']()
+    else:
+      #the label of a cancelled or failed segmentation is not kept (the previous result is restored),
+      #an incremental session is restarted since its state may be partly updated
+      self.session = None
+      if task['created']:
+        slicer.mrmlScene.RemoveNode(task['output'])
+      else:
+        self.restoreSnapshot()
+      if isinstance(error, SegmentorCancelled):
+        slicer.util.showStatusMessage( "Segmentation Cancelled", 2000 )
+      else:
+        logging.error("segmentation failed: %s", error)
+        slicer.util.errorDisplay('Segmentation failed: %s' % error)
+    if task['onFinished']:
+      task['onFinished'](error is None)
 
-    
-    #Segmentation Complete, Start to Present 3D Result##########
-    if automodel:
-      self.makeModel(seedingOutputROI, labelNumber, smoothValue)
-    slicer.util.showStatusMessage( "Segmentation Complete, 3D Result Presented!", 2000 )
+  #
+  #wait for the running segmentation (if any) and present its result
+  #
+  def wait(self):
+    task = getattr(self, 'task', None)
+    if task is not None:
+      task['thread'].join()
+      self.pollTask()
+
+  #
+  #cancel the running segmentation (if any), returns when it has stopped, True if it was cancelled
+  #(or failed) and its label restored, False if there was none or it had already finished
+  #
+  def cancel(self):
+    task = getattr(self, 'task', None)
+    if task is None:
+      return False
+    if task['progress'] is not None:
+      task['progress'].cancel()
+    self.wait()
+    return task['error'] is not None
 
-    return True
 #---------------------------------------------------------------------------
@@ -0,0 +1,163 @@
+# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# Run-length encoded binary mask, used to keep grown labels, undo snapshots and exports
+# compactly, a few bytes per row of the lesion instead of a byte per voxel of the volume
+#---------------------------------------------------------------------------
+
+import numpy as np
+
+#---------------------------------------------------------------------------
+#
+# SegmentorMask, a lesion is a small part of the volume, so only the runs of labelled voxels along the rows
+# (last axis) are kept, as their flat [start, end) indices in the volume, sorted and never crossing a row:
+#
+#   mask = SegmentorMask.fromDense(label)
+#   mask.count(), mask.boundingBox(), mask.contains((k, j, i))
+#   label = mask.union(other).toDense()
+#
+class SegmentorMask:
+
+  def __init__(self, shape, starts = None, ends = None):
+    self.shape = tuple(int(s) for s in shape)
+    size = int(np.prod(self.shape))
+    # uint32 indices are enough for volumes up to 4G voxels
+    self.indexType = np.uint32 if size < 2 ** 32 else np.int64
+    self.starts = np.asarray(starts if starts is not None else [], self.indexType)
+    self.ends = np.asarray(ends if ends is not None else [], self.indexType)
+
+  #
+  #the mask of the non zero voxels of a dense label, converted slab by slab (first axis),
+  #slabVoxels limits the temporary arrays
+  #
+  @classmethod
+  def fromDense(cls, labelData, slabVoxels = 16 * 1024 * 1024):
+    shape = labelData.shape
+    rowLength = shape[-1]
+    rowsPerIndex = int(np.prod(shape[1:-1]))
+    step = max(slabVoxels // max(int(np.prod(shape[1:])), 1), 1)
+    starts = []
+    ends = []
+    for k in range(0, shape[0], step):
+      rows = np.asarray(labelData[k : k + step] != 0).reshape(-1, rowLength)
+      # only the rows with label are searched for runs
+      active = np.flatnonzero(rows.any(axis = 1))
+      padded = np.zeros((len(active), rowLength + 2), np.int8)
+      padded[:, 1:-1] = rows[active]
+      edges = np.diff(padded, axis = 1)
+      # the rising and falling edges of each row are in the same (row major) order
+      row, column = np.nonzero(edges == 1)
+      starts.append((k * rowsPerIndex + active[row].astype(np.int64)) * rowLength + column)
+      row, column = np.nonzero(edges == -1)
+      ends.append((k * rowsPerIndex + active[row].astype(np.int64)) * rowLength + column)
+    if not starts:
+      return cls(shape)
+    return cls(shape, np.concatenate(starts), np.concatenate(ends))
+
+  #
+  #the dense label of the mask, written (value) into out if given, otherwise into a new uint8 array,
+  #the voxels out of the mask are not changed, chunkVoxels limits the temporary index arrays
+  #
+  def toDense(self, out = None, value = 1, chunkVoxels = 16 * 1024 * 1024):
+    if out is None:
+      out = np.zeros(self.shape, np.uint8)
+    if out.shape != self.shape:
+      raise ValueError("mask of shape %s cannot be written into %s" % (self.shape, out.shape))
+    lengths = (self.ends - self.starts).astype(np.int64)
+    total = np.cumsum(lengths)
+    first = 0
+    while first < len(lengths):
+      # the runs of one chunk, at least one run
+      last = max(int(np.searchsorted(total, (total[first] - lengths[first]) + chunkVoxels, 'right')), first + 1)
+      indices = self.expand(self.starts[first:last], lengths[first:last])
+      if out.flags.c_contiguous:
+        out.reshape(-1)[indices] = value
+      else:
+        out[np.unravel_index(indices, self.shape)] = value
+      first = last
+    return out
+
+  #
+  #the flat indices of the voxels of the given runs
+  #
+  def expand(self, starts, lengths):
+    total = int(lengths.sum())
+    offsets = np.repeat(starts.astype(np.int64) - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return offsets + np.arange(total, dtype = np.int64)
+
+  #
+  #number of voxels of the mask
+  #
+  def count(self):
+    return int((self.ends.astype(np.int64) - self.starts).sum())
+
+  #
+  #bytes used by the mask
+  #
+  def nbytes(self):
+    return self.starts.nbytes + self.ends.nbytes
+
+  #
+  #the slices of the bounding box of the mask, None if it is empty
+  #
+  def boundingBox(self):
+    if len(self.starts) == 0:
+      return None
+    rowLength = self.shape[-1]
+    rows = self.starts // rowLength
+    box = []
+    # the index of the rows along the other axes
+    leading = np.unravel_index(rows, self.shape[:-1])
+    for index in leading:
+      box.append(slice(int(index.min()), int(index.max()) + 1))
+    columns = self.starts % rowLength
+    lastColumns = (self.ends - 1) % rowLength
+    box.append(slice(int(columns.min()), int(lastColumns.max()) + 1))
+    return tuple(box)
+
+  #
+  #whether the voxels (a tuple of index arrays, like np.where, or of single indices) are in the mask
+  #
+  def contains(self, coords):
+    flat = np.ravel_multi_index(tuple(np.asarray(c, np.int64) for c in coords), self.shape)
+    run = np.searchsorted(self.starts, flat, 'right') - 1
+    inside = run >= 0
+    inside[inside] = flat[inside] < self.ends[run[inside]]
+    return inside
+
+  #
+  #the union of two masks of the same shape
+  #
+  def union(self, other):
+    if other.shape != self.shape:
+      raise ValueError("masks of shapes %s and %s cannot be merged" % (self.shape, other.shape))
+    starts = np.concatenate((self.starts, other.starts)).astype(np.int64)
+    ends = np.concatenate((self.ends, other.ends)).astype(np.int64)
+    if len(starts) == 0:
+      return SegmentorMask(self.shape)
+    order = np.argsort(starts, kind = 'mergesort')
+    starts = starts[order]
+    ends = ends[order]
+    # a run starts a new merged run if it begins after the end of all runs before it, or in another row
+    reach = np.maximum.accumulate(ends)
+    rows = starts // self.shape[-1]
+    begins = np.ones(len(starts), bool)
+    begins[1:] = (starts[1:] > reach[:-1]) | (rows[1:] != rows[:-1])
+    first = np.flatnonzero(begins)
+    last = np.append(first[1:], len(starts)) - 1
+    return SegmentorMask(self.shape, starts[first], reach[last])
+
+  #
+  #save the mask to a compressed numpy file (.npz), a few KB for a lesion
+  #
+  def save(self, path):
+    with open(path, 'wb') as f:
+      np.savez_compressed(f, shape = np.asarray(self.shape, np.int64), starts = self.starts, ends = self.ends)
+
+  @classmethod
+  def load(cls, path):
+    with np.load(path) as data:
+      return cls(tuple(data['shape']), data['starts'], data['ends'])
@@ -0,0 +1,143 @@
+# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# Stage level instrumentation of a segmentation, used by SegmentorCore and SegmentorLogic
+# the time, memory and counters of each stage, written as JSON lines to a trace file
+#---------------------------------------------------------------------------
+
+import sys
+import time
+import json
+import logging
+from contextlib import contextmanager
+
+# the allocations of a stage can be traced by tracemalloc (python 3), the peak resident
+# memory of the process is taken from resource (not on windows)
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+try:
+  import resource
+except ImportError:
+  resource = None
+
+# CPU time of the process (time.clock is the CPU time on unix in python 2)
+processTime = getattr(time, 'process_time', None) or time.clock
+
+#
+#the peak resident memory of the process in bytes (ru_maxrss is in KB, in bytes on mac os), None without resource
+#
+def maxResident():
+  if resource is None:
+    return None
+  maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+#---------------------------------------------------------------------------
+#
+# SegmentorProfile, each stage records its wall and CPU time, how much it raised the peak resident memory
+# of the process (and its peak allocation with traceMemory, python 3), and counters like the visited voxels
+# and iterations of the growth, a stage run several times (the grow-cut of an enlarged window) is accumulated,
+# the result is a dict which can be written as one JSON line to a trace file (traceFile):
+#
+#   profile = SegmentorProfile(traceFile = 'segmentor-trace.jsonl')
+#   with profile.stage('growCut'):
+#     ...
+#   profile.count('growCut', iterations = 12)
+#   profile.write()
+#
+class SegmentorProfile:
+
+  def __init__(self, traceFile = None, traceMemory = False):
+    # file receiving one JSON line per segmentation (None: no trace)
+    self.traceFile = traceFile
+    # trace the peak allocation of each stage by tracemalloc, slows the stages down
+    self.traceMemory = traceMemory and tracemalloc is not None
+    self.stages = []
+    self.records = {}
+    self.info = {}
+    self.started = time.time()
+
+  #
+  #the record of a stage, created at its first use
+  #
+  def record(self, name):
+    if name not in self.records:
+      # peakBytes is traced by tracemalloc, maxResidentIncrease is the growth of the peak resident memory of the process
+      self.records[name] = {'name': name, 'calls': 0, 'wallSeconds': 0.0, 'cpuSeconds': 0.0, 'peakBytes': None,
+                            'maxResidentIncrease': None if resource is None else 0}
+      self.stages.append(name)
+    return self.records[name]
+
+  #
+  #time a stage (with statement), the stages must not be nested
+  #
+  @contextmanager
+  def stage(self, name):
+    record = self.record(name)
+    if self.traceMemory:
+      if not tracemalloc.is_tracing():
+        tracemalloc.start()
+      if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+      current = tracemalloc.get_traced_memory()[0]
+    resident = maxResident()
+    wall = time.time()
+    cpu = processTime()
+    try:
+      yield record
+    finally:
+      record['calls'] = record['calls'] + 1
+      record['wallSeconds'] = record['wallSeconds'] + time.time() - wall
+      record['cpuSeconds'] = record['cpuSeconds'] + processTime() - cpu
+      if resident is not None:
+        record['maxResidentIncrease'] = record['maxResidentIncrease'] + maxResident() - resident
+      if self.traceMemory:
+        peak = tracemalloc.get_traced_memory()[1] - current
+        record['peakBytes'] = max(record['peakBytes'] or 0, peak)
+
+  #
+  #add counters to a stage (summed over the calls)
+  #
+  def count(self, name, **counters):
+    record = self.record(name)
+    for key, value in counters.items():
+      record[key] = record.get(key, 0) + value
+
+  #
+  #the structured result: information of the segmentation (shape, window...) and the stages in order
+  #
+  def result(self):
+    if self.traceMemory and tracemalloc.is_tracing():
+      tracemalloc.stop()
+    result = dict(self.info)
+    result['time'] = self.started
+    result['wallSeconds'] = sum(self.records[name]['wallSeconds'] for name in self.stages)
+    result['cpuSeconds'] = sum(self.records[name]['cpuSeconds'] for name in self.stages)
+    # the peak resident memory of the process
+    result['maxResidentBytes'] = maxResident()
+    result['stages'] = [dict(self.records[name]) for name in self.stages]
+    return result
+
+  #
+  #one line summary of the stages, for the log and the status bar
+  #
+  def summary(self):
+    return ', '.join('%s %.2f s' % (name, self.records[name]['wallSeconds']) for name in self.stages)
+
+  #
+  #append the result as one JSON line to the trace file, returns the result
+  #
+  def write(self):
+    result = self.result()
+    if self.traceFile:
+      try:
+        with open(self.traceFile, 'a') as f:
+          f.write(json.dumps(result, sort_keys = True) + '\n')
+      except (IOError, OSError) as e:
+        logging.warning("cannot write the segmentation trace %s: %s", self.traceFile, e)
+    return result
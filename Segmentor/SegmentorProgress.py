@@ -0,0 +1,77 @@
+# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# Progress, cancellation and budget of a segmentation, shared by the engines and the caller
+# the grow-cut reports each shell and the refinement each slice, the caller (usually another
+# thread) reads the progress or is called back, and can cancel the segmentation,
+# cancel() aborts it (SegmentorCancelled is raised), while a time or voxel budget only
+# stops the growth, which keeps the voxels grown so far and is refined as usual
+#---------------------------------------------------------------------------
+
+import time
+import threading
+
+#
+# raised by the engines when the segmentation was cancelled
+#
+class SegmentorCancelled(Exception):
+  pass
+
+#---------------------------------------------------------------------------
+#
+# SegmentorProgress
+#
+class SegmentorProgress:
+
+  def __init__(self, callback = None, timeBudget = None, voxelBudget = None):
+    # called with (stage, fraction) at each report, from the thread of the segmentation
+    self.callback = callback
+    # seconds and visited voxels the growth may use (None: no limit)
+    self.timeBudget = timeBudget
+    self.voxelBudget = voxelBudget
+    self.cancelled = threading.Event()
+    self.start()
+
+  #
+  #start (again) the budget, at the beginning of a segmentation
+  #
+  def start(self):
+    self.started = time.time()
+    self.voxels = 0
+    self.stage = None
+    self.fraction = 0.0
+    # why the growth was stopped early ('time' or 'voxels'), None if it was not
+    self.stopReason = None
+
+  #
+  #cancel the segmentation, can be called from any thread
+  #
+  def cancel(self):
+    self.cancelled.set()
+
+  #
+  #report the progress of a stage (fraction in [0, 1]), raises SegmentorCancelled if cancelled
+  #
+  def report(self, stage, fraction):
+    if self.cancelled.is_set():
+      raise SegmentorCancelled("the segmentation was cancelled")
+    self.stage = stage
+    self.fraction = min(max(fraction, 0.0), 1.0)
+    if self.callback is not None:
+      self.callback(stage, self.fraction)
+
+  #
+  #report the progress of the growth and the voxels it visited, returns False when the
+  #budget is exhausted and the growth has to stop
+  #
+  def update(self, stage, fraction, voxels):
+    self.report(stage, fraction)
+    self.voxels = self.voxels + voxels
+    if self.timeBudget is not None and time.time() - self.started > self.timeBudget:
+      self.stopReason = 'time'
+    elif self.voxelBudget is not None and self.voxels > self.voxelBudget:
+      self.stopReason = 'voxels'
+    return self.stopReason is None
@@ -0,0 +1,99 @@
+# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# The levels of the coarse-to-fine growth (SegmentorCore pyramidLevels), a volume is reduced by
+# blocks of voxels, the label grown at the coarse level is brought back to the full resolution,
+# and only a band around its boundary is grown again (SegmentorPyramid.band)
+#---------------------------------------------------------------------------
+
+import numpy as np
+
+#
+#cube dilation of a boolean volume by steps voxels (or a box, steps along each axis), one axis after the other
+#
+def dilateMask(mask, steps = 1):
+  dilated = np.array(mask, bool)
+  if np.isscalar(steps):
+    steps = (steps,) * dilated.ndim
+  for axis in range(dilated.ndim):
+    line = np.moveaxis(dilated, axis, 0)
+    shifted = np.array(line)
+    for step in range(1, min(steps[axis], line.shape[0] - 1) + 1):
+      shifted[step:] |= line[:-step]
+      shifted[:-step] |= line[step:]
+    line[...] = shifted
+  return dilated
+
+#---------------------------------------------------------------------------
+#
+# SegmentorPyramid, a volume is reduced by factor (2, 4...) along each axis, the mean of each block of
+# voxels, the seeds and the edges by the blocks holding one of them, and a coarse label is expanded block
+# by block, the blocks at the border of a volume whose size is not a multiple of factor are the mean of
+# the voxels they hold, the arrays are reduced and expanded by reshapes, no loop over the voxels, factor
+# may be given for each axis (a volume with thick slices is not reduced across them):
+#
+#   pyramid = SegmentorPyramid(factor = 4)
+#   coarseVolume = pyramid.reduceVolume(volume)
+#   coarseSeeds = pyramid.reduceMask(seeds)
+#   ...grow coarseSeeds in coarseVolume...
+#   inner, outer = pyramid.band(pyramid.expandMask(coarseSeeds, volume.shape))
+#
+class SegmentorPyramid:
+
+  def __init__(self, factor = 2, bandWidth = None):
+    # the size of the blocks of voxels reduced to one coarse voxel, along each axis, and the largest one
+    self.factors = tuple(int(f) for f in factor) if not np.isscalar(factor) else (int(factor),) * 3
+    self.factor = max(self.factors)
+    # voxels refined at the full resolution on each side of the coarse boundary along each axis (default: one block)
+    self.bandWidth = self.factors if bandWidth is None else (int(bandWidth),) * 3
+
+  #
+  #the shape of the coarse volume of a volume
+  #
+  def coarseShape(self, shape):
+    return tuple(-(-int(n) // f) for n, f in zip(shape, self.factors))
+
+  #
+  #the blocks of a volume, a (coarse shape, factor) view of the volume padded to a multiple of factor
+  #
+  def blocks(self, volume, mode):
+    padding = [(0, c * f - n) for c, n, f in zip(self.coarseShape(volume.shape), volume.shape, self.factors)]
+    if any(p for z, p in padding):
+      volume = np.pad(volume, padding, mode)
+    coarse = self.coarseShape(volume.shape)
+    fx, fy, fz = self.factors
+    return volume.reshape(coarse[0], fx, coarse[1], fy, coarse[2], fz)
+
+  #
+  #the mean of each block of the volume (float32), the blocks at the border are padded by their last voxels
+  #
+  def reduceVolume(self, volume):
+    return self.blocks(np.asarray(volume), 'edge').mean(axis = (1, 3, 5), dtype = np.float32)
+
+  #
+  #the blocks holding a voxel of a mask (a label, an edge map), boolean
+  #
+  def reduceMask(self, mask):
+    return self.blocks(np.asarray(mask) != 0, 'constant').any(axis = (1, 3, 5))
+
+  #
+  #a coarse mask at the full resolution, each coarse voxel fills its block, cut to shape
+  #
+  def expandMask(self, coarse, shape):
+    expanded = np.asarray(coarse) != 0
+    for axis in range(3):
+      expanded = np.repeat(expanded, self.factors[axis], axis = axis)
+    return np.ascontiguousarray(expanded[:shape[0], :shape[1], :shape[2]])
+
+  #
+  #the band around the boundary of an expanded mask, as the voxels kept grown (inner, farther than
+  #bandWidth inside of the boundary) and the voxels which may be grown (outer, closer than bandWidth
+  #outside of it), the band is outer without inner
+  #
+  def band(self, expanded):
+    outer = dilateMask(expanded, self.bandWidth)
+    inner = np.logical_not(dilateMask(np.logical_not(expanded), self.bandWidth))
+    return inner, outer
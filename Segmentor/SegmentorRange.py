@@ -0,0 +1,134 @@
+# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# The intensity range of the growth, estimated from the values of the seeds (GetGrowRange)
+# by a histogram of the seed values, their percentiles, or their bins in the histogram of the volume
+#---------------------------------------------------------------------------
+
+import logging
+import numpy as np
+
+#---------------------------------------------------------------------------
+#
+# SegmentorHistogram, the histogram of a volume in equal bins between its min and max,
+# the volume is scanned slab by slab (first axis), slabVoxels limits the temporary arrays
+#
+class SegmentorHistogram:
+
+  def __init__(self, volume, bins = 256, slabVoxels = 16 * 1024 * 1024):
+    self.bins = int(bins)
+    step = max(slabVoxels // max(int(np.prod(volume.shape[1:])), 1), 1)
+    low = None
+    high = None
+    for k in range(0, volume.shape[0], step):
+      slab = np.asarray(volume[k : k + step])
+      low = slab.min() if low is None else min(low, slab.min())
+      high = slab.max() if high is None else max(high, slab.max())
+    self.low = float(low)
+    self.high = float(high) if high > low else float(low) + 1.0
+    self.edges = np.linspace(self.low, self.high, self.bins + 1)
+    self.counts = np.zeros(self.bins, np.int64)
+    for k in range(0, volume.shape[0], step):
+      self.counts += np.bincount(self.binIndex(np.asarray(volume[k : k + step]).ravel()), minlength = self.bins)
+
+  #
+  #the bin of each value, the values out of the volume range go to the first or last bin
+  #
+  def binIndex(self, values):
+    index = ((np.asarray(values, np.float64) - self.low) * (self.bins / (self.high - self.low))).astype(np.int64)
+    return np.clip(index, 0, self.bins - 1)
+
+  #
+  #number of values in each bin
+  #
+  def count(self, values):
+    return np.bincount(self.binIndex(values), minlength = self.bins)
+
+  #
+  #bytes used by the histogram
+  #
+  def nbytes(self):
+    return self.counts.nbytes + self.edges.nbytes
+
+#---------------------------------------------------------------------------
+#
+# SegmentorRange, the seed values are binned (bins, 10 by default), the range goes from the first to the
+# last bin holding more than tailFraction (5%) of them, widened by compensateIntensity and clipped to the
+# seed values, a histogram needs no sort, so the estimate is linear in the seeds, method = 'percentile'
+# takes the tailFraction and 1 - tailFraction percentiles instead (numpy partitions the values), with a
+# SegmentorHistogram of the whole volume (computed once, kept by the caller) the seeds are counted in its
+# fine bins, the same for all the strokes of a volume, and the range goes from the bin where the tailFraction
+# lowest seeds end to the bin where the tailFraction highest ones begin (a single outlier seed does not
+# stretch the bins of the others):
+#
+#   estimator = SegmentorRange(compensateIntensity = 11)
+#   estimator.histogram = SegmentorHistogram(volume, bins = 256)
+#   ROI_min, ROI_max = estimator.growRange(seedValues)
+#
+class SegmentorRange:
+
+  def __init__(self, compensateIntensity = 11, bins = 10, tailFraction = 0.05, method = 'histogram', histogram = None, debug = False):
+    # compensateIntensity widens the range of the seed values
+    self.compensateIntensity = compensateIntensity
+    # number of bins of the seed histogram, and the fraction of the seeds a bin must hold to be in the range
+    self.bins = bins
+    self.tailFraction = tailFraction
+    # 'histogram' or 'percentile'
+    self.method = method
+    # the histogram of the volume (SegmentorHistogram) whose bins are used, None: bins over the seed values
+    self.histogram = histogram
+    # log the seed values
+    self.debug = debug
+
+  #
+  #(ROI_min, ROI_max), the intensity range of the growth from the seed values
+  #
+  def growRange(self, seedingROI_values):
+    values = np.ravel(seedingROI_values)
+    if len(values) == 0:
+      raise ValueError("no seed value")
+    if self.debug:
+      logging.debug("seed values: [%s]", np.array2string(values, separator = ',', threshold = len(values) + 1))
+
+    if self.method == 'percentile':
+      minV, maxV = (int(v) for v in np.percentile(values, [100.0 * self.tailFraction, 100.0 * (1.0 - self.tailFraction)]))
+      low, high = int(values.min()), int(values.max())
+    elif self.method == 'histogram':
+      minV, maxV, low, high = self.histogramRange(values)
+    else:
+      raise ValueError("unknown range method %s" % self.method)
+    logging.debug("min-max %s %s", minV, maxV)
+
+    # compensateIntensity is used to select the voxels within a range
+    ROI_min = max(minV - self.compensateIntensity, low)
+    ROI_max = min(maxV + self.compensateIntensity, high)
+    logging.debug("min-max compensate %s %s", ROI_min, ROI_max)
+    return (ROI_min, ROI_max)
+
+  #
+  #the left edges of the first and of the last bin holding more than tailFraction of the values
+  #(the edges of the whole range if there is none), and the edges of the whole range,
+  #with the volume histogram the left edges of the bins where the tails of the values end
+  #
+  def histogramRange(self, values):
+    if self.histogram is not None:
+      hist = self.histogram.count(values)
+      # only the bins of the seed values, the outer edges are the seed values
+      first, last = self.histogram.binIndex([values.min(), values.max()])
+      hist = hist[first : last + 1]
+      bins = np.concatenate(([values.min()], self.histogram.edges[first + 1 : last + 1], [values.max()]))
+      cumulative = np.cumsum(hist) * 1.0 / len(values)
+      heavy = np.flatnonzero(np.logical_and(cumulative > self.tailFraction, cumulative - hist * 1.0 / len(values) < 1.0 - self.tailFraction))
+    else:
+      hist, bins = np.histogram(values, self.bins)
+      heavy = np.flatnonzero(hist * 1.0 / len(values) > self.tailFraction)
+    logging.debug("hist %s", hist)
+    logging.debug("bins %s", bins)
+
+    low, high = int(bins[0]), int(bins[-1])
+    if len(heavy) == 0:
+      return low, high, low, high
+    return int(bins[heavy[0]]), int(bins[heavy[-1]]), low, high
@@ -0,0 +1,175 @@
+﻿# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# Refinement of the grow-cut result, used by SegmentorLogic
+# each labelled slice is replaced by the convex hull of its label, then smoothed
+# by morphological operations (opening and closing)
+#---------------------------------------------------------------------------
+
+import threading
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import cv2
+from SegmentorGrow import shellScale
+
+#---------------------------------------------------------------------------
+#
+# SegmentorRefine, only the slices with label are visited and the images are kept in preallocated uint8
+# buffers, the smoothing can also be done by true 3D morphology on the whole label, the slices are independent
+# and opencv releases the GIL, so they can be refined by a pool of threads, which gives the same result as the
+# serial refinement, the progress is reported to a SegmentorProgress, which can cancel the refinement,
+# the slices are taken along the first axis, or along the thick axis of thick slices (SegmentorGrow.shellScale),
+# with kernels of kernelSize voxels of the smallest spacing
+#
+class SegmentorRefine:
+
+  def __init__(self, kernelSize = 5, morphology3d = False, workers = 1, chunkSize = 8, spacing = None, anisotropy = None):
+    # size of the structuring element of the morphological operations
+    self.kernelSize = kernelSize
+    # the axis of the slices, the thick one of a volume with thick slices (spacing and anisotropy), the first otherwise,
+    # and the radius of the kernels along each axis of the slices (axis of the slices first)
+    scale = None if spacing is None else shellScale(spacing, anisotropy)
+    self.axis = 0 if scale is None else int(np.argmax(scale))
+    if scale is None:
+      self.radii = (kernelSize // 2,) * 3
+      kernelShape = (kernelSize, kernelSize)
+    else:
+      scale = [scale[self.axis]] + [s for a, s in enumerate(scale) if a != self.axis]
+      self.radii = tuple(int(round((kernelSize // 2) / s)) for s in scale)
+      kernelShape = (2 * self.radii[2] + 1, 2 * self.radii[1] + 1)
+    # smooth the label by 3D morphology instead of the morphology of each slice
+    self.morphology3d = morphology3d
+    # number of threads refining the slices, and number of slices given to a thread at once
+    self.workers = max(int(workers), 1)
+    self.chunkSize = max(int(chunkSize), 1)
+    self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, kernelShape)
+    # statistics of the last refinement
+    self.slicesRefined = 0
+
+  #
+  #index of the slices (along the first axis) which have label, by one reduction over the label
+  #
+  def labelledSlices(self, labelData):
+    return np.flatnonzero(labelData.any(axis = (1, 2)))
+
+  #
+  #replace the label of one slice with its convex hull, and smooth it if required,
+  #image and scratch are uint8 buffers of the slice shape
+  #
+  def refineSlice(self, oneslice, image, scratch, smooth):
+    #find the label areas, in (x, y) order of the image
+    points = np.argwhere(oneslice > 0)[:, ::-1].astype(np.int32)
+    #using the label areas(contains many pixels) to generate a convex hull
+    ##(the minimized region that can contain label areas)
+    poly = cv2.convexHull(points)
+
+    #use the convex hull as new label area
+    image.fill(0)
+    cv2.drawContours(image, [poly], -1, 255, -1)
+
+    #morphological operation to smooth the label area
+    if smooth:
+      cv2.morphologyEx(image, cv2.MORPH_OPEN, self.kernel, dst = scratch)
+      cv2.morphologyEx(scratch, cv2.MORPH_CLOSE, self.kernel, dst = image)
+
+    #convert the new label image to original format
+    np.copyto(oneslice, image > 0)
+
+  #
+  #refine the label in place, returns the number of refined slices,
+  #progress (SegmentorProgress, optional) is reported after each slice (each chunk of the threads),
+  #slices restricts the refinement to these slices (an incremental update, along self.axis), the 3D morphology
+  #depends on the neighbour slices, so it always refines all of them
+  #
+  def refine(self, labelData, progress = None, slices = None):
+    # the slices along the first axis of a view
+    labelData = np.moveaxis(labelData, self.axis, 0)
+    dx, dy, dz = labelData.shape
+    if slices is None or self.morphology3d:
+      slices = self.labelledSlices(labelData)
+    smooth = not self.morphology3d
+
+    if self.workers == 1 or len(slices) <= self.chunkSize:
+      image = np.zeros((dy, dz), np.uint8)
+      scratch = np.zeros((dy, dz), np.uint8)
+      for n, i in enumerate(slices):
+        self.refineSlice(labelData[i], image, scratch, smooth)
+        if progress is not None:
+          progress.report('refine', (n + 1.0) / len(slices))
+    else:
+      # each thread keeps its own buffers, and writes its slices directly into the label
+      buffers = threading.local()
+      lock = threading.Lock()
+      done = [0]
+      def refineChunk(chunk):
+        if not hasattr(buffers, 'image'):
+          buffers.image = np.zeros((dy, dz), np.uint8)
+          buffers.scratch = np.zeros((dy, dz), np.uint8)
+        for i in chunk:
+          self.refineSlice(labelData[i], buffers.image, buffers.scratch, smooth)
+        if progress is not None:
+          with lock:
+            done[0] = done[0] + len(chunk)
+            progress.report('refine', done[0] / float(len(slices)))
+
+      chunks = [slices[c : c + self.chunkSize] for c in range(0, len(slices), self.chunkSize)]
+      pool = ThreadPool(self.workers)
+      try:
+        pool.map(refineChunk, chunks)
+      finally:
+        pool.close()
+        pool.join()
+
+    if self.morphology3d and len(slices) > 0:
+      self.smooth3d(labelData, slices[0], slices[-1] + 1)
+
+    self.slicesRefined = len(slices)
+    return self.slicesRefined
+
+  #
+  #offsets of the voxels in a ball shaped 3D structuring element, an ellipsoid of self.radii voxels
+  #
+  def ballOffsets(self):
+    radius = self.kernelSize // 2
+    rx, ry, rz = self.radii
+    ox, oy, oz = np.meshgrid(np.arange(-rx, rx + 1), np.arange(-ry, ry + 1), np.arange(-rz, rz + 1), indexing = 'ij')
+    # the offsets in voxels of the smallest spacing
+    inside = (ox * radius / float(max(rx, 1))) ** 2 + (oy * radius / float(max(ry, 1))) ** 2 + \
+             (oz * radius / float(max(rz, 1))) ** 2 <= radius * radius + 1
+    return np.stack((ox[inside], oy[inside], oz[inside]), axis = 1)
+
+  #
+  #binary erosion (dilate = False) or dilation (dilate = True) of a 3D mask by the ball,
+  #the voxels outside of the mask do not erode it, like the default border of opencv
+  #
+  def morphology(self, mask, offsets, dilate):
+    rx, ry, rz = self.radii
+    padded = np.pad(mask, ((rx, rx), (ry, ry), (rz, rz)), 'constant', constant_values = not dilate)
+    result = np.zeros(mask.shape, bool) if dilate else np.ones(mask.shape, bool)
+    dx, dy, dz = mask.shape
+    for ox, oy, oz in offsets:
+      shifted = padded[rx + ox : rx + ox + dx, ry + oy : ry + oy + dy, rz + oz : rz + oz + dz]
+      if dilate:
+        result |= shifted
+      else:
+        result &= shifted
+    return result
+
+  #
+  #3D opening and closing of the labelled slices [first, last) of the label
+  #
+  def smooth3d(self, labelData, first, last):
+    radius = self.radii[0]
+    dx = labelData.shape[0]
+    # the closing can grow the label up to radius slices out of the labelled slices,
+    # another radius of empty slices makes the erosion at the ends of the stack exact
+    first = max(first - 2 * radius, 0)
+    last = min(last + 2 * radius, dx)
+    mask = labelData[first:last] > 0
+    offsets = self.ballOffsets()
+    mask = self.morphology(self.morphology(mask, offsets, False), offsets, True)
+    mask = self.morphology(self.morphology(mask, offsets, True), offsets, False)
+    np.copyto(labelData[first:last], mask)
@@ -0,0 +1,56 @@
+# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# Compact snapshot of a label, used for the undo of SegmentorLogic
+# only the bounding box of the label and a run-length encoded mask (SegmentorMask) of each
+# label value in the box are kept, so a snapshot of a lesion costs a few bytes per row of
+# the lesion instead of a copy of the whole volume, the snapshot is restored in place
+#---------------------------------------------------------------------------
+
+import numpy as np
+from SegmentorMask import SegmentorMask
+
+#---------------------------------------------------------------------------
+#
+# SegmentorSnapshot
+#
+class SegmentorSnapshot:
+
+  def __init__(self, labelData):
+    self.shape = labelData.shape
+    self.dtype = labelData.dtype
+    self.box = SegmentorMask.fromDense(labelData).boundingBox()
+    # (value, mask in the box) of each label value
+    self.masks = []
+    if self.box is None:
+      return
+    boxData = labelData[self.box]
+    values = np.unique(boxData[boxData != 0])
+    for value in values:
+      self.masks.append((value, SegmentorMask.fromDense(boxData == value if len(values) > 1 else boxData)))
+
+  #
+  #number of labelled voxels
+  #
+  def count(self):
+    return sum(mask.count() for value, mask in self.masks)
+
+  #
+  #bytes used by the snapshot
+  #
+  def nbytes(self):
+    return sum(mask.nbytes() for value, mask in self.masks)
+
+  #
+  #write the snapshot back into labelData (same shape), in place
+  #
+  def restore(self, labelData):
+    if labelData.shape != self.shape:
+      raise ValueError("snapshot of shape %s cannot be restored into %s" % (self.shape, labelData.shape))
+    labelData[...] = 0
+    for value, mask in self.masks:
+      mask.toDense(labelData[self.box], value)
+    return labelData
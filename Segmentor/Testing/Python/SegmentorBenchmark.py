@@ -0,0 +1,361 @@
+﻿# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# Benchmark of the grow-cut and refinement engines, runs outside of 3D slicer:
+#   python SegmentorBenchmark.py --stage grow --size 128 --lesion 40
+#   python SegmentorBenchmark.py --stage refine --size 512 --workers 1,2,4,8,16
+#   python SegmentorBenchmark.py --stage suite --sizes 64,128,256 --json benchmark.json
+#   python SegmentorBenchmark.py --stage retries --size 96 --edge-stop 2
+# each stage times the engines on synthetic phantoms, see benchmarkGrow, benchmarkRefine,
+# benchmarkSuite and benchmarkRetries
+#---------------------------------------------------------------------------
+from __future__ import print_function
+
+import os
+import sys
+import time
+import json
+import platform
+import argparse
+import numpy as np
+
+# the peak allocation of a stage is traced by tracemalloc (python 3), numpy reports its arrays to it
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+try:
+  import resource
+except ImportError:
+  resource = None
+# the model is built by VTK, like the model maker of 3D slicer
+try:
+  import vtk
+  from vtk.util import numpy_support
+except ImportError:
+  vtk = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from SegmentorGrow import SegmentorGrow
+from SegmentorRefine import SegmentorRefine
+from SegmentorCore import SegmentorCore
+
+PHANTOMS = ('sphere', 'ellipsoid', 'leak')
+
+#
+#synthetic volume, a bright lesion in a darker background with gaussian noise,
+#the lesion is a sphere, an ellipsoid, or a sphere leaking along a thin vessel to the border,
+#or a sphere touching an organ slightly darker than it ('weak', a weak edge),
+#with spacing (mm along each axis) the volume and the lesion are scaled by it, size and lesion are in
+#voxels of the smallest spacing
+#
+def makePhantom(size, lesion, noise, seed = 0, phantom = 'sphere', spacing = None):
+  rng = np.random.RandomState(seed)
+  shape, scale = phantomShape(size, spacing)
+  center = tuple(n // 2 for n in shape)
+  radii = (0.6, 1.0, 1.4) if phantom == 'ellipsoid' else (1.0, 1.0, 1.0)
+  volume = np.empty(shape, np.int16)
+  gy, gz = np.ogrid[0:shape[1], 0:shape[2]]
+  gy = (gy - center[1]) * scale[1]
+  gz = (gz - center[2]) * scale[2]
+  # built slice by slice to keep the memory low for the big phantoms
+  for i in range(shape[0]):
+    gi = (i - center[0]) * scale[0]
+    distance = (gi / (radii[0] * lesion)) ** 2 + (gy / (radii[1] * lesion)) ** 2 + (gz / (radii[2] * lesion)) ** 2
+    inside = distance < 1
+    if phantom == 'leak':
+      inside = inside | ((abs(gi) <= 1) & (abs(gy) <= 1) & (gz >= 0))
+    background = 40
+    if phantom == 'weak':
+      background = np.where(gz >= int(lesion * 0.7), 110, 40)
+    volume[i] = np.where(inside, 120, background) + rng.normal(0, noise, shape[1:])
+
+  # a small brush stroke in the middle of the lesion, like the one painted by Marker
+  seeds = np.zeros(volume.shape, np.uint8)
+  stroke = tuple(slice(c - int(round(r / s)), c + int(round(r / s)) + 1) for c, r, s in zip(center, (1, 4, 4), scale))
+  seeds[stroke] = 1
+  return volume, seeds, center
+
+#
+#the shape of a phantom of size voxels along its finest axis, and the scale of its voxels (spacing over the smallest one)
+#
+def phantomShape(size, spacing = None):
+  if spacing is None:
+    return (size, size, size), (1.0, 1.0, 1.0)
+  scale = tuple(float(s) / min(spacing) for s in spacing)
+  return tuple(max(int(round(size / s)), 8) for s in scale), scale
+
+#
+#the lesion of a phantom (without the vessel of 'leak' and the organ of 'weak'), as a boolean volume
+#
+def phantomLesion(size, lesion, phantom = 'sphere', spacing = None):
+  shape, scale = phantomShape(size, spacing)
+  center = tuple(n // 2 for n in shape)
+  radii = (0.6, 1.0, 1.4) if phantom == 'ellipsoid' else (1.0, 1.0, 1.0)
+  i, gy, gz = np.ogrid[0:shape[0], 0:shape[1], 0:shape[2]]
+  return ((i - center[0]) * scale[0] / (radii[0] * lesion)) ** 2 + ((gy - center[1]) * scale[1] / (radii[1] * lesion)) ** 2 + \
+         ((gz - center[2]) * scale[2] / (radii[2] * lesion)) ** 2 < 1
+
+def dice(label, lesion):
+  label = label > 0
+  return 2.0 * np.count_nonzero(label & lesion) / max(np.count_nonzero(label) + np.count_nonzero(lesion), 1)
+
+#
+#grow the phantom with one of the engines, returns the mask, the elapsed time and visited voxels
+#
+def timeGrowCut(volume, seeds, seed, engine, loop):
+  mask = seeds.copy()
+  start = time.time()
+  if loop:
+    engine.growCutLoop(volume, mask, seed, 100, 140)
+  else:
+    engine.growCut(volume, mask, seed, 100, 140)
+  return mask, time.time() - start, engine.voxelsVisited
+
+#
+#synthetic grow-cut result, an ellipsoid lesion with ragged border and a few leaked voxels
+#
+def makeLesionLabel(size, lesion, seed = 0):
+  rng = np.random.RandomState(seed)
+  center = size // 2
+  label = np.zeros((size, size, size), np.int16)
+  for i in range(size):
+    # built slice by slice to keep the memory low for the big phantoms
+    gy, gz = np.ogrid[0:size, 0:size]
+    distance = ((i - center) / float(lesion)) ** 2 + ((gy - center) / (0.8 * lesion)) ** 2 + ((gz - center) / (1.2 * lesion)) ** 2
+    inside = distance < 1 + rng.normal(0, 0.05, (size, size))
+    inside |= rng.rand(size, size) > 0.9999
+    label[i] = inside
+  return label
+
+#
+#a synthetic spherical lesion is grown by the vectorized engine and by the original per-voxel loop,
+#the throughput (visited shell voxels per second) is reported and the two masks are checked to be identical
+#
+def benchmarkGrow(args):
+  size = args.size or 96
+  lesion = args.lesion or 30
+  volume, seeds, seed = makePhantom(size, lesion, args.noise)
+  engine = SegmentorGrow(args.compensate)
+  print('phantom %d^3, lesion radius %d, noise %.1f' % (size, lesion, args.noise))
+
+  mask, elapsed, visited = timeGrowCut(volume, seeds, seed, engine, False)
+  print('vectorized: %8.3f s  %12.0f voxels/s  (%d grown voxels)' % (elapsed, visited / elapsed, (mask > 0).sum()))
+
+  if not args.skip_loop:
+    loop_mask, loop_elapsed, loop_visited = timeGrowCut(volume, seeds, seed, engine, True)
+    print('loop:       %8.3f s  %12.0f voxels/s  (%d grown voxels)' % (loop_elapsed, loop_visited / loop_elapsed, (loop_mask > 0).sum()))
+    print('speedup:    %8.1fx, identical masks: %s' % (loop_elapsed / elapsed, (loop_mask == mask).all()))
+
+#
+#a synthetic lesion label is refined by 1, 2, 4... threads, the time and speedup over the serial
+#refinement are reported and the results checked to be identical
+#
+def benchmarkRefine(args):
+  size = args.size or 512
+  lesion = args.lesion or size * 2 // 5
+  label = makeLesionLabel(size, lesion)
+  print('lesion label %d^3, lesion radius %d, chunk size %d' % (size, lesion, args.chunk))
+
+  # the serial refinement is the reference of the threaded ones
+  serial = label.copy()
+  start = time.time()
+  SegmentorRefine().refine(serial)
+  serial_elapsed = time.time() - start
+
+  for workers in [int(w) for w in args.workers.split(',')]:
+    refined = label.copy()
+    refine = SegmentorRefine(workers = workers, chunkSize = args.chunk)
+    start = time.time()
+    refine.refine(refined)
+    elapsed = time.time() - start
+    print('%2d workers: %8.3f s  %8.1f slices/s  speedup %5.2fx  identical: %s' % \
+          (workers, elapsed, refine.slicesRefined / elapsed, serial_elapsed / elapsed, (refined == serial).all()))
+
+#
+#run one stage, returns its result, elapsed time and peak allocation (bytes, None if not traced),
+#tracing the allocations slows the stage down
+#
+def timeStage(trace, function, *args):
+  trace = trace and tracemalloc is not None
+  if trace:
+    tracemalloc.start()
+  start = time.time()
+  result = function(*args)
+  elapsed = time.time() - start
+  peak = None
+  if trace:
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+  return result, elapsed, peak
+
+#
+#surface model of a label, with the filters and parameters used by SegmentorLogic.makeModel
+#
+def buildModel(labelData, smoothValue = 10):
+  image = vtk.vtkImageData()
+  dx, dy, dz = labelData.shape
+  image.SetDimensions(dz, dy, dx)
+  scalars = numpy_support.numpy_to_vtk(np.ascontiguousarray(labelData, np.uint8).ravel(), deep = True)
+  image.GetPointData().SetScalars(scalars)
+
+  cubes = vtk.vtkDiscreteMarchingCubes()
+  cubes.SetInputData(image)
+  cubes.SetValue(0, 1)
+  smoother = vtk.vtkWindowedSincPolyDataFilter()
+  smoother.SetInputConnection(cubes.GetOutputPort())
+  smoother.SetNumberOfIterations(smoothValue)
+  decimator = vtk.vtkDecimatePro()
+  decimator.SetInputConnection(smoother.GetOutputPort())
+  decimator.SetTargetReduction(0.25)
+  decimator.Update()
+  return decimator.GetOutput().GetNumberOfPoints()
+
+def stageRecord(voxels, elapsed, peak):
+  return {'seconds': elapsed, 'voxels': int(voxels), 'voxelsPerSecond': voxels / max(elapsed, 1e-9), 'peakBytes': peak}
+
+#
+#segment one phantom by SegmentorCore, stage by stage
+#
+def benchmarkCase(phantom, size, lesion, args):
+  spacing = [float(s) for s in args.spacing.split(',')] if args.spacing else None
+  volume, seeds, seed = makePhantom(size, lesion, args.noise, phantom = phantom, spacing = spacing)
+  core = SegmentorCore(args.compensate, seedFront = args.seed_front, pyramidLevels = args.pyramid, anisotropy = args.anisotropy or None)
+  # the stages are run one by one, without segment()
+  core.spacing = tuple(spacing or (1.0, 1.0, 1.0))
+  record = {'phantom': phantom, 'size': size, 'lesion': lesion, 'noise': args.noise, 'seedFront': args.seed_front,
+            'pyramidLevels': args.pyramid, 'spacing': list(core.spacing), 'anisotropy': args.anisotropy, 'stages': {}}
+  stages = record['stages']
+
+  seed, seedingROI_coords, seedingROI_values = core.seedPoint(volume, seeds)
+  growRange, elapsed, peak = timeStage(args.trace, core.GetGrowRange, seedingROI_values)
+  stages['GetGrowRange'] = stageRecord(seedingROI_values.size, elapsed, peak)
+  record['growRange'] = [int(v) for v in growRange]
+
+  windowROIData, elapsed, peak = timeStage(args.trace, core.growWindow, volume, seeds)
+  stages['growCut'] = stageRecord(windowROIData.size, elapsed, peak)
+  stages['growCut']['visitedVoxels'] = int(core.grow.voxelsVisited)
+  stages['growCut']['iterations'] = int(core.grow.iterations)
+  stages['growCut']['iterationsSaved'] = int(core.grow.iterationsSaved)
+  record['window'] = [list(core.window.lower), list(core.window.upper)]
+  grown = np.zeros(volume.shape, bool)
+  grown[core.window.slices()] = windowROIData > 0
+  truth = phantomLesion(size, lesion, phantom, spacing)
+  record['growDice'] = dice(grown, truth)
+
+  refine = core.refineEngine()
+  refined, elapsed, peak = timeStage(args.trace, refine.refine, windowROIData)
+  stages['refine'] = stageRecord(windowROIData.size, elapsed, peak)
+  stages['refine']['slices'] = int(refined)
+  record['labelVoxels'] = int(np.count_nonzero(windowROIData))
+  grown[core.window.slices()] = windowROIData > 0
+  record['dice'] = dice(grown, truth)
+
+  if vtk is not None:
+    points, elapsed, peak = timeStage(args.trace, buildModel, windowROIData)
+    stages['makeModel'] = stageRecord(windowROIData.size, elapsed, peak)
+    stages['makeModel']['points'] = int(points)
+  return record
+
+#
+#phantoms (sphere, ellipsoid, a lesion leaking along a vessel) of several sizes are segmented by SegmentorCore,
+#the time, voxels/second and peak allocation of each stage and the dice with the lesion are written as JSON,
+#to compare the releases, with --spacing (e.g. 5,0.7,0.7) the phantoms are round in mm, --anisotropy tells
+#the thick slices (SegmentorGrow.shellScale), the phantoms are built slice by slice, 1024^3 needs about 4 GB
+#
+def benchmarkSuite(args):
+  sizes = [int(s) for s in args.sizes.split(',')]
+  phantoms = args.phantoms.split(',')
+  result = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'vtk': vtk.vtkVersion.GetVTKVersion() if vtk is not None else None, 'cases': []}
+  for size in sizes:
+    for phantom in phantoms:
+      lesion = args.lesion or size * 3 // 10
+      record = benchmarkCase(phantom, size, lesion, args)
+      result['cases'].append(record)
+      print('%-9s %5d^3 ' % (phantom, size) + '  '.join('%s %.3f s (%.0f voxels/s)' % \
+            (name, stage['seconds'], stage['voxelsPerSecond']) for name, stage in sorted(record['stages'].items())) + \
+            '  visited %d, dice %.3f (refined %.3f)' % (record['stages']['growCut']['visitedVoxels'], record['growDice'], record['dice']))
+  if resource is not None:
+    # the peak resident memory of the whole run, in bytes (ru_maxrss is in KB on linux)
+    result['maxResidentBytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(result, f, indent = 2, sort_keys = True)
+    print('results written to %s' % args.json)
+  return result
+
+#
+#segment the phantoms (and a lesion touching a slightly darker organ, 'weak') with the compensate
+#intensities a user would try one after the other (--compensates) until the dice of the label with the
+#lesion reaches --dice, without and with the edge stop
+#
+def benchmarkRetries(args):
+  size = args.size or 96
+  lesion = args.lesion or size * 3 // 10
+  compensates = [float(c) for c in args.compensates.split(',')]
+  modes = [('range', None), ('edges', args.edge_stop)]
+  print('phantom %d^3, lesion radius %d, noise %.1f, dice >= %.2f, compensate %s' % (size, lesion, args.noise, args.dice, args.compensates))
+  total = dict((mode, 0) for mode, edgeStop in modes)
+  for phantom in PHANTOMS + ('weak',):
+    volume, seeds, seed = makePhantom(size, lesion, args.noise, phantom = phantom)
+    truth = phantomLesion(size, lesion, phantom)
+    line = '%-9s' % phantom
+    for mode, edgeStop in modes:
+      runs = None
+      scores = []
+      start = time.time()
+      for n, compensate in enumerate(compensates):
+        core = SegmentorCore(compensate, seedFront = args.seed_front, edgeStop = edgeStop)
+        scores.append(dice(core.segment(volume, seeds), truth))
+        if scores[-1] >= args.dice:
+          runs = n + 1
+          break
+      # a lesion never found costs all the runs
+      total[mode] = total[mode] + (runs or len(compensates))
+      line = line + '  %s: %s runs, dice %s (%.2f s)' % (mode, runs or 'failed after %d' % len(compensates), \
+                                                         ','.join('%.3f' % s for s in scores), time.time() - start)
+    print(line)
+  print('total runs: ' + ', '.join('%s %d' % (mode, total[mode]) for mode, edgeStop in modes))
+  return total
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description = 'Benchmark of the OneClickCut grow-cut and refinement engines.')
+  parser.add_argument('--stage', choices = ['grow', 'refine', 'suite', 'retries'], default = 'grow',
+                      help = 'the engine to benchmark, the whole suite, or the runs needed to segment the lesions')
+  parser.add_argument('--size', type = int, default = None, help = 'edge length of the cubic phantom volume (grow: 96, refine: 512)')
+  parser.add_argument('--lesion', type = int, default = None, help = 'radius of the lesion in voxels (grow: 30, refine: 2/5 of the size)')
+  parser.add_argument('--noise', type = float, default = 3.0, help = 'standard deviation of the gaussian noise')
+  parser.add_argument('--compensate', type = float, default = 11, help = 'compensate intensity of the grow-cut')
+  parser.add_argument('--skip-loop', action = 'store_true', help = 'do not run the (slow) per-voxel loop')
+  parser.add_argument('--workers', default = '1,2,4,8,16', help = 'comma separated numbers of refinement threads')
+  parser.add_argument('--chunk', type = int, default = 8, help = 'number of slices given to a refinement thread at once')
+  parser.add_argument('--sizes', default = '64,128,256', help = 'suite: comma separated phantom sizes (up to 1024)')
+  parser.add_argument('--phantoms', default = ','.join(PHANTOMS), help = 'suite: comma separated phantoms (%s)' % ', '.join(PHANTOMS))
+  parser.add_argument('--seed-front', action = 'store_true', help = 'suite: grow from the front of all the seeds instead of the shells')
+  parser.add_argument('--pyramid', type = int, default = 0, help = 'suite: levels of the coarse-to-fine growth (0: full resolution only)')
+  parser.add_argument('--spacing', default = None, help = 'suite: comma separated spacing (mm) of the phantoms along the axes of the arrays')
+  parser.add_argument('--anisotropy', type = float, default = 3.0,
+                      help = 'suite: the growth and the refinement are scaled by the spacing above this ratio of its largest and smallest values (0: never)')
+  parser.add_argument('--edge-stop', type = float, default = 2.0, help = 'retries: gradient of the edges, times the gradient of the seeds')
+  parser.add_argument('--compensates', default = '11,8,14,5,17,3,20,25,30', help = 'retries: compensate intensities tried in turn')
+  parser.add_argument('--dice', type = float, default = 0.9, help = 'retries: dice of a lesion segmented successfully')
+  parser.add_argument('--json', default = None, help = 'suite: file of the JSON results')
+  parser.add_argument('--no-trace', dest = 'trace', action = 'store_false',
+                      help = 'suite: do not trace the peak allocation of the stages (tracing slows them down)')
+  args = parser.parse_args(argv)
+
+  if args.stage == 'grow':
+    benchmarkGrow(args)
+  elif args.stage == 'refine':
+    benchmarkRefine(args)
+  elif args.stage == 'retries':
+    benchmarkRetries(args)
+  else:
+    benchmarkSuite(args)
+
+if __name__ == '__main__':
+  main()
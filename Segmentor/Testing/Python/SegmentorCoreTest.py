@@ -0,0 +1,174 @@
+# Project - One Click Cut  - "To segment 3D ROI, like tumor, leison from given 3D volume"
+# Author: Guoqing Bao
+# Supervisor: Sidong Liu; Weidong Cai;
+# The University of Sydney
+# 2017-05-08
+#---------------------------------------------------------------------------
+# Unit tests of the segmentation core, outside of 3D slicer, on the phantoms of SegmentorBenchmark:
+#   python -m unittest SegmentorCoreTest
+#---------------------------------------------------------------------------
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from SegmentorGrow import SegmentorGrow
+from SegmentorCore import SegmentorCore
+from SegmentorRange import SegmentorRange
+from SegmentorMask import SegmentorMask
+from SegmentorSnapshot import SegmentorSnapshot
+from SegmentorBenchmark import makePhantom, phantomLesion, dice
+
+#
+#two lesions in separate slices (the refinement keeps one region per slice), and a stroke in each of them
+#
+def makeTwoLesions(noise = 5.0, seed = 1):
+  rng = np.random.RandomState(seed)
+  shape = (44, 40, 40)
+  k, j, i = np.ogrid[0:shape[0], 0:shape[1], 0:shape[2]]
+  first = (k - 11) ** 2 + (j - 20) ** 2 + (i - 20) ** 2 < 64
+  second = (k - 32) ** 2 + (j - 20) ** 2 + (i - 20) ** 2 < 64
+  volume = (np.where(first | second, 120, 40) + rng.normal(0, noise, shape)).astype(np.int16)
+  firstStroke = np.zeros(shape, np.uint8)
+  firstStroke[10:13, 18:23, 18:23] = 1
+  bothStrokes = firstStroke.copy()
+  bothStrokes[31:34, 18:23, 18:23] = 1
+  return volume, firstStroke, bothStrokes, first | second
+
+#---------------------------------------------------------------------------
+#
+# SegmentorCoreTest
+#
+class SegmentorCoreTest(unittest.TestCase):
+
+  #
+  #the whole segmentation of the phantoms finds their lesion
+  #
+  def test_segmentPhantoms(self):
+    for phantom in ('sphere', 'ellipsoid'):
+      for seedFront in (False, True):
+        volume, seeds, center = makePhantom(48, 12, 5.0, phantom = phantom)
+        core = SegmentorCore(seedFront = seedFront)
+        label = core.segment(volume, seeds)
+        self.assertEqual(label.shape, volume.shape)
+        self.assertGreater(dice(label, phantomLesion(48, 12, phantom)), 0.97)
+        # nothing is written out of the working window
+        outside = np.ones(volume.shape, bool)
+        outside[core.window.slices()] = False
+        self.assertFalse(label[outside].any())
+        self.assertEqual(core.profile.info['labels'], [1])
+
+  #
+  #the vectorized grow-cut gives the same label as the original per-voxel loop
+  #
+  def test_growCutMatchesLoop(self):
+    for phantom in ('sphere', 'leak'):
+      volume, seeds, center = makePhantom(32, 9, 5.0, phantom = phantom)
+      engine = SegmentorGrow(11)
+      vectorized = seeds.copy()
+      engine.growCut(volume, vectorized, center, 100, 140)
+      loop = seeds.copy()
+      engine.growCutLoop(volume, loop, center, 100, 140)
+      self.assertTrue((vectorized == loop).all())
+      self.assertGreater(np.count_nonzero(vectorized), np.count_nonzero(seeds))
+
+  #
+  #the invalid inputs raise ValueError
+  #
+  def test_valueErrors(self):
+    volume, seeds, center = makePhantom(16, 4, 5.0)
+    core = SegmentorCore()
+    self.assertRaises(ValueError, core.segment, volume, seeds[1:])
+    self.assertRaises(ValueError, core.segment, volume, np.zeros(volume.shape, np.uint8))
+    self.assertRaises(ValueError, SegmentorRange().growRange, [])
+    self.assertRaises(ValueError, SegmentorRange(method = 'median').growRange, [100, 110])
+    mask = SegmentorMask.fromDense(seeds)
+    self.assertRaises(ValueError, mask.toDense, np.zeros((4, 4, 4), np.uint8))
+    self.assertRaises(ValueError, mask.union, SegmentorMask((4, 4, 4)))
+    self.assertRaises(ValueError, SegmentorSnapshot(seeds).restore, np.zeros((4, 4, 4), np.uint8))
+
+  #
+  #the shells of thick slices reach the ends of a structure elongated across the slices, although the seed
+  #is closer to an in-plane face of the image than the ends are in millimetres
+  #
+  def test_thickSlicesElongated(self):
+    rng = np.random.RandomState(0)
+    shape = (40, 100, 120)
+    k, j, i = np.ogrid[0:shape[0], 0:shape[1], 0:shape[2]]
+    cylinder = np.logical_and(np.logical_and(k >= 5, k < 35), (j - 40) ** 2 + (i - 60) ** 2 < 100)
+    volume = (np.where(cylinder, 120, 40) + rng.normal(0, 5, shape)).astype(np.int16)
+    seeds = np.zeros(shape, np.uint8)
+    seeds[19:21, 39:42, 59:62] = 1
+    for multiLabel in (False, True):
+      label = SegmentorCore(multiLabel = multiLabel).segment(volume, seeds, spacing = (5.0, 0.8, 0.8))
+      slices = np.flatnonzero(label.any(axis = (1, 2)))
+      self.assertEqual((slices[0], slices[-1]), (5, 34))
+      self.assertGreater(dice(label, cylinder), 0.97)
+
+  #
+  #a label survives the run-length encoding, its file and a snapshot unchanged
+  #
+  def test_maskSnapshotRoundTrip(self):
+    rng = np.random.RandomState(0)
+    label = np.zeros((12, 20, 24), np.uint8)
+    label[2:9, 3:15, 5:20] = (rng.rand(7, 12, 15) > 0.4) * rng.randint(1, 4, (7, 12, 15))
+    mask = SegmentorMask.fromDense(label)
+    self.assertEqual(mask.count(), np.count_nonzero(label))
+    self.assertTrue((mask.toDense() == (label > 0)).all())
+    self.assertEqual(mask.boundingBox(), SegmentorSnapshot(label).box)
+    coords = np.nonzero(np.ones(label.shape))
+    self.assertTrue((mask.contains(coords) == (label > 0).ravel()).all())
+    self.assertTrue((mask.union(SegmentorMask.fromDense(label == 2)).toDense() == (label > 0)).all())
+    self.assertEqual(SegmentorMask.fromDense(np.zeros(label.shape, np.uint8)).boundingBox(), None)
+
+    directory = tempfile.mkdtemp()
+    try:
+      path = os.path.join(directory, 'mask.npz')
+      mask.save(path)
+      self.assertTrue((SegmentorMask.load(path).toDense() == (label > 0)).all())
+    finally:
+      shutil.rmtree(directory)
+
+    snapshot = SegmentorSnapshot(label)
+    self.assertEqual(snapshot.count(), np.count_nonzero(label))
+    restored = np.full(label.shape, 7, np.uint8)
+    self.assertTrue((snapshot.restore(restored) == label).all())
+
+  #
+  #the labels of a multi-label segmentation grown from their fronts are the labels of separate segmentations
+  #
+  def test_multiLabelSeedFront(self):
+    volume, firstStroke, bothStrokes, lesions = makeTwoLesions()
+    seeds = bothStrokes + (bothStrokes > firstStroke)
+    for seedFront in (False, True):
+      label = SegmentorCore(multiLabel = True, seedFront = seedFront).segment(volume, seeds)
+      for value in (1, 2):
+        single = SegmentorCore(seedFront = seedFront).segment(volume, (seeds == value).astype(np.uint8))
+        self.assertGreater(dice(label == value, single > 0), 0.99)
+
+  #
+  #an incremental update with a stroke in another lesion gives the label of a whole segmentation of both strokes
+  #
+  def test_updateMatchesSegment(self):
+    volume, firstStroke, bothStrokes, lesions = makeTwoLesions()
+    core = SegmentorCore(incremental = True, seedFront = True)
+    label = core.update(volume, firstStroke)
+    self.assertFalse(core.profile.info['incremental'])
+    core.update(volume, bothStrokes, outputROIData = label)
+    self.assertTrue(core.profile.info['incremental'])
+    full = SegmentorCore(seedFront = True).segment(volume, bothStrokes)
+    self.assertGreater(dice(label, full > 0), 0.995)
+    self.assertGreater(dice(label, lesions), 0.98)
+
+    # no new seed, the label is unchanged
+    before = label.copy()
+    core.update(volume, bothStrokes, outputROIData = label)
+    self.assertTrue((label == before).all())
+
+if __name__ == '__main__':
+  unittest.main()